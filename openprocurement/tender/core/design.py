@@ -1,5 +1,11 @@
 # -*- coding: utf-8 -*-
+from hashlib import md5
+from itertools import islice
+from json import dumps
+from time import time
+from couchdb.client import Row
 from couchdb.design import ViewDefinition
+from couchdb.http import ResourceConflict, ResourceNotFound
 from openprocurement.api import design
 
 
@@ -29,11 +35,12 @@ FIELDS = [
 CHANGES_FIELDS = FIELDS + [
     'dateModified',
 ]
+DEFAULT_FIELDS = list(FIELDS)
 
 
 def add_design():
     for i, j in globals().items():
-        if "_view" in i:
+        if "_view" in i and isinstance(j, ViewDefinition):
             setattr(design, i, j)
 
 
@@ -45,43 +52,95 @@ tenders_all_view = ViewDefinition('tenders', 'all', '''function(doc) {
 }''')
 
 
-tenders_by_dateModified_view = ViewDefinition('tenders', 'by_dateModified', '''function(doc) {
-    if(doc.doc_type == 'Tender' && doc.status != 'draft') {
-        var fields=%s, data={};
-        for (var i in fields) {
-            if (doc[fields[i]]) {
-                data[fields[i]] = doc[fields[i]]
-            }
-        }
-        emit(doc.dateModified, data);
-    }
-}''' % FIELDS)
+def merge_sorted(iterables, key, reverse=False):
+    """ Lazily merges iterables sorted by ``key`` into one sorted iterator. """
+    heads = []
+    for iterable in iterables:
+        iterator = iter(iterable)
+        for item in iterator:
+            heads.append([item, iterator])
+            break
+    pick = max if reverse else min
+    while heads:
+        head = pick(heads, key=lambda i: key(i[0]))
+        yield head[0]
+        for item in head[1]:
+            head[0] = item
+            break
+        else:
+            heads.remove(head)
 
-tenders_real_by_dateModified_view = ViewDefinition('tenders', 'real_by_dateModified', '''function(doc) {
-    if(doc.doc_type == 'Tender' && doc.status != 'draft' && !doc.mode) {
-        var fields=%s, data={};
-        for (var i in fields) {
-            if (doc[fields[i]]) {
-                data[fields[i]] = doc[fields[i]]
-            }
-        }
-        emit(doc.dateModified, data);
-    }
-}''' % FIELDS)
 
-tenders_test_by_dateModified_view = ViewDefinition('tenders', 'test_by_dateModified', '''function(doc) {
-    if(doc.doc_type == 'Tender' && doc.status != 'draft' && doc.mode == 'test') {
-        var fields=%s, data={};
-        for (var i in fields) {
-            if (doc[fields[i]]) {
-                data[fields[i]] = doc[fields[i]]
-            }
-        }
-        emit(doc.dateModified, data);
-    }
-}''' % FIELDS)
+class ListingView(object):
+    """ One mode of a listing feed queried from a view keyed by [feed, mode, sort key].
+
+    Called the same way as a ``ViewDefinition``, ``startkey`` and ``endkey``
+    are sort keys and rows are keyed by them. The ``_all_`` mode merges rows
+    of all modes. Views of listing documents emit the tender ``_id`` in row
+    values, it becomes the row id. Rows are yielded while the view is read
+    ``batch_size`` rows at a time, so pages are never held in memory.
+    """
+    modes = (u'', u'test')
+    batch_size = 100
+
+    def __init__(self, view, feed, mode, projection=False):
+        self.view = view
+        self.feed = feed
+        self.mode = mode
+        self.projection = projection
+
+    def get_design(self, db):
+        """ Name of the design document queried. """
+        get_design = getattr(self.view, 'get_design', None)
+        return get_design(db) if get_design else self.view.design
 
-tenders_by_local_seq_view = ViewDefinition('tenders', 'by_local_seq', '''function(doc) {
+    def make_row(self, row):
+        value = row.value
+        row_id = row.id
+        if self.projection:
+            value = dict(value)
+            row_id = value.pop('_id')
+        listing_row = Row(id=row_id, key=row.key[-1], value=value)
+        if 'doc' in row:
+            listing_row['doc'] = row['doc']
+        return listing_row
+
+    def iter_view(self, db, options):
+        """ Rows of the view, the next batch continues after the last row of the previous one. """
+        limit = options.pop('limit', None)
+        while limit is None or limit > 0:
+            size = self.batch_size if limit is None else min(self.batch_size, limit)
+            rows = list(self.view(db, limit=size, **options))
+            for row in rows:
+                yield row
+            if len(rows) < size:
+                return
+            if limit is not None:
+                limit -= size
+            options.update({'startkey': rows[-1].key, 'startkey_docid': rows[-1].id, 'skip': 1})
+
+    def query(self, db, mode, options):
+        prefix = [self.feed, mode]
+        options = dict(options)
+        lowest, highest = prefix, prefix + [{}]
+        if options.get('descending'):
+            lowest, highest = highest, lowest
+        options['startkey'] = prefix + [options['startkey']] if 'startkey' in options else lowest
+        options['endkey'] = prefix + [options['endkey']] if 'endkey' in options else highest
+        return (self.make_row(row) for row in self.iter_view(db, options))
+
+    def __call__(self, db, **options):
+        if self.mode != u'_all_':
+            return self.query(db, self.mode, options)
+        rows = merge_sorted(
+            [self.query(db, mode, options) for mode in self.modes],
+            key=lambda row: (row.key, row.id),
+            reverse=bool(options.get('descending'))
+        )
+        return islice(rows, options['limit']) if 'limit' in options else rows
+
+
+LISTING_VIEW_TEMPLATE = '''function(doc) {
     if(doc.doc_type == 'Tender' && doc.status != 'draft') {
         var fields=%s, data={};
         for (var i in fields) {
@@ -89,30 +148,150 @@ tenders_by_local_seq_view = ViewDefinition('tenders', 'by_local_seq', '''functio
                 data[fields[i]] = doc[fields[i]]
             }
         }
-        emit(doc._local_seq, data);
+        emit(['dateModified', doc.mode || '', doc.dateModified], data);
+        emit(['changes', doc.mode || '', doc._local_seq], data);
     }
-}''' % CHANGES_FIELDS)
+}'''
 
-tenders_real_by_local_seq_view = ViewDefinition('tenders', 'real_by_local_seq', '''function(doc) {
-    if(doc.doc_type == 'Tender' && doc.status != 'draft' && !doc.mode) {
-        var fields=%s, data={};
-        for (var i in fields) {
-            if (doc[fields[i]]) {
-                data[fields[i]] = doc[fields[i]]
-            }
-        }
-        emit(doc._local_seq, data);
+
+def get_listing_version(fields):
+    """ Version of the listing view for the fields, None for the default ones. """
+    if list(fields) == DEFAULT_FIELDS:
+        return
+    return md5(dumps(list(fields))).hexdigest()[:8]
+
+
+def make_listing_view(fields, version=None):
+    design_name = 'listing_{}'.format(version) if version else 'tenders'
+    return ViewDefinition(design_name, 'listing', LISTING_VIEW_TEMPLATE % (list(fields) + ['dateModified']))
+
+
+class ListingDesign(object):
+    """ Versions of the tenders listing view for the configured fields.
+
+    Views for fields other than the default ones get ``listing_<version>``
+    design documents. While a new version is being indexed, listings are
+    served by the previous one (recorded in a local document) and the index
+    is checked every ``check_interval`` seconds, it is ready once it reaches
+    the database update sequence of the first check. Called the same way as
+    the ``ViewDefinition`` in use.
+    """
+    marker_id = '_local/tenders_listing'
+    check_interval = 60
+
+    def __init__(self, fields):
+        self.configure(fields)
+
+    def configure(self, fields):
+        self.fields = list(fields)
+        self.version = get_listing_version(self.fields)
+        self.view = make_listing_view(self.fields, self.version)
+        self.active = None
+        self.checked = 0
+        self.target_seq = None
+
+    def is_indexed(self, db):
+        seq = lambda value: int(str(value).split('-')[0])
+        # a continuously written database is never caught up with, the index
+        # has to reach the sequence of the time indexing was triggered
+        if self.target_seq is None:
+            self.target_seq = seq(db.info()['update_seq'])
+        # a query with stale=update_after starts indexing and does not wait for it
+        self.view(db, limit=1, stale='update_after').rows
+        index = db.info(self.view.design)['view_index']
+        return seq(index['update_seq']) >= self.target_seq
+
+    def retire(self, db, version):
+        """ Removes the view of the previous version unless another worker did. """
+        try:
+            if version:
+                doc = db.get('_design/listing_{}'.format(version))
+                if doc:
+                    db.delete(doc)
+            else:
+                doc = db.get('_design/tenders')
+                if doc and 'listing' in doc.get('views', {}):
+                    del doc['views']['listing']
+                    db.save(doc)
+        except (ResourceConflict, ResourceNotFound):
+            return
+        db.cleanup()
+
+    def load_active(self, db):
+        marker = db.get(self.marker_id) or {'_id': self.marker_id, 'version': None, 'fields': DEFAULT_FIELDS}
+        if marker['version'] != self.version:
+            if not self.is_indexed(db):
+                return marker['version'], marker['fields'], make_listing_view(marker['fields'], marker['version'])
+            previous = marker['version']
+            marker.update({'version': self.version, 'fields': self.fields})
+            try:
+                db.save(marker)
+            except ResourceConflict:
+                # switched by another worker at the same time
+                marker = db.get(self.marker_id)
+                if marker['version'] != self.version:
+                    return marker['version'], marker['fields'], make_listing_view(marker['fields'], marker['version'])
+                return self.version, self.fields, self.view
+            self.retire(db, previous)
+        return self.version, self.fields, self.view
+
+    def get_active(self, db):
+        """ (version, fields, view) to serve listings from. """
+        if self.active is None or self.active[0] != self.version and time() - self.checked > self.check_interval:
+            self.checked = time()
+            self.active = self.load_active(db)
+        return self.active
+
+    def get_fields(self, db):
+        return self.get_active(db)[1]
+
+    def get_design(self, db):
+        return self.get_active(db)[2].design
+
+    def __call__(self, db, **options):
+        # view results are lazy, rows are read here to catch a missing view
+        try:
+            return list(self.get_active(db)[2](db, **options))
+        except ResourceNotFound:
+            # the version was retired by another worker
+            self.active = None
+            return list(self.get_active(db)[2](db, **options))
+
+
+LISTING_DESIGN = ListingDesign(FIELDS)
+tenders_listing_view = LISTING_DESIGN.view
+
+
+def configure_listing(fields):
+    """ Sets the fields of listing rows, called before ``add_design``. """
+    global tenders_listing_view
+    FIELDS[:] = fields
+    CHANGES_FIELDS[:] = FIELDS + ['dateModified']
+    LISTING_DESIGN.configure(FIELDS)
+    tenders_listing_view = LISTING_DESIGN.view
+
+tenders_by_dateModified_view = ListingView(LISTING_DESIGN, u'dateModified', u'_all_')
+tenders_real_by_dateModified_view = ListingView(LISTING_DESIGN, u'dateModified', u'')
+tenders_test_by_dateModified_view = ListingView(LISTING_DESIGN, u'dateModified', u'test')
+tenders_by_local_seq_view = ListingView(LISTING_DESIGN, u'changes', u'_all_')
+tenders_real_by_local_seq_view = ListingView(LISTING_DESIGN, u'changes', u'')
+tenders_test_by_local_seq_view = ListingView(LISTING_DESIGN, u'changes', u'test')
+
+# view of compact TenderListing documents, see utils.ListingProjections
+# changes are keyed by the update sequence of the listing document, it is
+# written right after its tender, so offsets of both views are comparable
+tenders_listing_projections_view = ViewDefinition('listing', 'listing', '''function(doc) {
+    if(doc.doc_type == 'TenderListing' && doc.status != 'draft') {
+        var data = doc.data;
+        data._id = doc.tender_id;
+        emit(['dateModified', doc.mode || '', doc.dateModified], data);
+        emit(['changes', doc.mode || '', doc._local_seq], data);
     }
-}''' % CHANGES_FIELDS)
+}''')
 
-tenders_test_by_local_seq_view = ViewDefinition('tenders', 'test_by_local_seq', '''function(doc) {
-    if(doc.doc_type == 'Tender' && doc.status != 'draft' && doc.mode == 'test') {
-        var fields=%s, data={};
-        for (var i in fields) {
-            if (doc[fields[i]]) {
-                data[fields[i]] = doc[fields[i]]
-            }
-        }
-        emit(doc._local_seq, data);
+# view of TenderNextCheck documents, see utils.NextCheckIndex
+tenders_next_check_view = ViewDefinition('next_check', 'next_check', '''function(doc) {
+    if(doc.doc_type == 'TenderNextCheck') {
+        emit([doc.next_check, doc.tender_id], doc.mode || '');
     }
-}''' % CHANGES_FIELDS)
+}''')
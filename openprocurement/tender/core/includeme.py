@@ -1,18 +1,26 @@
+from atexit import register
 from pkg_resources import iter_entry_points
 from pyramid.interfaces import IRequest
+from pyramid.settings import asbool
 from openprocurement.tender.core.utils import (
     extract_tender, isTender, register_tender_procurementMethodType,
-    tender_from_data, SubscribersPicker
+    tender_from_data, SubscribersPicker, TENDER_ID_ALLOCATOR, REVISIONS_STORAGE,
+    LISTING_PROJECTIONS, SERIALIZATION_CACHE, NEXT_CHECK_INDEX
 )
 from openprocurement.api.interfaces import IContentConfigurator
 from openprocurement.tender.core.models import ITender
 from openprocurement.tender.core.adapters import TenderConfigurator
+from openprocurement.tender.core.traversal import RESOURCES, AuthorizationPolicy, add_tender_resource
 
 
 def includeme(config):
-    from openprocurement.tender.core.design import add_design
+    from openprocurement.tender.core.design import add_design, configure_listing
+    settings = config.get_settings()
+    if settings.get('listing.fields'):
+        configure_listing(settings['listing.fields'].replace(',', ' ').split())
     add_design()
     config.add_request_method(extract_tender, 'tender', reify=True)
+    config.set_authorization_policy(AuthorizationPolicy())
 
     # tender procurementMethodType plugins support
     config.registry.tender_procurementMethodTypes = {}
@@ -21,15 +29,51 @@ def includeme(config):
     config.add_request_method(tender_from_data)
     config.add_directive('add_tender_procurementMethodType',
                          register_tender_procurementMethodType)
+    config.add_directive('add_tender_resource', add_tender_resource)
     config.scan("openprocurement.tender.core.views")
     config.scan("openprocurement.tender.core.subscribers")
     config.registry.registerAdapter(TenderConfigurator, (ITender, IRequest),
                                     IContentConfigurator)
 
+    # tenderID sequence numbers leasing
+    if settings.get('tenderID.block_size'):
+        TENDER_ID_ALLOCATOR.block_size = int(settings['tenderID.block_size'])
+        register(TENDER_ID_ALLOCATOR.release)
+
+    # old revisions offloading
+    if settings.get('revisions.inline_limit'):
+        REVISIONS_STORAGE.inline_limit = int(settings['revisions.inline_limit'])
+        REVISIONS_STORAGE.chunk_size = int(settings.get('revisions.chunk_size') or REVISIONS_STORAGE.inline_limit or 1)
+
+    # listings served from compact listing documents
+    if asbool(settings.get('listing.projections')):
+        LISTING_PROJECTIONS.enabled = True
+
+    # chronograph checks served from the next_check index
+    if asbool(settings.get('next_check.index')):
+        NEXT_CHECK_INDEX.enabled = True
+
+    # listings written to the response while view rows are iterated
+    config.registry.listing_streaming = asbool(settings.get('listing.streaming'))
+
+    # conditional listing requests, costs a database info request per listing
+    config.registry.listing_etag = asbool(settings.get('listing.etag'))
+
+    # serialized tenders cache
+    if settings.get('serialization_cache.size'):
+        SERIALIZATION_CACHE.size = int(settings['serialization_cache.size'])
+        if settings.get('serialization_cache.time_bucket'):
+            SERIALIZATION_CACHE.time_bucket = int(settings['serialization_cache.time_bucket'])
+        if settings.get('serialization_cache.memcached'):
+            from memcache import Client
+            SERIALIZATION_CACHE.shared = Client(settings['serialization_cache.memcached'].split(','))
+
     # search for plugins
-    settings = config.get_settings()
     plugins = settings.get('plugins') and settings['plugins'].split(',')
     for entry_point in iter_entry_points('openprocurement.tender.core.plugins'):
         if not plugins or entry_point.name in plugins:
             plugin = entry_point.load()
             plugin(config)
+
+    # subresources registered by plugins are in place now
+    RESOURCES.compile()
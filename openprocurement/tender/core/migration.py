@@ -1,7 +1,71 @@
 # -*- coding: utf-8 -*-
 import logging
+from pyramid.settings import asbool
+from openprocurement.tender.core.utils import REVISIONS_STORAGE, LISTING_PROJECTIONS, NEXT_CHECK_INDEX
 LOGGER = logging.getLogger(__name__)
+OBSOLETE_VIEWS = [
+    'by_dateModified', 'real_by_dateModified', 'test_by_dateModified',
+    'by_local_seq', 'real_by_local_seq', 'test_by_local_seq',
+]
+
+
+def offload_revisions(db, storage=REVISIONS_STORAGE):
+    """ Moves revisions over the storage limit out of existing tender documents. """
+    count = 0
+    for row in db.iterview('tenders/all', 2 ** 10, include_docs=True):
+        if storage.offload_doc(db, row.doc):
+            count += 1
+    LOGGER.info('Offloaded revisions of {} tenders'.format(count))
+    return count
+
+
+def project_listings(db, projections=LISTING_PROJECTIONS):
+    """ Writes missing or outdated listing documents of existing tenders.
+
+    Listings are served from those documents once all of them are written.
+    """
+    count = 0
+    for row in db.iterview('tenders/all', 2 ** 10, include_docs=True):
+        if projections.save(db, row.id, row.doc):
+            count += 1
+    projections.mark_ready(db)
+    LOGGER.info('Updated listings of {} tenders'.format(count))
+    return count
+
+
+def index_next_checks(db, index=NEXT_CHECK_INDEX):
+    """ Writes missing or outdated next_check index documents of existing tenders. """
+    count = 0
+    for row in db.iterview('tenders/all', 2 ** 10, include_docs=True):
+        if index.save(db, row.id, row.doc):
+            count += 1
+    LOGGER.info('Updated next checks of {} tenders'.format(count))
+    return count
+
+
+def drop_obsolete_views(db):
+    """ Removes the per mode listing views replaced by ``tenders/listing``.
+
+    Workers of older versions query those views, so they are only dropped
+    when ``migration.drop_obsolete_views`` is set, after all workers are upgraded.
+    """
+    doc = db.get('_design/tenders')
+    views = doc and doc.get('views', {})
+    obsolete = [i for i in OBSOLETE_VIEWS if views and i in views]
+    if obsolete:
+        for i in obsolete:
+            del views[i]
+        db.save(doc)
+        db.cleanup()
+    return obsolete
 
 
 def migrate_data(registry, destination=None):
-    pass
+    if asbool((registry.settings or {}).get('migration.drop_obsolete_views')):
+        drop_obsolete_views(registry.db)
+    if REVISIONS_STORAGE.inline_limit is not None:
+        offload_revisions(registry.db)
+    if LISTING_PROJECTIONS.enabled:
+        project_listings(registry.db)
+    if NEXT_CHECK_INDEX.enabled:
+        index_next_checks(registry.db)
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 from uuid import uuid4
+from contextlib import contextmanager
 from datetime import timedelta, time, datetime
 from couchdb_schematics.document import SchematicsDocument
 from schematics.transforms import whitelist, blacklist, export_loop
 # from iso8601 import parse_date
 from zope.interface import implementer
+from pyramid.decorator import reify
 from pyramid.security import Allow
 from schematics.exceptions import ValidationError
 from schematics.types.compound import ModelType, DictType
@@ -39,7 +41,9 @@ from openprocurement.tender.core.constants import (
 
 
 from openprocurement.tender.core.utils import (
-    calc_auction_end_time, rounding_shouldStartAfter
+    calc_auction_end_time, rounding_shouldStartAfter, get_tender_index,
+    SERIALIZATION_CACHE, REVISION_CACHE, ACL, copy_acl, memoize, get_owners,
+    TenderStateSummary
 )
 from openprocurement.tender.core.validation import (
     validate_LotValue_value
@@ -75,8 +79,8 @@ class PeriodEndRequired(BasePeriodEndRequired):
     def validate_startDate(self, data, period):
         if period and data.get('endDate') and data.get('endDate') < period:
             raise ValidationError(u"period should begin before its end")
-        tender = get_tender(data['__parent__'])
-        if tender.get('revisions') and tender['revisions'][0].date > CANT_DELETE_PERIOD_START_DATE_FROM and not period:
+        creation_date = get_tender_creation_date(get_tender(data['__parent__']))
+        if creation_date and creation_date > CANT_DELETE_PERIOD_START_DATE_FROM and not period:
             raise ValidationError([u'This field cannot be deleted'])
 
 
@@ -100,6 +104,77 @@ def get_tender(model):
     return model
 
 
+def get_tender_creation_date(tender):
+    """ Date of the first tender revision, None for tenders not saved yet.
+
+    The first revision always stays in the tender document, even when
+    older revisions are offloaded to chunk documents.
+    """
+    revisions = tender.get('revisions')
+    return revisions[0].date if revisions else None
+
+
+class TenderIndex(object):
+    """ Lookups over the tender data, each built on first use.
+
+    An index is only valid while the tender data does not change, so it is
+    shared only inside ``BaseTender.indexed`` blocks, e.g. a single export.
+    """
+
+    def __init__(self, tender):
+        self.tender = tender
+
+    @reify
+    def lot_bids(self):
+        """ Number of active bids per lot id. """
+        counts = {}
+        for bid in self.tender.bids:
+            if getattr(bid, "status", "active") == "active":
+                for lot_id in set([i.relatedLot for i in bid.lotValues]):
+                    counts[lot_id] = counts.get(lot_id, 0) + 1
+        return counts
+
+    @reify
+    def lots(self):
+        return dict([(i.id, i) for i in self.tender.lots or []])
+
+    @reify
+    def lot_ids(self):
+        return set(self.lots)
+
+    @reify
+    def item_ids(self):
+        return set([i.id for i in self.tender.items or []])
+
+    @reify
+    def award_ids(self):
+        return set([i.id for i in self.tender.awards or []])
+
+    @reify
+    def feature_values(self):
+        """ Allowed values per feature code. """
+        return dict([(i.code, set([x.value for x in i.enum])) for i in self.tender.features or []])
+
+    @reify
+    def state_summary(self):
+        return TenderStateSummary(self.tender)
+
+    @reify
+    def complaints_decision_date(self):
+        """ The latest date an auction may start at after complaint decisions. """
+        decision_dates = [
+            datetime.combine(complaint.dateDecision.date() + timedelta(days=3), time(0, tzinfo=complaint.dateDecision.tzinfo))
+            for complaint in self.tender.complaints
+            if complaint.dateDecision
+        ]
+        return max(decision_dates) if decision_dates else None
+
+
+def lookup_index(tender):
+    """ The index of the current ``indexed`` block or a new one outside of it. """
+    return get_tender_index(tender) or TenderIndex(tender)
+
+
 class TenderAuctionPeriod(Period):
     """The auction period."""
 
@@ -153,10 +228,10 @@ class Document(BaseDocument):
         if not relatedItem and data.get('documentOf') in ['item', 'lot']:
             raise ValidationError(u'This field is required.')
         if relatedItem and isinstance(data['__parent__'], Model):
-            tender = get_tender(data['__parent__'])
-            if data.get('documentOf') == 'lot' and relatedItem not in [i.id for i in tender.lots]:
+            index = lookup_index(get_tender(data['__parent__']))
+            if data.get('documentOf') == 'lot' and relatedItem not in index.lot_ids:
                 raise ValidationError(u"relatedItem should be one of lots")
-            if data.get('documentOf') == 'item' and relatedItem not in [i.id for i in tender.items]:
+            if data.get('documentOf') == 'item' and relatedItem not in index.item_ids:
                 raise ValidationError(u"relatedItem should be one of items")
 
 
@@ -184,31 +259,46 @@ def validate_dkpp(items, *args):
         raise ValidationError(u"One of additional classifications should be one of [{0}].".format(', '.join(ADDITIONAL_CLASSIFICATIONS_SCHEMES)))
 
 
+def find_duplicates(values):
+    """ Values occurring more than once, in order of their second occurrence. """
+    seen = set()
+    reported = set()
+    duplicates = []
+    for value in values:
+        if value not in seen:
+            seen.add(value)
+        elif value not in reported:
+            reported.add(value)
+            duplicates.append(value)
+    return duplicates
+
+
+def format_duplicates(duplicates):
+    return u', '.join([unicode(i) for i in duplicates])
+
+
 def validate_parameters_uniq(parameters, *args):
-    if parameters:
-        codes = [i.code for i in parameters]
-        if [i for i in set(codes) if codes.count(i) > 1]:
-            raise ValidationError(u"Parameter code should be uniq for all parameters")
+    duplicates = parameters and find_duplicates([i.code for i in parameters])
+    if duplicates:
+        raise ValidationError(u"Parameter code should be uniq for all parameters: {}".format(format_duplicates(duplicates)))
 
 
 def validate_values_uniq(values, *args):
-    codes = [i.value for i in values]
-    if any([codes.count(i) > 1 for i in set(codes)]):
-        raise ValidationError(u"Feature value should be uniq for feature")
+    duplicates = find_duplicates([i.value for i in values])
+    if duplicates:
+        raise ValidationError(u"Feature value should be uniq for feature: {}".format(format_duplicates(duplicates)))
 
 
 def validate_features_uniq(features, *args):
-    if features:
-        codes = [i.code for i in features]
-        if any([codes.count(i) > 1 for i in set(codes)]):
-            raise ValidationError(u"Feature code should be uniq for all features")
+    duplicates = features and find_duplicates([i.code for i in features])
+    if duplicates:
+        raise ValidationError(u"Feature code should be uniq for all features: {}".format(format_duplicates(duplicates)))
 
 
 def validate_lots_uniq(lots, *args):
-    if lots:
-        ids = [i.id for i in lots]
-        if [i for i in set(ids) if ids.count(i) > 1]:
-            raise ValidationError(u"Lot id should be uniq for all lots")
+    duplicates = lots and find_duplicates([i.id for i in lots])
+    if duplicates:
+        raise ValidationError(u"Lot id should be uniq for all lots: {}".format(format_duplicates(duplicates)))
 
 
 def validate_funders_unique(funders, *args):
@@ -235,26 +325,20 @@ class LotAuctionPeriod(Period):
         lot = self.__parent__
         if tender.status not in ['active.tendering', 'active.auction'] or lot.status != 'active':
             return
-        if self.startDate and get_now() > calc_auction_end_time(lot.numberOfBids, self.startDate):
-            start_after = calc_auction_end_time(lot.numberOfBids, self.startDate)
+        number_of_bids = lot.numberOfBids
+        if self.startDate and get_now() > calc_auction_end_time(number_of_bids, self.startDate):
+            start_after = calc_auction_end_time(number_of_bids, self.startDate)
         else:
-            decision_dates = [
-                datetime.combine(complaint.dateDecision.date() + timedelta(days=3), time(0, tzinfo=complaint.dateDecision.tzinfo))
-                for complaint in tender.complaints
-                if complaint.dateDecision
-            ]
-            decision_dates.append(tender.tenderPeriod.endDate)
-            start_after = max(decision_dates)
+            decision_date = lookup_index(tender).complaints_decision_date
+            start_after = max(decision_date, tender.tenderPeriod.endDate) if decision_date else tender.tenderPeriod.endDate
         return rounding_shouldStartAfter(start_after, tender).isoformat()
 
 
 class Location(BaseLocation):
     def validate_latitude(self, data, latitude):
         if latitude:
-            parent_object = data.get('__parent__', {}).get('__parent__', {})
-            if (parent_object.get('revisions') and
-                parent_object['revisions'][0].date >
-                    ITEMS_LOCATION_VALIDATION_FROM):
+            creation_date = get_tender_creation_date(data.get('__parent__', {}).get('__parent__', {}))
+            if creation_date and creation_date > ITEMS_LOCATION_VALIDATION_FROM:
                 valid_latitude = COORDINATES_REG_EXP.match(str(latitude))
                 if (valid_latitude is not None and
                         valid_latitude.group() == str(latitude)):
@@ -267,10 +351,8 @@ class Location(BaseLocation):
 
     def validate_longitude(self, data, longitude):
         if longitude:
-            parent_object = data.get('__parent__', {}).get('__parent__', {})
-            if (parent_object.get('revisions') and
-                parent_object['revisions'][0].date >
-                    ITEMS_LOCATION_VALIDATION_FROM):
+            creation_date = get_tender_creation_date(data.get('__parent__', {}).get('__parent__', {}))
+            if creation_date and creation_date > ITEMS_LOCATION_VALIDATION_FROM:
                 valid_longitude = COORDINATES_REG_EXP.match(str(longitude))
                 if (valid_longitude is not None and
                         valid_longitude.group() == str(longitude)):
@@ -288,7 +370,7 @@ class Item(BaseItem):
     deliveryLocation = ModelType(Location)
     def validate_additionalClassifications(self, data, items):
         tender = get_tender(data['__parent__'])
-        tender_date = tender.get('revisions')[0].date if tender.get('revisions') else get_now()
+        tender_date = get_tender_creation_date(tender) or get_now()
         tender_from_2017 = tender_date > CPV_ITEMS_CLASS_FROM
         tender_from_inn = tender_date > GROUP_336_FROM
         not_cpv = data['classification']['id'] == '99999999-9'
@@ -304,7 +386,7 @@ class Item(BaseItem):
             raise ValidationError(u"One of additional classifications should be INN.")
 
     def validate_relatedLot(self, data, relatedLot):
-        if relatedLot and isinstance(data['__parent__'], Model) and relatedLot not in [i.id for i in get_tender(data['__parent__']).lots]:
+        if relatedLot and isinstance(data['__parent__'], Model) and relatedLot not in lookup_index(get_tender(data['__parent__'])).lot_ids:
             raise ValidationError(u"relatedLot should be one of lots")
 
 
@@ -322,7 +404,7 @@ class Contract(BaseContract):
     documents = ListType(ModelType(Document), default=list())
 
     def validate_awardID(self, data, awardID):
-        if awardID and isinstance(data['__parent__'], Model) and awardID not in [i.id for i in data['__parent__'].awards]:
+        if awardID and isinstance(data['__parent__'], Model) and awardID not in lookup_index(data['__parent__']).award_ids:
             raise ValidationError(u"awardID should be one of awards")
 
     def validate_dateSigned(self, data, value):
@@ -356,7 +438,7 @@ class LotValue(Model):
             validate_LotValue_value(get_tender(data['__parent__']), data['relatedLot'], value)
 
     def validate_relatedLot(self, data, relatedLot):
-        if isinstance(data['__parent__'], Model) and relatedLot not in [i.id for i in get_tender(data['__parent__']).lots]:
+        if isinstance(data['__parent__'], Model) and relatedLot not in lookup_index(get_tender(data['__parent__'])).lot_ids:
             raise ValidationError(u"relatedLot should be one of lots")
 
 
@@ -365,13 +447,12 @@ class Parameter(Model):
     value = FloatType(required=True)
 
     def validate_code(self, data, code):
-        if isinstance(data['__parent__'], Model) and code not in [i.code for i in (get_tender(data['__parent__']).features or [])]:
+        if isinstance(data['__parent__'], Model) and code not in lookup_index(get_tender(data['__parent__'])).feature_values:
             raise ValidationError(u"code should be one of feature code.")
 
     def validate_value(self, data, value):
         if isinstance(data['__parent__'], Model):
-            tender = get_tender(data['__parent__'])
-            codes = dict([(i.code, [x.value for x in i.enum]) for i in (tender.features or [])])
+            codes = lookup_index(get_tender(data['__parent__'])).feature_values
             if data['code'] in codes and value not in codes[data['code']]:
                 raise ValidationError(u"value should be one of feature value.")
 
@@ -398,7 +479,9 @@ class Bid(Model):
         }
 
     def __local_roles__(self):
-        return dict([('{}_{}'.format(self.owner, self.owner_token), 'bid_owner')])
+        return dict(memoize(self, '_local_roles', (self.owner, self.owner_token), lambda: {
+            '{}_{}'.format(self.owner, self.owner_token): 'bid_owner'
+        }))
 
     tenderers = ListType(ModelType(Organization), required=True, min_size=1, max_size=1)
     parameters = ListType(ModelType(Parameter), default=list(), validators=[validate_parameters_uniq])
@@ -431,9 +514,9 @@ class Bid(Model):
         return self
 
     def __acl__(self):
-        return [
+        return copy_acl(memoize(self, '_acl', (self.owner, self.owner_token), lambda: ACL([
             (Allow, '{}_{}'.format(self.owner, self.owner_token), 'edit_bid'),
-        ]
+        ])))
 
     def validate_participationUrl(self, data, url):
         if url and isinstance(data['__parent__'], Model) and get_tender(data['__parent__']).lots:
@@ -444,7 +527,8 @@ class Bid(Model):
             tender = data['__parent__']
             if tender.lots and not values:
                 raise ValidationError(u'This field is required.')
-            if tender.get('revisions') and tender['revisions'][0].date > BID_LOTVALUES_VALIDATION_FROM and values:
+            creation_date = get_tender_creation_date(tender)
+            if creation_date and creation_date > BID_LOTVALUES_VALIDATION_FROM and values:
                 lots = [i.relatedLot for i in values]
                 if len(lots) != len(set(lots)):
                     raise ValidationError(u'bids don\'t allow duplicated proposals')
@@ -480,7 +564,7 @@ class Bid(Model):
                     raise ValidationError(u"All features parameters is required.")
             elif not parameters and tender.features:
                 raise ValidationError(u'This field is required.')
-            elif set([i['code'] for i in parameters]) != set([i.code for i in (tender.features or [])]):
+            elif set([i['code'] for i in parameters]) != set(lookup_index(tender).feature_values):
                 raise ValidationError(u"All features parameters is required.")
 
 
@@ -530,10 +614,10 @@ class Question(Model):
         if not relatedItem and data.get('questionOf') in ['item', 'lot']:
             raise ValidationError(u'This field is required.')
         if relatedItem and isinstance(data['__parent__'], Model):
-            tender = get_tender(data['__parent__'])
-            if data.get('questionOf') == 'lot' and relatedItem not in [i.id for i in tender.lots]:
+            index = lookup_index(get_tender(data['__parent__']))
+            if data.get('questionOf') == 'lot' and relatedItem not in index.lot_ids:
                 raise ValidationError(u"relatedItem should be one of lots")
-            if data.get('questionOf') == 'item' and relatedItem not in [i.id for i in tender.items]:
+            if data.get('questionOf') == 'item' and relatedItem not in index.item_ids:
                 raise ValidationError(u"relatedItem should be one of items")
 
 
@@ -617,14 +701,16 @@ class Complaint(Model):
         return role
 
     def __local_roles__(self):
-        return dict([('{}_{}'.format(self.owner, self.owner_token), 'complaint_owner')])
+        return dict(memoize(self, '_local_roles', (self.owner, self.owner_token), lambda: {
+            '{}_{}'.format(self.owner, self.owner_token): 'complaint_owner'
+        }))
 
     def __acl__(self):
-        return [
+        return copy_acl(memoize(self, '_acl', (self.owner, self.owner_token), lambda: ACL([
             (Allow, 'g:reviewers', 'edit_complaint'),
             (Allow, '{}_{}'.format(self.owner, self.owner_token), 'edit_complaint'),
             (Allow, '{}_{}'.format(self.owner, self.owner_token), 'upload_complaint_documents'),
-        ]
+        ])))
 
     def validate_resolutionType(self, data, resolutionType):
         if not resolutionType and data.get('status') == 'answered':
@@ -635,7 +721,7 @@ class Complaint(Model):
             raise ValidationError(u'This field is required.')
 
     def validate_relatedLot(self, data, relatedLot):
-        if relatedLot and isinstance(data['__parent__'], Model) and relatedLot not in [i.id for i in get_tender(data['__parent__']).lots]:
+        if relatedLot and isinstance(data['__parent__'], Model) and relatedLot not in lookup_index(get_tender(data['__parent__'])).lot_ids:
             raise ValidationError(u"relatedLot should be one of lots")
 
 
@@ -661,7 +747,7 @@ class Cancellation(Model):
     def validate_relatedLot(self, data, relatedLot):
         if not relatedLot and data.get('cancellationOf') == 'lot':
             raise ValidationError(u'This field is required.')
-        if relatedLot and isinstance(data['__parent__'], Model) and relatedLot not in [i.id for i in data['__parent__'].lots]:
+        if relatedLot and isinstance(data['__parent__'], Model) and relatedLot not in lookup_index(data['__parent__']).lot_ids:
             raise ValidationError(u"relatedLot should be one of lots")
 
 
@@ -707,7 +793,7 @@ class Award(BaseAward):
         if isinstance(data['__parent__'], Model):
             if not lotID and data['__parent__'].lots:
                 raise ValidationError(u'This field is required.')
-            if lotID and lotID not in [i.id for i in data['__parent__'].lots]:
+            if lotID and lotID not in lookup_index(data['__parent__']).lot_ids:
                 raise ValidationError(u"lotID should be one of lots")
 
 
@@ -736,9 +822,9 @@ class Feature(Model):
     def validate_relatedItem(self, data, relatedItem):
         if not relatedItem and data.get('featureOf') in ['item', 'lot']:
             raise ValidationError(u'This field is required.')
-        if data.get('featureOf') == 'item' and isinstance(data['__parent__'], Model) and relatedItem not in [i.id for i in data['__parent__'].items]:
+        if data.get('featureOf') == 'item' and isinstance(data['__parent__'], Model) and relatedItem not in lookup_index(data['__parent__']).item_ids:
             raise ValidationError(u"relatedItem should be one of items")
-        if data.get('featureOf') == 'lot' and isinstance(data['__parent__'], Model) and relatedItem not in [i.id for i in data['__parent__'].lots]:
+        if data.get('featureOf') == 'lot' and isinstance(data['__parent__'], Model) and relatedItem not in lookup_index(data['__parent__']).lot_ids:
             raise ValidationError(u"relatedItem should be one of lots")
 
 
@@ -778,6 +864,9 @@ class Lot(BaseLot):
     @serializable
     def numberOfBids(self):
         """A property that is serialized by schematics exports."""
+        index = get_tender_index(self.__parent__)
+        if index is not None:
+            return index.lot_bids.get(self.id, 0)
         bids = [
             bid
             for bid in self.__parent__.bids
@@ -834,12 +923,45 @@ class BaseTender(SchematicsDocument, Model):
     _attachments = DictType(DictType(BaseType), default=dict())  # couchdb attachments
     revisions = ListType(ModelType(Revision), default=list())
 
+    # statuses in which serializables depend on the current time, see utils.get_time_bucket
+    time_dependent_statuses = ()
+
     def __repr__(self):
         return '<%s:%r@%r>' % (type(self).__name__, self.id, self.rev)
 
+    @contextmanager
+    def indexed(self):
+        """ Shares one TenderIndex between everything computed inside the block.
+
+        The tender data must not change inside the block.
+        """
+        if '_index' in self.__dict__:
+            yield self.__dict__['_index']
+            return
+        self.__dict__['_index'] = index = TenderIndex(self)
+        try:
+            yield index
+        finally:
+            del self.__dict__['_index']
+
+    def to_primitive(self, role=None, context=None):
+        with self.indexed():
+            return super(BaseTender, self).to_primitive(role=role, context=context)
+
+    def serialize(self, role=None, context=None):
+        # tenders of GET requests are bound to the stored revision, see SerializationCache
+        if '_serialization_key' in self.__dict__ and context is None and isinstance(role, basestring):
+            return SERIALIZATION_CACHE.serialize(self, role, super(BaseTender, self).serialize)
+        return super(BaseTender, self).serialize(role=role, context=context)
+
+    def validate(self, *args, **kwargs):
+        with self.indexed():
+            return super(BaseTender, self).validate(*args, **kwargs)
+
     def __local_roles__(self):
-        roles = dict([('{}_{}'.format(self.owner, self.owner_token), 'tender_owner')])
-        return roles
+        return dict(REVISION_CACHE.get(self, 'local_roles', lambda: {
+            '{}_{}'.format(self.owner, self.owner_token): 'tender_owner'
+        }))
 
     @serializable(serialized_name='id')
     def doc_id(self):
@@ -902,10 +1024,13 @@ class Tender(BaseTender):
         return role
 
     def __acl__(self):
-        acl = [
-            (Allow, '{}_{}'.format(i.owner, i.owner_token), 'create_award_complaint')
-            for i in self.bids
-        ]
+        return copy_acl(REVISION_CACHE.get(self, 'acl', self.build_acl))
+
+    def build_acl(self):
+        acl = ACL([
+            (Allow, '{}_{}'.format(owner, owner_token), 'create_award_complaint')
+            for owner, owner_token in get_owners(self, 'bids')
+        ])
         acl.extend([
             (Allow, '{}_{}'.format(self.owner, self.owner_token), 'edit_tender'),
             (Allow, '{}_{}'.format(self.owner, self.owner_token), 'upload_tender_documents'),
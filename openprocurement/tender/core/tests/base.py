@@ -3,9 +3,13 @@ import json
 import os
 from uuid import uuid4
 from copy import deepcopy
+from collections import namedtuple
 from urllib import urlencode
 from base64 import b64encode
 from datetime import datetime
+from threading import Lock
+from time import sleep
+from couchdb.http import ResourceConflict
 from requests.models import Response
 from webtest import TestApp
 
@@ -14,6 +18,68 @@ from openprocurement.api.utils import SESSION, apply_data_patch
 
 
 now = datetime.now()
+Row = namedtuple('Row', ['id', 'key', 'value', 'doc'])
+
+
+class LocalCouchDB(object):
+    """ In-memory stand-in for couchdb.Database with revision checks.
+
+    ``latency`` (in seconds) is spent on every call to imitate a round-trip
+    to the CouchDB server.
+    """
+
+    def __init__(self, name='tests', latency=0):
+        self.name = name
+        self.latency = latency
+        self.docs = {}
+        self.reads = self.writes = self.conflicts = 0
+        self.lock = Lock()
+
+    def get(self, doc_id, default=None):
+        if self.latency:
+            sleep(self.latency)
+        with self.lock:
+            self.reads += 1
+            doc = self.docs.get(doc_id)
+            return deepcopy(doc) if doc is not None else default
+
+    def save(self, doc):
+        if self.latency:
+            sleep(self.latency)
+        with self.lock:
+            current = self.docs.get(doc['_id'])
+            if (current and current['_rev']) != doc.get('_rev'):
+                self.conflicts += 1
+                raise ResourceConflict(('conflict', 'Document update conflict.'))
+            self.writes += 1
+            doc['_rev'] = '{}-{}'.format(int((current or {'_rev': '0'})['_rev'].split('-')[0]) + 1, uuid4().hex)
+            self.docs[doc['_id']] = deepcopy(doc)
+            return doc['_id'], doc['_rev']
+
+    def delete(self, doc):
+        with self.lock:
+            current = self.docs.get(doc['_id'])
+            if not current or current['_rev'] != doc.get('_rev'):
+                self.conflicts += 1
+                raise ResourceConflict(('conflict', 'Document update conflict.'))
+            self.writes += 1
+            del self.docs[doc['_id']]
+
+    def view(self, name, startkey=None, endkey=None, include_docs=False, keys=None, **options):
+        assert name == '_all_docs', 'only _all_docs is supported'
+        with self.lock:
+            self.reads += 1
+            if keys is not None:
+                return [
+                    Row(i, i, {'rev': self.docs[i]['_rev']}, deepcopy(self.docs[i]) if include_docs else None)
+                    if i in self.docs else Row(None, i, None, None)
+                    for i in keys
+                ]
+            return [
+                Row(doc_id, doc_id, {'rev': doc['_rev']}, deepcopy(doc) if include_docs else None)
+                for doc_id, doc in sorted(self.docs.items())
+                if (startkey is None or doc_id >= startkey) and (endkey is None or doc_id <= endkey)
+            ]
 
 
 class BaseTenderWebTest(BaseWebTest):
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+""" Performance benchmarks.
+
+Not a part of the main test suite, run them with
+
+    python setup.py benchmark
+
+or
+
+    python -m openprocurement.tender.core.tests.benchmarks
+"""
+import os
+import unittest
+from datetime import datetime, timedelta
+from threading import Thread
+from time import time
+from uuid import uuid4
+from mock import MagicMock, patch
+from pyramid.authorization import ACLAuthorizationPolicy
+from pyramid.security import Allow, Everyone
+
+from openprocurement.api.constants import TZ
+from openprocurement.api.utils import get_revision_changes
+from openprocurement.tender.core.design import LISTING_DESIGN, tenders_listing_projections_view
+from openprocurement.tender.core.models import find_duplicates
+from openprocurement.tender.core.tests.base import BaseWebTest, LocalCouchDB
+from openprocurement.tender.core.tests.utils import TenderWithBids
+from openprocurement.tender.core.traversal import Root, AuthorizationPolicy
+from openprocurement.tender.core.utils import (
+    generate_tender_id, TenderIDAllocator, track_changes, serialize_changes,
+    tender_from_data, tender_serialize, get_working_days_calendar,
+    calendar_business_date, iterate_business_date, ListingProjections,
+    SerializationCache
+)
+
+__test__ = False  # keep nose from collecting benchmarks
+
+
+def report(name, **values):
+    print('{}: {}'.format(name, ', '.join(['{}={}'.format(k, values[k]) for k in sorted(values)])))
+
+
+class TenderIDContentionBenchmark(unittest.TestCase):
+    workers = 8
+    tenders_per_worker = 25
+    latency = 0.001
+
+    def run_creators(self, block_size):
+        ctime = datetime.now(TZ)
+        db = LocalCouchDB(latency=self.latency)
+        tender_ids = []
+
+        def create(allocator):
+            for _ in xrange(self.tenders_per_worker):
+                tender_ids.append(generate_tender_id(ctime, db, '', allocator))
+            allocator.release()
+
+        threads = [
+            Thread(target=create, args=(TenderIDAllocator(block_size=block_size),))
+            for _ in xrange(self.workers)
+        ]
+        start = time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time() - start
+        self.assertEqual(len(set(tender_ids)), self.workers * self.tenders_per_worker)
+        report('tenderID block_size={}'.format(block_size),
+               seconds=round(elapsed, 3), writes=db.writes, conflicts=db.conflicts,
+               ids_per_second=int(len(tender_ids) / elapsed))
+        return elapsed
+
+    def test_contention(self):
+        per_tender = self.run_creators(1)
+        leased = self.run_creators(100)
+        self.assertLess(leased, per_tender)
+
+
+class RevisionDiffBenchmark(unittest.TestCase):
+    sizes = (10, 100, 1000)
+    repeat = 20
+
+    def make_tender(self, size):
+        return TenderWithBids({
+            'id': uuid4().hex,
+            'title': 'Synthetic tender',
+            'status': 'active.tendering',
+            'items': [{'id': uuid4().hex, 'description': 'Item {}'.format(i)} for i in xrange(size / 10 or 1)],
+            'bids': [{
+                'id': uuid4().hex,
+                'status': 'active',
+                'tenderers': [{'name': 'Tenderer {}'.format(i)}],
+            } for i in xrange(size)],
+        })
+
+    def measure(self, diff, size):
+        tender = self.make_tender(size)
+        tender_src = tender.serialize('plain')
+        track_changes(tender)
+        tender.title = 'Renamed synthetic tender'
+        start = time()
+        for _ in xrange(self.repeat):
+            changes = diff(tender, tender_src)
+        return changes, (time() - start) / self.repeat
+
+    def test_diff(self):
+        def full(tender, tender_src):
+            return get_revision_changes(tender.serialize('plain'), tender_src)
+
+        def incremental(tender, tender_src):
+            return get_revision_changes(serialize_changes(tender, 'plain', tender_src), tender_src)
+
+        for size in self.sizes:
+            full_changes, full_time = self.measure(full, size)
+            incremental_changes, incremental_time = self.measure(incremental, size)
+            self.assertEqual(full_changes, incremental_changes)
+            report('revision diff bids={}'.format(size),
+                   full_ms=round(full_time * 1000, 2), incremental_ms=round(incremental_time * 1000, 2))
+
+
+class LazyTenderBenchmark(unittest.TestCase):
+    page_size = 1000
+    fields = ['id', 'dateModified', 'status', 'tenderID']
+
+    def make_page(self):
+        return [TenderWithBids({
+            'id': uuid4().hex,
+            'title': 'Synthetic tender',
+            'status': 'draft',
+            'dateModified': datetime.now(TZ).isoformat(),
+            'tenderID': 'UA-2017-10-07-{:06d}'.format(i),
+            'items': [{'id': uuid4().hex, 'description': 'Item {}'.format(j)} for j in xrange(10)],
+            'bids': [{
+                'id': uuid4().hex,
+                'status': 'active',
+                'tenderers': [{'name': 'Tenderer {}'.format(j)}],
+            } for j in xrange(10)],
+            'documents': [{'id': uuid4().hex, 'title': 'doc.pdf'} for j in xrange(10)],
+        }).to_primitive() for i in xrange(self.page_size)]
+
+    def test_listing_page(self):
+        request = MagicMock()
+        request.registry.tender_procurementMethodTypes.get.return_value = TenderWithBids
+        request.tender_from_data.side_effect = lambda data, **kwargs: tender_from_data(request, data, **kwargs)
+        page = self.make_page()
+
+        def full(data):
+            tender = tender_from_data(request, data)
+            return dict([(i, j) for i, j in tender.serialize(tender.status).items() if i in self.fields])
+
+        def lazy(data):
+            return tender_serialize(request, data, self.fields)
+
+        timings = {}
+        for serialize in (full, lazy):
+            start = time()
+            results = [serialize(i) for i in page]
+            timings[serialize.__name__] = time() - start
+            self.assertEqual(len(results), self.page_size)
+        self.assertEqual(full(page[0]), lazy(page[0]))
+        report('listing page tenders={}'.format(self.page_size),
+               full_ms=int(timings['full'] * 1000), lazy_ms=int(timings['lazy'] * 1000))
+        self.assertLess(timings['lazy'], timings['full'])
+
+
+class UniquenessBenchmark(unittest.TestCase):
+    sizes = (10, 100, 1000)
+    repeat = 20
+
+    def measure(self, func, values):
+        start = time()
+        for _ in xrange(self.repeat):
+            func(values)
+        return (time() - start) / self.repeat
+
+    def test_duplicates(self):
+        def count_based(codes):
+            return [i for i in set(codes) if codes.count(i) > 1]
+
+        for size in self.sizes:
+            codes = ['OCDS-{}'.format(i) for i in xrange(size)]
+            count_time = self.measure(count_based, codes)
+            set_time = self.measure(find_duplicates, codes)
+            self.assertEqual(count_based(codes), find_duplicates(codes))
+            report('uniqueness size={}'.format(size),
+                   count_us=int(count_time * 10 ** 6), set_us=int(set_time * 10 ** 6))
+
+
+class BusinessDateBenchmark(unittest.TestCase):
+    deltas = (1, 7, 30, 90, 365)
+
+    def test_deltas(self):
+        calendar = get_working_days_calendar()
+        date_obj = datetime.now(TZ)
+        for days in self.deltas:
+            timings = {'loop': 0, 'calendar': 0}
+            for delta in (timedelta(days), timedelta(-days)):
+                start = time()
+                iterated = [iterate_business_date(date_obj, delta) for _ in xrange(100)]
+                timings['loop'] += time() - start
+                start = time()
+                compiled = [calendar_business_date(calendar, date_obj, delta) for _ in xrange(100)]
+                timings['calendar'] += time() - start
+                self.assertEqual(iterated, compiled)
+            report('business date days={}'.format(days),
+                   loop_us=int(timings['loop'] * 10 ** 4 / 2), calendar_us=int(timings['calendar'] * 10 ** 4 / 2))
+
+
+class ListingIndexingBenchmark(BaseWebTest):
+    """ CouchDB indexing of the tenders listing view and the projections view.
+
+    The listing view maps whole tender documents, the projections view maps
+    the small listing documents written in the save path. Both indexes are
+    built over the same database with the tenders and their listing
+    documents, the first query of a view waits for its index to be built.
+    """
+    relative_to = os.path.dirname(__file__)
+    tenders = 200
+
+    def make_tenders(self):
+        return [TenderWithBids({
+            'id': uuid4().hex,
+            'title': 'Synthetic tender',
+            'status': 'active.tendering',
+            'dateModified': datetime.now(TZ).isoformat(),
+            'tenderID': 'UA-2017-10-07-{:06d}'.format(i),
+            'items': [{'id': uuid4().hex, 'description': 'Item {}'.format(j)} for j in xrange(10)],
+            'bids': [{
+                'id': uuid4().hex,
+                'status': 'active',
+                'tenderers': [{'name': 'Tenderer {}'.format(j)}],
+            } for j in xrange(50)],
+            'documents': [{'id': uuid4().hex, 'title': 'doc.pdf'} for j in xrange(20)],
+        }) for i in xrange(self.tenders)]
+
+    def test_indexing(self):
+        projections = ListingProjections(enabled=True)
+        docs = []
+        for tender in self.make_tenders():
+            doc = tender.to_primitive()
+            doc['_id'], doc['doc_type'] = tender.id, 'Tender'
+            docs.extend([doc, projections.project(tender.id, doc)])
+        self.db.update(docs)
+
+        timings = {}
+        for name, view in (('listing', LISTING_DESIGN.view), ('projections', tenders_listing_projections_view)):
+            start = time()
+            view(self.db, limit=1).rows
+            timings[name] = time() - start
+
+        report('listing indexing tenders={}'.format(self.tenders),
+               listing_tenders_per_second=int(self.tenders / timings['listing']),
+               projections_tenders_per_second=int(self.tenders / timings['projections']))
+
+
+class SerializationCacheBenchmark(unittest.TestCase):
+    requests = 1000
+    tenders = 10
+
+    def test_serialize(self):
+        cache = SerializationCache(size=100, report_interval=0)
+        docs = []
+        for i in xrange(self.tenders):
+            doc = TenderWithBids({
+                'id': uuid4().hex,
+                'title': 'Synthetic tender',
+                'status': 'draft',
+                'items': [{'id': uuid4().hex, 'description': 'Item {}'.format(j)} for j in xrange(10)],
+                'bids': [{
+                    'id': uuid4().hex,
+                    'status': 'active',
+                    'tenderers': [{'name': 'Tenderer {}'.format(j)}],
+                } for j in xrange(50)],
+            }).to_primitive()
+            doc['_rev'] = '1-{}'.format(uuid4().hex)
+            docs.append(doc)
+
+        timings = {}
+        for name, bind in (('model', lambda tender, doc: None), ('cache', cache.bind)):
+            start = time()
+            for i in xrange(self.requests):
+                doc = docs[i % self.tenders]
+                tender = TenderWithBids(doc)
+                bind(tender, doc)
+                with patch('openprocurement.tender.core.models.SERIALIZATION_CACHE', cache):
+                    tender.serialize('draft')
+            timings[name] = time() - start
+        metrics = cache.metrics()
+        report('serialization requests={}'.format(self.requests),
+               model_ms=int(timings['model'] * 1000), cache_ms=int(timings['cache'] * 1000),
+               hit_rate=metrics['hit_rate'], evictions=metrics['evictions'])
+
+
+class PermissionCheckBenchmark(unittest.TestCase):
+    bids = (10, 100, 1000)
+    checks = 1000
+
+    def make_context(self, bids):
+        class Context(object):
+            __parent__ = Root(MagicMock())
+            __acl__ = [
+                (Allow, 'broker{}_{}'.format(i, uuid4().hex), 'create_award_complaint') for i in xrange(bids)
+            ] + [(Allow, 'broker_{}'.format(uuid4().hex), 'edit_tender')]
+        return Context()
+
+    def test_permits(self):
+        principals = [Everyone, 'g:brokers', 'broker_{}'.format(uuid4().hex)]
+        permissions = ['view_tender', 'create_bid', 'edit_tender', 'create_award_complaint']
+        for bids in self.bids:
+            context = self.make_context(bids)
+            timings = {}
+            for name, permits in (('acl', ACLAuthorizationPolicy().permits), ('indexed', AuthorizationPolicy().check)):
+                start = time()
+                results = [bool(permits(context, principals, permissions[i % 4])) for i in xrange(self.checks)]
+                timings[name] = time() - start
+                self.assertEqual(results[:4], [True, True, False, False])
+            report('permission checks bids={}'.format(bids),
+                   acl_per_second=int(self.checks / timings['acl']), indexed_per_second=int(self.checks / timings['indexed']))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TenderIDContentionBenchmark))
+    suite.addTest(unittest.makeSuite(RevisionDiffBenchmark))
+    suite.addTest(unittest.makeSuite(LazyTenderBenchmark))
+    suite.addTest(unittest.makeSuite(UniquenessBenchmark))
+    suite.addTest(unittest.makeSuite(BusinessDateBenchmark))
+    suite.addTest(unittest.makeSuite(ListingIndexingBenchmark))
+    suite.addTest(unittest.makeSuite(SerializationCacheBenchmark))
+    suite.addTest(unittest.makeSuite(PermissionCheckBenchmark))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
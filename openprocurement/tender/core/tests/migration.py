@@ -11,6 +11,22 @@ class MigrateTest(BaseWebTest):
         super(MigrateTest, self).setUp()
         migrate_data(self.app.app.registry)
 
+    def tearDown(self):
+        self.app.app.registry.settings.pop('migration.drop_obsolete_views', None)
+        super(MigrateTest, self).tearDown()
+
+    def test_drop_obsolete_views(self):
+        doc = self.db.get('_design/tenders')
+        doc['views']['by_dateModified'] = {'map': 'function(doc) {}'}
+        self.db.save(doc)
+        migrate_data(self.app.app.registry)
+        self.assertIn('by_dateModified', self.db.get('_design/tenders')['views'])
+
+        self.app.app.registry.settings['migration.drop_obsolete_views'] = 'true'
+        migrate_data(self.app.app.registry)
+        self.assertNotIn('by_dateModified', self.db.get('_design/tenders')['views'])
+        self.assertIn('all', self.db.get('_design/tenders')['views'])
+
 
 def suite():
     suite = unittest.TestSuite()
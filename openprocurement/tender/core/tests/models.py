@@ -1,19 +1,25 @@
 # -*- coding: utf-8 -*-
 import unittest
+from uuid import uuid4
 from mock import patch, MagicMock
 from datetime import datetime, timedelta, time
 from schematics.exceptions import ModelValidationError, ValidationError
+from schematics.types.compound import ModelType
+from pyramid.security import Allow
 from openprocurement.tender.core.models import (
-    PeriodEndRequired, get_tender, Tender, TenderAuctionPeriod, Question, Item
+    PeriodEndRequired, get_tender, Tender, TenderAuctionPeriod, Question, Item,
+    Lot, Bid, Complaint, Award, Feature, TenderIndex, lookup_index, get_tender_index,
+    find_duplicates, validate_lots_uniq, validate_values_uniq, validate_features_uniq
 )
 from openprocurement.api.constants import (
     ADDITIONAL_CLASSIFICATIONS_SCHEMES_2017,
     ADDITIONAL_CLASSIFICATIONS_SCHEMES,
     TZ
 )
-from openprocurement.api.models import AdditionalClassification
+from openprocurement.api.models import AdditionalClassification, ListType
 from openprocurement.api.utils import get_now
 from openprocurement.tender.core.constants import GROUP_336_FROM
+from openprocurement.tender.core.utils import lazy_model, track_changes
 
 class TestPeriodEndRequired(unittest.TestCase):
 
@@ -210,12 +216,191 @@ class TestQuestionModel(unittest.TestCase):
         self.assertEqual(len(serialized_question['id']), 32)
 
 
+class TestUniquenessValidators(unittest.TestCase):
+
+    def test_find_duplicates(self):
+        self.assertEqual(find_duplicates([]), [])
+        self.assertEqual(find_duplicates(['a', 'b', 'c']), [])
+        self.assertEqual(find_duplicates(['a', 'b', 'b', 'a', 'b', 'c']), ['b', 'a'])
+        self.assertEqual(find_duplicates([0.1, 0, 0.1]), [0.1])
+
+    def test_validate_lots_uniq(self):
+        lots = [Lot({'id': '1' * 32}), Lot({'id': '2' * 32})]
+        validate_lots_uniq(lots)
+        validate_lots_uniq(None)
+        with self.assertRaises(ValidationError) as e:
+            validate_lots_uniq(lots + [Lot({'id': '1' * 32})])
+        self.assertEqual(e.exception.message, [u"Lot id should be uniq for all lots: {}".format('1' * 32)])
+
+    def test_validate_values_uniq(self):
+        feature = Feature({'enum': [{'value': 0.1}, {'value': 0.2}]})
+        validate_values_uniq(feature.enum)
+        feature.enum[1].value = 0.1
+        with self.assertRaises(ValidationError) as e:
+            validate_values_uniq(feature.enum)
+        self.assertEqual(e.exception.message, [u"Feature value should be uniq for feature: 0.1"])
+
+    def test_validate_features_uniq(self):
+        features = [Feature({'code': i}) for i in ('a', 'b', 'b', 'c', 'a')]
+        validate_features_uniq(features[:2])
+        with self.assertRaises(ValidationError) as e:
+            validate_features_uniq(features)
+        self.assertEqual(e.exception.message, [u"Feature code should be uniq for all features: b, a"])
+
+
+class TenderWithLots(Tender):
+    lots = ListType(ModelType(Lot), default=list())
+    bids = ListType(ModelType(Bid), default=list())
+    complaints = ListType(ModelType(Complaint), default=list())
+    items = ListType(ModelType(Item))
+    awards = ListType(ModelType(Award), default=list())
+    features = ListType(ModelType(Feature))
+
+
+class TestTenderIndex(unittest.TestCase):
+
+    def test_lot_bids(self):
+        lot_ids = [uuid4().hex for _ in range(3)]
+        tender = TenderWithLots({
+            'lots': [{'id': i, 'title': 'Lot'} for i in lot_ids],
+            'bids': [
+                {'status': 'active', 'lotValues': [{'relatedLot': lot_ids[0]}, {'relatedLot': lot_ids[1]}]},
+                {'status': 'active', 'lotValues': [{'relatedLot': lot_ids[0]}, {'relatedLot': lot_ids[0]}]},
+                {'status': 'draft', 'lotValues': [{'relatedLot': lot_ids[2]}]},
+            ]
+        })
+        number_of_bids = [lot.numberOfBids for lot in tender.lots]
+        self.assertEqual(number_of_bids, [2, 1, 0])
+        self.assertIsNone(get_tender_index(tender))
+
+        with tender.indexed() as index:
+            self.assertIs(get_tender_index(tender), index)
+            self.assertEqual(index.lot_bids, {lot_ids[0]: 2, lot_ids[1]: 1})
+            self.assertEqual([lot.numberOfBids for lot in tender.lots], number_of_bids)
+            with tender.indexed() as nested_index:
+                self.assertIs(nested_index, index)
+            self.assertIs(get_tender_index(tender), index)
+        self.assertIsNone(get_tender_index(tender))
+
+    def test_complaints_decision_date(self):
+        tender = TenderWithLots({'complaints': [
+            {'title': 'complaint', 'dateDecision': '2017-10-02T12:00:00+03:00'},
+            {'title': 'complaint', 'dateDecision': '2017-10-05T12:00:00+03:00'},
+            {'title': 'complaint'},
+        ]})
+        with tender.indexed() as index:
+            self.assertEqual(index.complaints_decision_date, TZ.localize(datetime(2017, 10, 8)))
+
+        tender = TenderWithLots()
+        with tender.indexed() as index:
+            self.assertIsNone(index.complaints_decision_date)
+
+    def test_lookups(self):
+        lot_id, item_id, award_id = uuid4().hex, uuid4().hex, uuid4().hex
+        tender = TenderWithLots({
+            'lots': [{'id': lot_id, 'title': 'Lot'}],
+            'items': [{'id': item_id, 'description': 'Item'}],
+            'awards': [{'id': award_id, 'bid_id': uuid4().hex}],
+            'features': [{'code': 'OCDS-123', 'title': 'Feature', 'enum': [{'value': 0.1, 'title': 'Yes'}, {'value': 0, 'title': 'No'}]}],
+        })
+        with tender.indexed() as index:
+            self.assertIs(lookup_index(tender), index)
+            self.assertEqual(index.lot_ids, set([lot_id]))
+            self.assertIs(index.lots[lot_id], tender.lots[0])
+            self.assertEqual(index.item_ids, set([item_id]))
+            self.assertEqual(index.award_ids, set([award_id]))
+            self.assertEqual(index.feature_values, {'OCDS-123': set([0.1, 0])})
+        self.assertIsInstance(lookup_index(tender), TenderIndex)
+        self.assertIsNot(lookup_index(tender), lookup_index(tender))
+
+        tender = TenderWithLots()
+        index = lookup_index(tender)
+        self.assertEqual((index.lot_ids, index.item_ids, index.award_ids, index.feature_values), (set(), set(), set(), {}))
+
+
+class TestACL(unittest.TestCase):
+
+    def make_tender_data(self):
+        return {
+            '_id': uuid4().hex,
+            '_rev': '1-{}'.format(uuid4().hex),
+            'owner': 'broker',
+            'owner_token': 'tender_token',
+            'bids': [{'owner': 'broker{}'.format(i), 'owner_token': 'token{}'.format(i)} for i in range(3)],
+        }
+
+    def test_tender_acl(self):
+        tender_data = self.make_tender_data()
+        tender = TenderWithLots(tender_data)
+        acl = tender.__acl__()
+        self.assertEqual(acl, [
+            (Allow, 'broker0_token0', 'create_award_complaint'),
+            (Allow, 'broker1_token1', 'create_award_complaint'),
+            (Allow, 'broker2_token2', 'create_award_complaint'),
+            (Allow, 'broker_tender_token', 'edit_tender'),
+            (Allow, 'broker_tender_token', 'upload_tender_documents'),
+            (Allow, 'broker_tender_token', 'edit_complaint'),
+        ])
+        self.assertEqual(acl.by_principal['broker1_token1'], [(Allow, 'broker1_token1', 'create_award_complaint')])
+        self.assertEqual(len(acl.by_principal['broker_tender_token']), 3)
+        self.assertEqual(tender.__local_roles__(), {'broker_tender_token': 'tender_owner'})
+
+        # computed once per revision, copies do not change the cache
+        acl.append((Allow, 'other', 'edit_tender'))
+        self.assertIn('other', acl.by_principal)
+        tender = lazy_model(TenderWithLots, tender_data)
+        self.assertEqual(tender.__acl__(), acl[:-1])
+        self.assertNotIn('other', tender.__acl__().by_principal)
+        self.assertIn('bids', tender._data.pending)
+
+        # tenders being changed are not cached
+        tender = TenderWithLots(tender_data)
+        track_changes(tender)
+        tender.owner_token = 'changed'
+        tender.bids = tender.bids[:1]
+        self.assertEqual(len(tender.__acl__()), 4)
+        self.assertIn('broker_changed', tender.__acl__().by_principal)
+        self.assertEqual(tender.__local_roles__(), {'broker_changed': 'tender_owner'})
+        self.assertEqual(TenderWithLots(tender_data).__acl__(), acl[:-1])
+
+        tender_data['_rev'] = '2-{}'.format(uuid4().hex)
+        tender_data['bids'] = tender_data['bids'][:1]
+        tender = lazy_model(TenderWithLots, tender_data)
+        self.assertEqual(len(tender.__acl__()), 4)
+        self.assertIn('bids', tender._data.pending)
+
+        del tender_data['_rev']
+        tender = TenderWithLots(tender_data)
+        tender.bids = []
+        self.assertEqual(len(tender.__acl__()), 3)
+
+    def test_owner_acl(self):
+        bid = Bid({'owner': 'broker', 'owner_token': 'token'})
+        self.assertEqual(bid.__acl__(), [(Allow, 'broker_token', 'edit_bid')])
+        self.assertEqual(bid.__local_roles__(), {'broker_token': 'bid_owner'})
+        bid.owner_token = 'changed'
+        self.assertEqual(bid.__acl__(), [(Allow, 'broker_changed', 'edit_bid')])
+        self.assertEqual(bid.__local_roles__(), {'broker_changed': 'bid_owner'})
+
+        complaint = Complaint({'title': 'complaint', 'owner': 'broker', 'owner_token': 'token'})
+        acl = complaint.__acl__()
+        self.assertEqual(acl.by_principal['broker_token'], [
+            (Allow, 'broker_token', 'edit_complaint'),
+            (Allow, 'broker_token', 'upload_complaint_documents'),
+        ])
+        self.assertEqual(acl.by_principal['g:reviewers'], [(Allow, 'g:reviewers', 'edit_complaint')])
+        self.assertEqual(complaint.__local_roles__(), {'broker_token': 'complaint_owner'})
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TestPeriodEndRequired))
     suite.addTest(unittest.makeSuite(TestItemValidation))
     suite.addTest(unittest.makeSuite(TestModelsUtils))
     suite.addTest(unittest.makeSuite(TestTenderAuctionPeriod))
+    suite.addTest(unittest.makeSuite(TestTenderIndex))
+    suite.addTest(unittest.makeSuite(TestUniquenessValidators))
+    suite.addTest(unittest.makeSuite(TestACL))
     return suite
 
 
@@ -1,7 +1,15 @@
 # -*- coding: utf-8 -*-
 import os
 import unittest
+from datetime import timedelta
+from urllib import quote
+from couchdb.client import Row
+from mock import MagicMock, patch
+from openprocurement.api.utils import get_now
+from openprocurement.tender.core.design import ListingView
 from openprocurement.tender.core.tests.base import BaseWebTest
+from openprocurement.tender.core.utils import NEXT_CHECK_INDEX
+from openprocurement.tender.core.views.tender import TendersResource
 
 
 class TenderResourceTest(BaseWebTest):
@@ -68,10 +76,146 @@ class TenderResourceTest(BaseWebTest):
         self.assertNotIn('descending=1', response.json['prev_page']['uri'])
         self.assertIn('limit=10', response.json['prev_page']['uri'])
 
+    def test_listing_etag(self):
+        response = self.app.get('/tenders')
+        self.assertNotIn('ETag', response.headers)
+
+        self.app.app.registry.listing_etag = True
+        self.addCleanup(setattr, self.app.app.registry, 'listing_etag', False)
+        response = self.app.get('/tenders')
+        etag = response.headers['ETag']
+
+        response = self.app.get('/tenders', headers={'If-None-Match': etag}, status=304)
+        self.assertEqual(response.status, '304 Not Modified')
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.body, '')
+
+        response = self.app.get('/tenders?opt_pretty=1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status, '200 OK')
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        self.db.save({'_id': 'etag', 'doc_type': 'Other'})
+        response = self.app.get('/tenders', headers={'If-None-Match': etag})
+        self.assertEqual(response.status, '200 OK')
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+
+class StreamingTenderResourceTest(TenderResourceTest):
+
+    def setUp(self):
+        super(StreamingTenderResourceTest, self).setUp()
+        self.app.app.registry.listing_streaming = True
+
+    def tearDown(self):
+        self.app.app.registry.listing_streaming = False
+        super(StreamingTenderResourceTest, self).tearDown()
+
+
+@patch('openprocurement.tender.core.views.tender.context_unpack', MagicMock(return_value={}))
+class ListingResultsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.resource = TendersResource.__new__(TendersResource)
+        self.resource.db = MagicMock()
+        self.resource.request = MagicMock()
+        self.resource.LOGGER = MagicMock()
+        self.resource.FIELDS = ['status']
+        self.resource.object_name_for_listing = 'Tenders'
+        self.resource.log_message_id = 'tender_list_custom'
+        self.resource.serialize_func = lambda request, doc, fields: dict([(i, doc[i]) for i in fields if i in doc])
+
+    def make_query(self, view, projection):
+        return {
+            'view': view,
+            'fields': ['title'],
+            'view_fields': ['title', 'dateModified', 'id'],
+            'changes': False,
+            'list_view': ListingView(None, u'dateModified', u'', projection=projection),
+        }
+
+    @patch('openprocurement.tender.core.views.tender.LISTING_DESIGN')
+    def test_configure_listing(self, design):
+        resource = TendersResource(MagicMock(), MagicMock())
+        design.get_fields.assert_not_called()
+        resource.configure_listing()
+        design.get_fields.assert_called_once_with(resource.db)
+        self.assertIs(resource.FIELDS, design.get_fields.return_value)
+
+    def test_custom_fields(self):
+        rows = [Row(id='a', key='2017-01-01', value={}, doc={'id': 'a', 'title': 'Earth'})]
+        view = MagicMock(return_value=rows)
+        results = list(self.resource.iter_listing_results(self.make_query(view, False)))
+        self.assertEqual(results, [({'id': 'a', 'title': 'Earth'}, '2017-01-01')])
+        view.assert_called_once_with(include_docs=True)
+        self.resource.db.view.assert_not_called()
+
+    @patch('openprocurement.tender.core.views.tender.fetch_docs')
+    def test_custom_fields_projections(self, fetch_docs):
+        fetch_docs.return_value = {'a': {'id': 'a', 'title': 'Earth'}}
+        view = MagicMock(return_value=[Row(id='a', key='2017-01-01', value={}), Row(id='b', key='2017-01-02', value={})])
+        results = list(self.resource.iter_listing_results(self.make_query(view, True)))
+        self.assertEqual(results, [({'id': 'a', 'title': 'Earth'}, '2017-01-01')])
+        view.assert_called_once_with()
+        fetch_docs.assert_called_once_with(self.resource.db, ['a', 'b'])
+
+        fetch_docs.reset_mock()
+        self.resource.fetch_batch_size = 1
+        view.return_value = iter(view.return_value)
+        results = list(self.resource.iter_listing_results(self.make_query(view, True)))
+        self.assertEqual(results, [({'id': 'a', 'title': 'Earth'}, '2017-01-01')])
+        self.assertEqual([i[0][1] for i in fetch_docs.call_args_list], [['a'], ['b']])
+
+
+class DueTendersResourceTest(BaseWebTest):
+    relative_to = os.path.dirname(__file__)
+
+    def setUp(self):
+        super(DueTendersResourceTest, self).setUp()
+        NEXT_CHECK_INDEX.enabled = True
+
+    def tearDown(self):
+        NEXT_CHECK_INDEX.enabled = False
+        super(DueTendersResourceTest, self).tearDown()
+
+    def test_due_tenders(self):
+        now = get_now()
+        for i, hours in enumerate([-1, -3, 1, -2]):
+            NEXT_CHECK_INDEX.save(self.db, 'tender{}'.format(i), {'next_check': (now + timedelta(hours=hours)).isoformat()})
+        self.db.save({'_id': 'tender4', 'doc_type': 'Tender'})
+
+        self.app.authorization = ('Basic', ('broker', ''))
+        response = self.app.get('/due_tenders', status=403)
+        self.assertEqual(response.status, '403 Forbidden')
+
+        self.app.authorization = ('Basic', ('chronograph', ''))
+        response = self.app.get('/due_tenders?limit=2')
+        self.assertEqual(response.status, '200 OK')
+        self.assertEqual([i['id'] for i in response.json['data']], ['tender1', 'tender3'])
+        offset = response.json['next_page']['offset']
+        self.assertEqual(offset, '{}_tender3'.format(response.json['data'][1]['next_check']))
+
+        response = self.app.get('/due_tenders?limit=2&offset={}'.format(quote(offset)))
+        self.assertEqual([i['id'] for i in response.json['data']], ['tender0'])
+        offset = response.json['next_page']['offset']
+
+        response = self.app.get('/due_tenders?limit=2&offset={}'.format(quote(offset)))
+        self.assertEqual(response.json['data'], [])
+        self.assertEqual(response.json['next_page']['offset'], offset)
+
+        response = self.app.get('/due_tenders?offset=invalid', status=404)
+        self.assertEqual(response.json['errors'][0]['description'], 'Offset expired/invalid')
+
+        NEXT_CHECK_INDEX.enabled = False
+        response = self.app.get('/due_tenders', status=404)
+        self.assertEqual(response.status, '404 Not Found')
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TenderResourceTest))
+    suite.addTest(unittest.makeSuite(StreamingTenderResourceTest))
+    suite.addTest(unittest.makeSuite(ListingResultsTest))
+    suite.addTest(unittest.makeSuite(DueTendersResourceTest))
     return suite
 
 
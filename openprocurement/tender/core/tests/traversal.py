@@ -3,7 +3,9 @@
 import os
 import unittest
 
-from openprocurement.tender.core.traversal import Root, factory
+from openprocurement.tender.core.traversal import (
+    Root, factory, get_item, ResourceTable, RESOURCES, ACL, AuthorizationPolicy
+)
 from openprocurement.tender.core.tests.base import BaseWebTest
 
 from pyramid.security import (
@@ -12,6 +14,7 @@ from pyramid.security import (
     Deny,
     Everyone,
 )
+from pyramid.authorization import ACLAuthorizationPolicy
 from mock import MagicMock, patch
 from munch import munchify
 
@@ -85,6 +88,7 @@ class TraversalTest(BaseWebTest):
             (Allow, 'g:contracting', 'extract_credentials'),
             (Allow, 'g:competitive_dialogue', 'create_tender'),
             (Allow, 'g:chronograph', 'edit_tender'),
+            (Allow, 'g:chronograph', 'view_due_tenders'),
             (Allow, 'g:Administrator', 'edit_tender'),
             (Allow, 'g:Administrator', 'edit_bid'),
             (Allow, 'g:admins', ALL_PERMISSIONS),
@@ -226,6 +230,144 @@ class TraversalTest(BaseWebTest):
         response = factory(request)
         self.assertEqual(response.id, self.test_data['id'])
 
+    @patch('openprocurement.tender.core.utils.error_handler')
+    def test_get_item(self, mocked_error_handler):
+        mocked_error_handler.return_value = Exception('Oops.')
+        tender = munchify({
+            'id': 'tender_id',
+            'documents': [
+                {'id': 'document_id', 'title': 'first.pdf'},
+                {'id': 'other_id', 'title': 'other.pdf'},
+                {'id': 'document_id', 'title': 'second.pdf'},
+            ],
+        })
+        request = MagicMock()
+        request.validated = {}
+        request.matchdict = {'document_id': 'document_id'}
+        document = get_item(tender, 'document', request)
+        self.assertEqual(document.title, 'second.pdf')
+        self.assertIs(document.__parent__, tender)
+        self.assertEqual([i.title for i in request.validated['documents']], ['first.pdf', 'second.pdf'])
+        self.assertEqual(request.validated['document_id'], 'document_id')
+        self.assertEqual(request.validated['id'], 'document_id')
+
+        # the index is rebuilt when the list changes
+        tender.documents.append(munchify({'id': 'document_id', 'title': 'third.pdf'}))
+        self.assertEqual(get_item(tender, 'document', request).title, 'third.pdf')
+
+        request.matchdict = {'document_id': 'missing_id'}
+        with self.assertRaises(Exception):
+            get_item(tender, 'document', request)
+        self.assertEqual(request.errors.status, 404)
+        request.errors.add.assert_called_once_with('url', 'document_id', 'Not Found')
+
+    def test_resource_table(self):
+        self.assertEqual(RESOURCES.resolve({'tender_id': 'id'}), [])
+        self.assertEqual(RESOURCES.resolve({'tender_id': 'id', 'award_id': 'a', 'complaint_id': 'c', 'document_id': 'd'}), [
+            ('award', 'awards'), ('complaint', 'complaints'), ('document', 'documents')
+        ])
+        self.assertEqual(RESOURCES.resolve({'tender_id': 'id', 'complaint_id': 'c', 'document_id': 'd'}), [
+            ('complaint', 'complaints'), ('document', 'documents')
+        ])
+        # keys of different branches follow the order of the rules
+        self.assertEqual(RESOURCES.resolve({'tender_id': 'id', 'bid_id': 'b', 'lot_id': 'l'}), [('bid', 'bids')])
+
+        table = ResourceTable([('award_id', 'awards', [])])
+        self.assertEqual(table.resolve({'award_id': 'a', 'milestone_id': 'm'}), [('award', 'awards')])
+        table.add(('award_id', 'milestone_id'))
+        table.add(('qualification_id',), 'qualifications')
+        table.compile()
+        self.assertEqual(table.resolve({'award_id': 'a', 'milestone_id': 'm'}), [('award', 'awards'), ('milestone', 'milestones')])
+        self.assertEqual(table.resolve({'qualification_id': 'q'}), [('qualification', 'qualifications')])
+        self.assertEqual(table.resolve({'milestone_id': 'm'}), [])
+
+    def test_authorization_policy(self):
+        request = MagicMock()
+        root = Root(request)
+        tender = munchify({'id': 'tender_id'})
+        tender.__parent__ = root
+        tender.__acl__ = lambda: [
+            (Allow, 'broker_token', 'edit_tender'),
+            (Deny, 'broker_token', 'create_bid'),
+            (Allow, 'g:brokers', ('edit_tender', 'create_bid')),
+        ]
+        bid = munchify({'id': 'bid_id'})
+        bid.__parent__ = tender
+        bid.__acl__ = ACL([(Allow, 'bidder_token', 'edit_bid')])
+        principals = [
+            [Everyone],
+            [Everyone, 'g:brokers'],
+            [Everyone, 'g:brokers', 'broker_token'],
+            [Everyone, 'g:brokers', 'bidder_token'],
+            [Everyone, 'broker05', 'g:brokers'],
+            [Everyone, 'g:admins'],
+            [Everyone, 'g:chronograph'],
+        ]
+        permissions = [
+            'view_tender', 'create_bid', 'create_tender', 'edit_tender',
+            'edit_bid', 'create_complaint', 'upload_tender_documents', 'unknown',
+        ]
+        policy = AuthorizationPolicy()
+        for context in (root, tender, bid):
+            for i in principals:
+                for permission in permissions:
+                    expected = ACLAuthorizationPolicy().permits(context, i, permission)
+                    result = policy.permits(context, i, permission)
+                    self.assertEqual(bool(result), bool(expected), (context, i, permission))
+                    self.assertEqual(result.ace, expected.ace)
+                    self.assertIs(policy.permits(context, i, permission), result)
+
+    def test_authorization_policy_acl_errors(self):
+        class Context(object):
+            __parent__ = Root(MagicMock())
+
+            def __acl__(self):
+                return self.owner_acl  # a bug in the ACL builder
+
+        with self.assertRaises(AttributeError):
+            AuthorizationPolicy().permits(Context(), [Everyone], 'view_tender')
+
+    def test_acl_lookup(self):
+        acl = ACL([
+            (Deny, 'broker05', 'create_bid'),
+            (Allow, 'g:brokers', ['create_bid', 'create_tender']),
+            (Allow, 'g:admins', ALL_PERMISSIONS),
+            (Allow, 'g:brokers', 'create_bid'),
+        ])
+        self.assertEqual(acl.lookup(['g:brokers', 'broker05'], 'create_bid'), (Deny, 'broker05', 'create_bid'))
+        self.assertEqual(acl.lookup(['g:brokers'], 'create_tender'), (Allow, 'g:brokers', ['create_bid', 'create_tender']))
+        self.assertEqual(acl.lookup(['g:admins', 'g:brokers'], 'anything'), (Allow, 'g:admins', ALL_PERMISSIONS))
+        self.assertIsNone(acl.lookup(['g:brokers'], 'anything'))
+        self.assertEqual(len(acl.by_principal['g:brokers']), 2)
+        acl.insert(0, (Deny, 'g:brokers', 'create_tender'))
+        self.assertEqual(acl.lookup(['g:brokers'], 'create_tender'), (Deny, 'g:brokers', 'create_tender'))
+
+        # changes that keep the length rebuild the index too
+        acl[0] = (Allow, 'g:brokers', 'anything')
+        self.assertEqual(acl.lookup(['g:brokers'], 'anything'), (Allow, 'g:brokers', 'anything'))
+        acl[0:1] = [(Deny, 'g:brokers', 'anything')]
+        self.assertEqual(acl.lookup(['g:brokers'], 'anything'), (Deny, 'g:brokers', 'anything'))
+        acl.reverse()
+        self.assertEqual(acl.lookup(['g:brokers'], 'create_bid'), (Allow, 'g:brokers', 'create_bid'))
+        del acl[0]
+        acl += [(Deny, 'g:admins', 'anything')]
+        self.assertEqual(acl.lookup(['g:admins'], 'anything'), (Allow, 'g:admins', ALL_PERMISSIONS))
+        acl.remove((Allow, 'g:admins', ALL_PERMISSIONS))
+        self.assertEqual(acl.lookup(['g:admins'], 'anything'), (Deny, 'g:admins', 'anything'))
+
+    def test_authorization_policy_changed_context(self):
+        class Context(object):
+            __parent__ = Root(MagicMock())
+
+        tender = Context()
+        tender.__acl__ = ACL([(Allow, 'broker_token', 'edit_tender')])
+        tender._tracked_fields = {}  # see utils.track_changes
+        policy = AuthorizationPolicy()
+        self.assertTrue(policy.permits(tender, ['broker_token'], 'edit_tender'))
+        tender.__acl__[0] = (Allow, 'broker_changed', 'edit_tender')
+        self.assertFalse(policy.permits(tender, ['broker_token'], 'edit_tender'))
+        self.assertNotIn('_permits', tender.__dict__)
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -1,21 +1,40 @@
 # -*- coding: utf-8 -*-
+import json
 import unittest
 from copy import deepcopy
 from datetime import datetime, timedelta, time
 from mock import patch, MagicMock, call
+from threading import Thread
 from schematics.transforms import wholelist
 from schematics.types import StringType
+from schematics.types.compound import ModelType
+from schematics.types.serializable import serializable
 from pyramid.exceptions import URLDecodeError
+from pyramid.httpexceptions import HTTPNotModified
+from couchdb.client import Row
+from couchdb.http import ResourceConflict, ResourceNotFound
 from uuid import uuid4
 from openprocurement.tender.core.utils import (
     generate_tender_id, tender_serialize, tender_from_data,
     register_tender_procurementMethodType, calculate_business_date,
     isTender, SubscribersPicker, extract_tender, has_unanswered_complaints,
-    has_unanswered_questions, remove_draft_bids, save_tender, apply_patch
+    has_unanswered_questions, remove_draft_bids, save_tender, apply_patch,
+    TenderIDAllocator, track_changes, get_changed_fields, serialize_changes,
+    get_tender_src, RevisionsStorage, WorkingDaysCalendar,
+    calendar_business_date, iterate_business_date, get_sandbox_directives,
+    parse_sandbox_directives, SandboxDirectives, ListingProjections,
+    iter_json_listing, tender_listing_serialize, fetch_docs, lazy_model,
+    extract_tender_adapter, SerializationCache, get_time_bucket, get_lazy_items,
+    get_state_summary, cleanup_bids_for_cancelled_lots, NextCheckIndex
 )
 from openprocurement.api.constants import TZ
+from openprocurement.api.models import Revision, ListType
+from openprocurement.api.utils import get_revision_changes, apply_data_patch
+from openprocurement.tender.core.tests.base import LocalCouchDB
+from openprocurement.tender.core.design import ListingView, ListingDesign, DEFAULT_FIELDS
 from openprocurement.tender.core.models import (
-    Tender as BaseTender, Lot, Complaint, Item, Question, Bid
+    Tender as BaseTender, Lot, Complaint, Item, Question, Bid, Award, Cancellation,
+    Feature, Document
 )
 
 
@@ -31,6 +50,17 @@ class Tender(BaseTender):
     )
 
 
+class TenderWithNextCheck(Tender):
+    @serializable(serialize_when_none=False)
+    def next_check(self):
+        return '2017-10-12T00:00:00+03:00' if self.status == 'active.tendering' else None
+
+
+class TenderWithBids(Tender):
+    bids = ListType(ModelType(Bid), default=list())
+    items = ListType(ModelType(Item))
+
+
 class TestUtils(unittest.TestCase):
 
     def setUp(self):
@@ -71,6 +101,49 @@ class TestUtils(unittest.TestCase):
             server_id and '-' + server_id)
         self.assertEqual(tid, tender_id)
 
+    def test_generate_tender_id_block_leasing(self):
+        ctime = datetime(2017, 10, 7, 12, tzinfo=TZ)
+        db = LocalCouchDB()
+        allocator = TenderIDAllocator(block_size=10)
+
+        tender_ids = [generate_tender_id(ctime, db, '7', allocator) for _ in range(25)]
+        self.assertEqual(tender_ids, ['UA-2017-10-07-{:06}-7'.format(i) for i in range(1, 26)])
+        self.assertEqual(db.writes, 3)
+        self.assertEqual(db.docs['tenderID_7']['2017-10-07'], 31)
+
+        # unused numbers are returned on day rollover
+        tender_id = generate_tender_id(ctime + timedelta(days=1), db, '7', allocator)
+        self.assertEqual(tender_id, 'UA-2017-10-08-000001-7')
+        self.assertEqual(db.docs['tenderID_7']['2017-10-07'], 26)
+        self.assertEqual(db.docs['tenderID_7']['2017-10-08'], 11)
+
+        # ... and on release if nobody leased after us
+        other = TenderIDAllocator(block_size=10)
+        self.assertEqual(generate_tender_id(ctime + timedelta(days=1), db, '7', other), 'UA-2017-10-08-000011-7')
+        allocator.release()
+        self.assertEqual(db.docs['tenderID_7']['2017-10-08'], 21)
+        other.release()
+        self.assertEqual(db.docs['tenderID_7']['2017-10-08'], 12)
+
+    def test_generate_tender_id_concurrent_allocators(self):
+        ctime = datetime(2017, 10, 7, 12, tzinfo=TZ)
+        db = LocalCouchDB()
+        tender_ids = []
+
+        def create(allocator):
+            for _ in range(50):
+                tender_ids.append(generate_tender_id(ctime, db, '', allocator))
+            allocator.release()
+
+        threads = [Thread(target=create, args=(TenderIDAllocator(block_size=7),)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(tender_ids), 400)
+        self.assertEqual(len(set(tender_ids)), 400)
+        self.assertTrue(all([i.startswith('UA-2017-10-07-') for i in tender_ids]))
+
     def test_tender_serialize(self):
         request = MagicMock()
         request.tender_from_data.return_value = None
@@ -89,6 +162,47 @@ class TestUtils(unittest.TestCase):
         tender = tender_serialize(request, self.tender_data, fields)
         self.assertEqual(tender, self.tender_data)
 
+    def test_tender_listing_serialize(self):
+        request = MagicMock()
+        request.registry.tender_procurementMethodTypes.get.return_value = TenderWithBids
+        request.context = None
+        tender = TenderWithBids(self.tender_data)
+        tender.bids = [Bid({'id': uuid4().hex, 'status': 'active', 'tenderers': [{'name': 'Tenderer'}]})]
+        doc = tender.to_primitive()
+        doc['_id'] = tender.id
+
+        fields = ['id', 'dateModified', 'status', 'tenderID']
+        with patch('openprocurement.tender.core.utils.lazy_model', wraps=lazy_model) as mocked_lazy_model:
+            data = tender_listing_serialize(request, doc, fields)
+            self.assertEqual(mocked_lazy_model.call_count, 0)
+            self.assertEqual(data, dict([(i, j) for i, j in tender.serialize('draft').items() if i in fields]))
+
+            fields.append('bids')
+            data = tender_listing_serialize(request, doc, fields)
+            self.assertEqual(mocked_lazy_model.call_count, 0)
+            self.assertEqual(data, dict([(i, j) for i, j in tender.serialize('draft').items() if i in fields]))
+
+            # doc_id serializable is exported from the model
+            del doc['_id']
+            data = tender_listing_serialize(request, doc, fields)
+            self.assertEqual(mocked_lazy_model.call_count, 1)
+            self.assertEqual(data, dict([(i, j) for i, j in tender.serialize('draft').items() if i in fields]))
+
+        request.registry.tender_procurementMethodTypes.get.return_value = None
+        request.tender_from_data.return_value = None
+        self.assertEqual(tender_listing_serialize(request, doc, fields), tender_serialize(request, doc, fields))
+
+    def test_fetch_docs(self):
+        db = LocalCouchDB()
+        db.save({'_id': 'a', 'title': 'A'})
+        db.save({'_id': 'b', 'title': 'B'})
+        self.assertEqual(fetch_docs(db, []), {})
+        self.assertEqual(db.reads, 0)
+        docs = fetch_docs(db, ['b', 'a', 'c'])
+        self.assertEqual(db.reads, 1)
+        self.assertEqual(sorted(docs), ['a', 'b'])
+        self.assertEqual(docs['b']['title'], 'B')
+
     def test_register_tender_procurementMethodType(self):
         config = MagicMock()
         config.registry.tender_procurementMethodTypes = {}
@@ -136,6 +250,51 @@ class TestUtils(unittest.TestCase):
         )
         self.assertEqual(business_date, datetime(2017, 10, 18))
 
+    def test_working_days_calendar(self):
+        working_days = {'2017-10-16': True, '2017-10-21': False}
+        calendar = WorkingDaysCalendar(working_days, datetime(2017, 8, 1).date(), datetime(2018, 1, 1).date())
+        with patch('openprocurement.tender.core.utils.WORKING_DAYS', working_days):
+            for day in xrange(60):
+                date_obj = TZ.localize(datetime(2017, 9, 20, 13, 30) + timedelta(day))
+                for delta in [timedelta(0), timedelta(hours=5), timedelta(hours=-5)] + \
+                        [timedelta(days) for days in xrange(-15, 16)]:
+                    self.assertEqual(calendar_business_date(calendar, date_obj, delta),
+                                     iterate_business_date(date_obj, delta))
+        date_obj = datetime(2017, 10, 13, 10)
+        self.assertEqual(calendar_business_date(calendar, date_obj, timedelta(1)), datetime(2017, 10, 17, 10))
+        self.assertEqual(calendar_business_date(calendar, date_obj, timedelta(2)), datetime(2017, 10, 18, 10))
+        self.assertEqual(calendar_business_date(calendar, date_obj, timedelta(5)), datetime(2017, 10, 21, 10))
+        self.assertEqual(calendar_business_date(calendar, datetime(2017, 10, 16, 10), timedelta(-1)),
+                         datetime(2017, 10, 13))
+        # out of the compiled range
+        self.assertIsNone(calendar_business_date(calendar, datetime(2017, 12, 25), timedelta(10)))
+        self.assertIsNone(calendar_business_date(calendar, datetime(2017, 8, 5), timedelta(-10)))
+        self.assertIsNone(calendar_business_date(calendar, datetime(2018, 1, 1), timedelta(1)))
+
+    @patch('openprocurement.tender.core.utils.SANDBOX_MODE', True)
+    def test_get_sandbox_directives(self):
+        self.assertEqual(get_sandbox_directives(None), SandboxDirectives(None, False, False, False))
+        self.assertEqual(
+            get_sandbox_directives({'procurementMethodDetails': 'quick, accelerator=1440',
+                                    'submissionMethodDetails': 'quick(mode:no-auction)'}),
+            SandboxDirectives(1440, True, True, False)
+        )
+
+        tender = Tender({'submissionMethodDetails': 'quick(mode:fast-forward)'})
+        with patch('openprocurement.tender.core.utils.parse_sandbox_directives',
+                   wraps=parse_sandbox_directives) as mocked_parse:
+            directives = get_sandbox_directives(tender)
+            self.assertEqual(directives, SandboxDirectives(None, True, False, True))
+            self.assertIs(get_sandbox_directives(tender), directives)
+            self.assertEqual(mocked_parse.call_count, 1)
+
+            tender.submissionMethodDetails = 'quick'
+            self.assertEqual(get_sandbox_directives(tender), SandboxDirectives(None, True, False, False))
+            self.assertEqual(mocked_parse.call_count, 2)
+
+        with patch('openprocurement.tender.core.utils.SANDBOX_MODE', False):
+            self.assertEqual(parse_sandbox_directives(None, 'quick'), SandboxDirectives(None, False, False, False))
+
     @patch('openprocurement.tender.core.utils.error_handler')
     def test_tender_from_data(self, mocked_handler):
         mocked_handler.return_value = Exception('Mocked!')
@@ -161,6 +320,57 @@ class TestUtils(unittest.TestCase):
         model = tender_from_data(request, self.tender_data)
         self.assertIsInstance(model, Tender)
 
+    def test_tender_from_data_lazy(self):
+        request = MagicMock()
+        request.registry.tender_procurementMethodTypes.get.return_value = TenderWithBids
+        tender_data = deepcopy(self.tender_data)
+        tender_data['items'] = [i.serialize() for i in self.items]
+
+        tender = tender_from_data(request, tender_data, lazy=True)
+        self.assertIsInstance(tender, TenderWithBids)
+        self.assertIs(tender._initial, tender_data)
+        self.assertEqual(tender.status, 'draft')
+        self.assertEqual(tender._data.pending.keys(), ['items'])
+        self.assertEqual(tender.items[0].description, 'Some item')
+        self.assertIs(tender.items[0].__parent__, tender)
+        self.assertEqual(tender._data.pending, {})
+        self.assertEqual(tender.serialize('draft'), tender_from_data(request, tender_data).serialize('draft'))
+
+    def test_get_lazy_items(self):
+        tender_data = deepcopy(self.tender_data)
+        tender_data['bids'] = [{
+            'id': uuid4().hex,
+            'status': 'active',
+            'tenderers': [{'name': 'Tenderer {}'.format(i)}],
+            'documents': [
+                {'id': 'document', 'title': 'first.pdf'},
+                {'id': 'other', 'title': 'other.pdf'},
+                {'id': 'document', 'title': 'second.pdf'},
+            ],
+        } for i in xrange(3)]
+        tender = lazy_model(TenderWithBids, tender_data)
+
+        bids = get_lazy_items(tender, 'bids', tender_data['bids'][1]['id'])
+        self.assertEqual(len(bids), 1)
+        bid = bids[0]
+        self.assertIsInstance(bid, Bid)
+        self.assertEqual(bid.tenderers[0].name, 'Tenderer 1')
+        self.assertIn('bids', tender._data.pending)
+        self.assertIn('documents', bid._data.pending)
+        self.assertIs(get_lazy_items(tender, 'bids', bid.id)[0], bid)
+        self.assertEqual(get_lazy_items(tender, 'bids', 'missing'), [])
+
+        documents = get_lazy_items(bid, 'documents', 'document')
+        self.assertEqual([i.title for i in documents], ['first.pdf', 'second.pdf'])
+        self.assertIn('documents', bid._data.pending)
+        self.assertEqual(bid.serialize('view'), TenderWithBids(tender_data).bids[1].serialize('view'))
+
+        # converted fields and models that are not lazy are left to get_item
+        self.assertEqual(len(tender.bids), 3)
+        self.assertIsNone(get_lazy_items(tender, 'bids', bid.id))
+        self.assertIsNone(get_lazy_items(TenderWithBids(tender_data), 'bids', bid.id))
+        self.assertIsNone(get_lazy_items(tender, 'status', bid.id))
+
     @patch('openprocurement.tender.core.utils.decode_path_info')
     @patch('openprocurement.tender.core.utils.error_handler')
     def test_extract_tender(self, mocked_error_handler, mocked_decode_path):
@@ -222,6 +432,126 @@ class TestUtils(unittest.TestCase):
         for k in tender_data:
             self.assertEqual(tender_data[k], serialized_tender[k])
 
+    def test_extract_tender_etag(self):
+        tender_data = deepcopy(self.tender_data)
+        tender_data.update({'doc_type': 'Tender', '_rev': '1-abc'})
+        principals = ['system.Everyone', 'system.Authenticated', 'broker', 'g:brokers']
+        request = MagicMock(method='GET', path_qs='/api/2.3/tenders/{}'.format(tender_data['id']),
+                            effective_principals=principals, if_none_match=[])
+        request.registry.db.get.return_value = tender_data
+
+        extract_tender_adapter(request, tender_data['id'])
+        etag = request.response.etag
+        self.assertEqual(request.response.vary, ('Authorization', 'X-Access-Token'))
+        request.tender_from_data.assert_called_once_with(tender_data, lazy=True)
+
+        request.tender_from_data.reset_mock()
+        request.if_none_match = [etag]
+        with self.assertRaises(HTTPNotModified) as e:
+            extract_tender_adapter(request, tender_data['id'])
+        self.assertEqual(e.exception.etag, etag)
+        self.assertEqual(e.exception.vary, ('Authorization', 'X-Access-Token'))
+        request.tender_from_data.assert_not_called()
+
+        for changes in [{'_rev': '2-def'}, {'status': 'active.tendering'}]:
+            doc = dict(tender_data, **changes)
+            request.registry.db.get.return_value = doc
+            extract_tender_adapter(request, tender_data['id'])
+            self.assertNotEqual(request.response.etag, etag)
+        request.registry.db.get.return_value = tender_data
+        for other in [['system.Everyone', 'system.Authenticated', 'other', 'g:brokers'],
+                      principals + ['broker_{}'.format(uuid4().hex)]]:
+            request.effective_principals = other
+            extract_tender_adapter(request, tender_data['id'])
+            self.assertNotEqual(request.response.etag, etag)
+
+        request.method = 'PATCH'
+        request.effective_principals = principals
+        request.response.etag = None
+        extract_tender_adapter(request, tender_data['id'])
+        self.assertIsNone(request.response.etag)
+        request.tender_from_data.assert_called_with(tender_data, lazy=False)
+
+    def test_serialization_cache(self):
+        doc = dict(self.tender_data, _id=self.tender_data['id'], _rev='1-abc')
+        cache = SerializationCache()
+        tender = Tender(doc)
+        cache.bind(tender, doc)
+        self.assertNotIn('_serialization_key', tender.__dict__)
+
+        cache.size = 2
+        cache.bind(tender, doc)
+        self.assertEqual(tender.__dict__['_serialization_key'], (doc['_id'], '1-abc', 0))
+        serialize = MagicMock(side_effect=Tender(doc).serialize)
+        data = cache.serialize(tender, 'draft', serialize)
+        self.assertEqual(data, Tender(doc).serialize('draft'))
+        data['status'] = 'changed'
+        self.assertEqual(cache.serialize(tender, 'draft', serialize), Tender(doc).serialize('draft'))
+        serialize.assert_called_once_with('draft')
+        self.assertEqual(cache.metrics(), {'size': 1, 'hits': 1, 'shared_hits': 0, 'misses': 1, 'evictions': 0, 'hit_rate': 0.5})
+
+        cache.serialize(tender, 'plain', serialize)
+        tender.__dict__['_serialization_key'] = (doc['_id'], '2-def', 0)
+        cache.serialize(tender, 'draft', serialize)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.items.keys(), [
+            'tender:{}:1-abc:plain:0'.format(doc['_id']), 'tender:{}:2-def:draft:0'.format(doc['_id'])
+        ])
+
+        shared = {}
+        cache = SerializationCache(size=1, shared=MagicMock(get=shared.get, set=shared.__setitem__))
+        cache.bind(tender, doc)
+        cache.serialize(tender, 'draft', serialize)
+        cache.items.clear()
+        self.assertEqual(cache.serialize(tender, 'draft', serialize), Tender(doc).serialize('draft'))
+        self.assertEqual((cache.hits, cache.shared_hits, cache.misses), (0, 1, 1))
+
+        # misses give the same JSON decoded data as hits
+        cache = SerializationCache(size=1)
+        cache.bind(tender, doc)
+        serialize = MagicMock(return_value={'period': ('2017-10-10', '2017-10-11')})
+        miss = cache.serialize(tender, 'view', serialize)
+        self.assertEqual(miss, {u'period': [u'2017-10-10', u'2017-10-11']})
+        self.assertEqual([type(i) for i in miss], [unicode])
+        self.assertEqual(cache.serialize(tender, 'view', serialize), miss)
+
+        # models bound to a stored revision are serialized through the cache
+        with patch('openprocurement.tender.core.models.SERIALIZATION_CACHE', cache):
+            self.assertEqual(tender.serialize('draft'), Tender(doc).serialize('draft'))
+            self.assertEqual(cache.hits, 1)
+            Tender(doc).serialize('draft')
+            self.assertEqual(cache.hits, 1)
+
+    @patch('openprocurement.tender.core.utils.get_now')
+    def test_get_time_bucket(self, mocked_get_now):
+        mocked_get_now.return_value = datetime(2017, 10, 10, 10, 10, tzinfo=TZ)
+        doc = dict(self.tender_data)
+        self.assertEqual(get_time_bucket(doc, 60), 0)
+        doc['auctionPeriod'] = {'startDate': '2017-10-10T10:00:00+03:00'}
+        bucket = get_time_bucket(doc, 60)
+        self.assertNotEqual(bucket, 0)
+        mocked_get_now.return_value += timedelta(seconds=50)
+        self.assertEqual(get_time_bucket(doc, 60), bucket)
+        mocked_get_now.return_value += timedelta(seconds=10)
+        self.assertEqual(get_time_bucket(doc, 60), bucket + 1)
+        self.assertEqual(get_time_bucket(doc, 0), 0)
+        doc['auctionPeriod']['endDate'] = '2017-10-10T11:00:00+03:00'
+        self.assertEqual(get_time_bucket(doc, 60), 0)
+        doc['lots'] = [{'auctionPeriod': {'startDate': '2017-10-10T10:00:00+03:00'}}]
+        self.assertEqual(get_time_bucket(doc, 60), bucket + 1)
+
+        doc = dict(self.tender_data, status='active.tendering')
+        self.assertEqual(get_time_bucket(doc, 60, Tender), 0)
+        with patch.object(Tender, 'time_dependent_statuses', ('active.tendering',)):
+            self.assertEqual(get_time_bucket(doc, 60, Tender), bucket + 1)
+            self.assertEqual(get_time_bucket(dict(doc, status='complete'), 60, Tender), 0)
+
+    def assertUnanswered(self, expected, check, tender, *args):
+        # without an index the lists are scanned, with it TenderStateSummary is used
+        self.assertEqual(expected, check(tender, *args))
+        with tender.indexed():
+            self.assertEqual(expected, check(tender, *args))
+
     def test_has_unanswered_complaints(self):
         tender = Tender(self.tender_data)
         tender.block_tender_complaint_status = ['pending']
@@ -231,15 +561,15 @@ class TestUtils(unittest.TestCase):
             'relatedLot': '11111111111111111111111111111111',
             'title': 'Earth is mine!'
         })]
-        self.assertEqual(True, has_unanswered_complaints(tender))
+        self.assertUnanswered(True, has_unanswered_complaints, tender)
 
         tender.complaints[0].relatedLot = '33333333333333333333333333333333'
-        self.assertEqual(False, has_unanswered_complaints(tender))
+        self.assertUnanswered(False, has_unanswered_complaints, tender)
 
-        self.assertEqual(True, has_unanswered_complaints(tender, False))
+        self.assertUnanswered(True, has_unanswered_complaints, tender, False)
 
         tender.complaints[0].status = 'resolved'
-        self.assertEqual(False, has_unanswered_complaints(tender, False))
+        self.assertUnanswered(False, has_unanswered_complaints, tender, False)
 
     def test_has_unanswered_questions(self):
         tender = Tender(self.tender_data)
@@ -250,12 +580,164 @@ class TestUtils(unittest.TestCase):
             'relatedItem': '11111111111111111111111111111111',
             'title': 'Do you have some Earth?'
         })]
-        self.assertEqual(True, has_unanswered_questions(tender))
-        self.assertEqual(True, has_unanswered_questions(tender, False))
+        self.assertUnanswered(True, has_unanswered_questions, tender)
+        self.assertUnanswered(True, has_unanswered_questions, tender, False)
+
+        tender.questions[0].relatedItem = '33333333333333333333333333333333'
+        self.assertUnanswered(False, has_unanswered_questions, tender)
+        self.assertUnanswered(True, has_unanswered_questions, tender, False)
+        tender.questions[0].questionOf = 'item'
+        tender.questions[0].relatedItem = tender.items[0].id
+        self.assertUnanswered(True, has_unanswered_questions, tender)
+        tender.lots[0].status = 'cancelled'
+        self.assertUnanswered(False, has_unanswered_questions, tender)
 
         tender.questions[0].answer = 'No'
-        self.assertEqual(False, has_unanswered_questions(tender))
-        self.assertEqual(False, has_unanswered_questions(tender, False))
+        self.assertUnanswered(False, has_unanswered_questions, tender)
+        self.assertUnanswered(False, has_unanswered_questions, tender, False)
+
+    def test_cleanup_bids_for_cancelled_lots(self):
+        earth, mars = [i.id for i in self.lots]
+        tender = TenderWithBids(self.tender_data)
+        tender.lots = self.lots
+        tender.items = self.items + [Item({'description': 'Red item', 'relatedLot': mars})]
+        tender.features = [
+            Feature({'code': 'earth', 'featureOf': 'lot', 'relatedItem': earth, 'title': 'Earth'}),
+            Feature({'code': 'mars', 'featureOf': 'lot', 'relatedItem': mars, 'title': 'Mars'}),
+            Feature({'code': 'red', 'featureOf': 'item', 'relatedItem': tender.items[1].id, 'title': 'Red'}),
+            Feature({'code': 'tenderer', 'featureOf': 'tenderer', 'title': 'Tenderer'}),
+        ]
+        tender.bids = [
+            Bid({
+                'lotValues': [{'relatedLot': earth}, {'relatedLot': mars}],
+                'parameters': [{'code': i, 'value': 0.1} for i in ('earth', 'mars', 'red', 'tenderer')],
+            }),
+            Bid({'lotValues': [{'relatedLot': mars}], 'parameters': [{'code': 'mars', 'value': 0.1}]}),
+            Bid({'parameters': [{'code': 'tenderer', 'value': 0.1}]}),
+        ]
+        tender.bids[0].documents = [
+            Document({'documentOf': 'lot', 'relatedItem': earth}),
+            Document({'documentOf': 'lot', 'relatedItem': mars}),
+            Document({'documentOf': 'tender'}),
+        ]
+        bids = tender.bids
+        request = MagicMock()
+
+        with patch('openprocurement.tender.core.utils.LOGGER') as logger:
+            removed = cleanup_bids_for_cancelled_lots(tender, request)
+        self.assertEqual(removed, {'lots': [], 'bids': [], 'lotValues': 0, 'parameters': 0, 'documents': 0})
+        self.assertIs(tender.bids, bids)
+        self.assertEqual([len(i.lotValues or []) for i in tender.bids], [2, 1, 0])
+        self.assertFalse(logger.info.called)
+
+        tender.lots[1].status = 'cancelled'
+        tender_src = tender.serialize('plain')
+        track_changes(tender)
+        with patch('openprocurement.tender.core.utils.LOGGER') as logger:
+            removed = cleanup_bids_for_cancelled_lots(tender, request)
+        # bids without lot values are removed as well
+        self.assertEqual(removed, {'lots': [mars], 'bids': [bids[1].id, bids[2].id], 'lotValues': 2, 'parameters': 2, 'documents': 1})
+        self.assertEqual(tender.bids, [bids[0]])
+        self.assertEqual([i.relatedLot for i in bids[0].lotValues], [earth])
+        self.assertEqual([i.code for i in bids[0].parameters], ['earth', 'tenderer'])
+        self.assertEqual([i.documentOf for i in bids[0].documents], ['lot', 'tender'])
+        self.assertEqual(logger.info.call_args[1]['extra']['MESSAGE_ID'], 'cleanup_bids_for_cancelled_lots')
+
+        # the revision of the save keeps the removed bids
+        request.registry.db.save.return_value = (tender.id, '1-{}'.format(uuid4().hex))
+        request.validated = {'tender_src': tender_src, 'tender': tender}
+        self.assertEqual(save_tender(request), True)
+        restored = apply_data_patch(tender.serialize('plain'), tender.revisions[-1].changes)
+        self.assertEqual([i['id'] for i in restored['bids']], [i.id for i in bids])
+
+        self.assertEqual(cleanup_bids_for_cancelled_lots(tender),
+                         {'lots': [mars], 'bids': [], 'lotValues': 0, 'parameters': 0, 'documents': 0})
+        self.assertEqual(tender.bids, [bids[0]])
+
+    def test_cleanup_bids_for_cancelled_lots_scale(self):
+        lots = [Lot({'title': 'Lot {}'.format(i), 'value': {'amount': 1000}, 'minimalStep': {'amount': 10}}) for i in xrange(100)]
+        for lot in lots[::4]:
+            lot.status = 'cancelled'
+        cancelled = set([i.id for i in lots[::4]])
+        tender = TenderWithBids(self.tender_data)
+        tender.lots = lots
+        tender.items = []
+        tender.features = [
+            Feature({'code': 'lot{}'.format(i), 'featureOf': 'lot', 'relatedItem': lot.id, 'title': 'Lot'})
+            for i, lot in enumerate(lots)
+        ]
+        tender.bids = [
+            Bid({
+                'lotValues': [{'relatedLot': lots[i % 100].id}, {'relatedLot': lots[(i + 20) % 100].id}],
+                'parameters': [{'code': 'lot{}'.format(i % 100), 'value': 0.1}, {'code': 'lot{}'.format((i + 1) % 100), 'value': 0.1}],
+            })
+            for i in xrange(500)
+        ]
+        expected = [
+            (bid.id, [i.relatedLot for i in bid.lotValues if i.relatedLot not in cancelled])
+            for bid in tender.bids
+        ]
+
+        removed = cleanup_bids_for_cancelled_lots(tender)
+        self.assertEqual(removed['lots'], sorted(cancelled))
+        self.assertEqual(removed['bids'], [i for i, values in expected if not values])
+        self.assertEqual(len(removed['bids']), 125)
+        self.assertEqual(removed['lotValues'], 250)
+        self.assertEqual(removed['parameters'], 125)
+        self.assertEqual([(bid.id, [i.relatedLot for i in bid.lotValues]) for bid in tender.bids],
+                         [i for i in expected if i[1]])
+        self.assertFalse([i for bid in tender.bids for i in bid.parameters if i.code in set(['lot{}'.format(j) for j in xrange(0, 100, 4)])])
+
+    def test_tender_state_summary(self):
+        earth, mars = [i.id for i in self.lots]
+        tender = Tender(self.tender_data)
+        tender.block_tender_complaint_status = ['claim', 'pending']
+        tender.block_complaint_status = ['pending']
+        tender.lots = self.lots
+        tender.lots[1].status = 'cancelled'
+        tender.items = self.items
+        tender.questions = [
+            Question({'questionOf': 'lot', 'relatedItem': mars, 'title': 'Is there life on Mars?'}),
+            Question({'questionOf': 'item', 'relatedItem': self.items[0].id, 'title': 'Is it round?', 'answer': 'Yes'}),
+            Question({'questionOf': 'tender', 'title': 'Why?', 'answer': 'Why not'}),
+        ]
+        tender.complaints = [
+            Complaint({'status': 'pending', 'relatedLot': mars, 'title': 'Mars is mine!'}),
+            Complaint({'status': 'draft', 'title': 'Just a draft'}),
+        ]
+        tender.awards = [
+            Award({'lotID': earth, 'complaintPeriod': {'endDate': '2017-10-10T00:00:00+03:00'}}),
+            Award({'lotID': earth, 'complaintPeriod': {'endDate': '2017-10-20T00:00:00+03:00'},
+                   'complaints': [{'status': 'pending', 'title': 'Unfair'}]}),
+        ]
+        tender.bids = [
+            Bid({'lotValues': [{'relatedLot': earth}, {'relatedLot': earth}]}),
+            Bid({'status': 'draft', 'lotValues': [{'relatedLot': earth}]}),
+        ]
+        tender.cancellations = [Cancellation({'reason': 'No oxygen', 'cancellationOf': 'lot', 'relatedLot': mars})]
+
+        summary = get_state_summary(tender)
+        self.assertFalse(summary.has_unanswered_questions())
+        self.assertTrue(summary.has_unanswered_questions(False))
+        self.assertFalse(summary.has_unanswered_complaints())
+        self.assertTrue(summary.has_unanswered_complaints(False))
+        self.assertEqual(summary.active_lots, set([earth]))
+        self.assertFalse(summary.lot(earth).blocked)
+        self.assertTrue(summary.lot(mars).blocked)
+        self.assertFalse(summary.lot().blocked)
+        self.assertEqual(summary.lot(mars).pending_complaints, 1)
+        self.assertEqual(summary.lot(mars).pending_cancellations, 1)
+        self.assertEqual(summary.lot(earth).awards, tender.awards)
+        self.assertIs(summary.lot(earth).last_award, tender.awards[1])
+        self.assertIsNone(summary.lot(mars).last_award)
+        self.assertEqual(summary.lot(earth).stand_still_end, tender.awards[1].complaintPeriod.endDate)
+        self.assertEqual(summary.lot(earth).pending_award_complaints, 1)
+        self.assertEqual((summary.lot().active_bids, summary.lot(earth).active_bids, summary.lot(mars).active_bids), (1, 1, 0))
+
+        self.assertIsNot(get_state_summary(tender), summary)
+        with tender.indexed() as index:
+            self.assertIs(get_state_summary(tender), index.state_summary)
+            self.assertIs(get_state_summary(tender), get_state_summary(tender))
 
     def test_remove_draft_bids(self):
         tender = Tender(self.tender_data)
@@ -290,6 +772,397 @@ class TestUtils(unittest.TestCase):
         res = save_tender(request)
         self.assertEqual(res, True)
 
+    def test_serialize_changes(self):
+        tender = TenderWithBids(self.tender_data)
+        tender.bids = [Bid({'id': uuid4().hex, 'status': 'active'}) for _ in range(3)]
+        tender_src = tender.serialize('plain')
+        self.assertIsNone(get_changed_fields(tender))
+        self.assertIsNone(serialize_changes(tender, 'plain', tender_src))
+
+        track_changes(tender)
+        self.assertEqual(get_changed_fields(tender), set())
+        self.assertEqual(serialize_changes(tender, 'plain', tender_src), tender_src)
+
+        tender.title = 'Top Secret Purchase'
+        tender.bids[1].status = 'draft'
+        tender.items = self.items
+        tender.status = None
+        self.assertEqual(get_changed_fields(tender), set(['title', 'bids', 'items', 'status']))
+        data = serialize_changes(tender, 'plain', tender_src)
+        self.assertEqual(data, tender.serialize('plain'))
+        self.assertEqual(get_revision_changes(data, tender_src),
+                         get_revision_changes(tender.serialize('plain'), tender_src))
+
+    def test_track_changes_on_read(self):
+        tender = TenderWithBids(self.tender_data)
+        tender.bids = [Bid({'id': uuid4().hex, 'status': 'active'}) for _ in range(3)]
+        track_changes(tender)
+        self.assertEqual(tender._data.snapshots, {})
+
+        # only fields that are read are walked for changes
+        tender.bids[1].status = 'draft'
+        self.assertEqual(set(tender._data.snapshots), set(['bids']))
+        self.assertEqual(get_changed_fields(tender), set(['bids']))
+
+        # fields set to the same values are not changed, validation does that
+        tender._data.update({'title': tender._data['title']})
+        self.assertEqual(get_changed_fields(tender), set(['bids']))
+        tender.title = 'Top Secret Purchase'
+        tender.items = self.items
+        self.assertEqual(get_changed_fields(tender), set(['bids', 'title', 'items']))
+
+    def test_get_tender_src(self):
+        tender = TenderWithBids(self.tender_data)
+        tender.bids = [Bid({'id': uuid4().hex, 'status': 'active'})]
+        doc = tender.to_primitive()
+        tender = TenderWithBids(doc)
+        tender_src = get_tender_src(tender, 'plain')
+        self.assertEqual(tender_src, tender.serialize('plain'))
+        self.assertEqual(tender_src['id'], tender.id)
+        self.assertIs(tender_src['bids'], doc['bids'])
+
+    def test_get_tender_src_legacy_document(self):
+        tender = TenderWithBids(self.tender_data)
+        tender.bids = [Bid({
+            'id': uuid4().hex,
+            'lotValues': [{'relatedLot': '11111111111111111111111111111111', 'value': {'amount': 100}}],
+        })]
+        doc = tender.to_primitive()
+        # stored by older versions: no defaults, empty lists
+        del doc['status']
+        del doc['bids'][0]['status']
+        doc['bids'][0]['documents'] = []
+        tender = TenderWithBids(doc)
+        # values of fields the models do not have anymore
+        doc['bids'][0]['legacyNote'] = 'Legacy'
+        doc['bids'][0]['lotValues'][0]['value']['legacyRate'] = 1
+        baseline = tender.serialize('plain')
+
+        tender_src = get_tender_src(tender, 'plain')
+        self.assertEqual(tender_src, baseline)
+        track_changes(tender)
+        tender.title = 'Top Secret Purchase'
+        tender.bids[0].lotValues[0].value.amount = 200
+        data = serialize_changes(tender, 'plain', tender_src)
+        self.assertEqual(get_revision_changes(data, tender_src),
+                         get_revision_changes(tender.serialize('plain'), baseline))
+
+    def test_save_tender_next_check_only(self):
+        doc = dict(self.tender_data, status='active.tendering', next_check='2017-10-10T00:00:00+03:00')
+        tender = TenderWithNextCheck(doc)
+        tender_src = get_tender_src(tender, 'plain')
+        self.assertEqual(tender_src['next_check'], '2017-10-10T00:00:00+03:00')
+        track_changes(tender)
+
+        request = MagicMock()
+        request.registry.db.save.return_value = (tender.id, '1-{}'.format(uuid4().hex))
+        request.authenticated_userid = 'chronograph'
+        request.validated = {'tender_src': tender_src, 'tender': tender}
+        self.assertEqual(save_tender(request), True)
+        self.assertEqual(tender.revisions[-1].changes,
+                         [{'op': 'replace', 'path': '/next_check', 'value': '2017-10-10T00:00:00+03:00'}])
+        self.assertEqual(tender.serialize('plain')['next_check'], '2017-10-12T00:00:00+03:00')
+
+    def test_save_tender_tracked_changes(self):
+        tender = Tender(self.tender_data)
+        tender_src = tender.serialize('plain')
+        track_changes(tender)
+        tender.title = 'Top Secret Purchase'
+        changes = get_revision_changes(tender.serialize('plain'), tender_src)
+
+        request = MagicMock()
+        request.registry.db.save.return_value = (tender.id, '1-{}'.format(uuid4().hex))
+        request.authenticated_userid = 'administrator'
+        request.validated = {'tender_src': tender_src, 'tender': tender}
+        self.assertEqual(save_tender(request), True)
+        self.assertEqual(tender.revisions[-1].changes, changes)
+
+    def test_save_tender_offload_conflict(self):
+        tender = Tender(self.tender_data)
+        tender.revisions = [Revision({'author': 'broker', 'rev': '{}-{}'.format(i, uuid4().hex), 'changes': []}) for i in range(3)]
+        revs = [i.rev for i in tender.revisions]
+        tender_src = tender.serialize('plain')
+        tender.title = 'Top Secret Purchase'
+        request = MagicMock()
+        request.authenticated_userid = 'administrator'
+        request.validated = {'tender_src': tender_src, 'tender': tender}
+        request.registry.db = LocalCouchDB()
+        request.registry.db.save({'_id': '{}_revisions_0000000001'.format(tender.id)})
+
+        with patch('openprocurement.tender.core.utils.REVISIONS_STORAGE', RevisionsStorage(inline_limit=1)):
+            self.assertIsNone(save_tender(request))
+        request.errors.add.assert_called_once_with('body', 'data', "('conflict', 'Document update conflict.')")
+        self.assertEqual(request.errors.status, 409)
+        self.assertEqual([i.rev for i in tender.revisions][:3], revs)
+
+        request.registry.db.docs.pop('{}_revisions_0000000001'.format(tender.id))
+        request.registry.db.docs[tender.id] = {'_id': tender.id, '_rev': '1-{}'.format(uuid4().hex)}
+        request.errors.reset_mock()
+        with patch('openprocurement.tender.core.utils.REVISIONS_STORAGE', RevisionsStorage(inline_limit=1)):
+            self.assertIsNone(save_tender(request))
+        self.assertEqual(request.errors.status, 409)
+        self.assertEqual([i.rev for i in tender.revisions][:3], revs)
+        self.assertEqual([i for i in request.registry.db.docs if 'revisions' in i], [])
+
+    def test_revisions_storage(self):
+        db = LocalCouchDB()
+        storage = RevisionsStorage(inline_limit=2, chunk_size=2)
+        tender = Tender(self.tender_data)
+        tender.revisions = [Revision({
+            'author': 'broker',
+            'rev': '{}-{}'.format(i, uuid4().hex) if i else None,
+            'changes': [{'op': 'remove', 'path': '/title'}]
+        }) for i in range(4)]
+        revs = [i.rev for i in tender.revisions]
+        self.assertIsNone(storage.offload(db, tender))
+        self.assertEqual(len(tender.revisions), 4)
+
+        tender.revisions.append(Revision({'author': 'broker', 'rev': '4-{}'.format(uuid4().hex), 'changes': []}))
+        revs.append(tender.revisions[-1].rev)
+        chunk = storage.offload(db, tender)
+        self.assertEqual(chunk['_id'], '{}_revisions_0000000001'.format(tender.id))
+        self.assertEqual(chunk['doc_type'], 'TenderRevisions')
+        self.assertEqual([i['rev'] for i in chunk['revisions']], revs[1:3])
+        self.assertEqual([i.rev for i in tender.revisions], revs[:1] + revs[3:])
+        self.assertEqual([i.rev for i in storage.load(db, tender)], revs)
+
+        storage.restore(db, tender, chunk)
+        self.assertEqual([i.rev for i in tender.revisions], revs)
+        self.assertNotIn(chunk['_id'], db.docs)
+
+        doc = tender.to_primitive()
+        db.save(doc)
+        self.assertEqual(storage.offload_doc(db, doc), True)
+        self.assertEqual([i['rev'] for i in db.docs[tender.id]['revisions']], revs[:1] + revs[3:])
+        self.assertEqual([i.rev for i in storage.load(db, Tender(db.docs[tender.id]))], revs)
+        self.assertEqual(storage.offload_doc(db, doc), False)
+
+    def test_listing_projections(self):
+        db = LocalCouchDB()
+        projections = ListingProjections(fields=['status', 'tenderID', 'lots', 'dateModified'], enabled=True)
+        tender = Tender(self.tender_data)
+        tender.mode = 'test'
+        self.assertEqual(projections.save_tender(db, tender), True)
+        doc = db.docs['{}_listing'.format(tender.id)]
+        self.assertEqual(doc['doc_type'], 'TenderListing')
+        self.assertEqual(doc['tender_id'], tender.id)
+        self.assertEqual((doc['status'], doc['mode'], doc['dateModified']),
+                         ('draft', 'test', self.tender_data['dateModified']))
+        self.assertEqual(doc['data'], {
+            'status': 'draft',
+            'tenderID': self.tender_data['tenderID'],
+            'dateModified': self.tender_data['dateModified'],
+        })
+        self.assertEqual(projections.save_tender(db, tender), False)
+
+        tender.status = 'active.tendering'
+        self.assertEqual(projections.save(db, tender.id, tender.to_primitive()), True)
+        self.assertEqual(db.docs['{}_listing'.format(tender.id)]['data']['status'], 'active.tendering')
+
+        projections.enabled = False
+        tender.status = 'complete'
+        self.assertEqual(projections.save_tender(db, tender), False)
+
+    def test_listing_projections_version(self):
+        db = LocalCouchDB()
+        projections = ListingProjections(fields=['status', 'tenderID', 'dateModified'], enabled=True)
+        tender = Tender(self.tender_data)
+        self.assertEqual(projections.save_tender(db, tender), True)
+        self.assertEqual(projections.is_ready(db), False)
+        projections.mark_ready(db)
+        # not ready results are rechecked after check_interval
+        self.assertEqual(projections.is_ready(db), False)
+        projections.checked = None
+        self.assertEqual(projections.is_ready(db), True)
+        version = db.docs['{}_listing'.format(tender.id)]['version']
+        self.assertEqual(db.docs[projections.marker_id]['version'], version)
+
+        # other fields make a new version, documents of the previous one are rewritten
+        projections = ListingProjections(fields=['status', 'title', 'dateModified'], enabled=True)
+        self.assertEqual(projections.is_ready(db), False)
+        self.assertEqual(projections.save(db, tender.id, tender.to_primitive()), True)
+        self.assertNotEqual(db.docs['{}_listing'.format(tender.id)]['version'], version)
+        self.assertEqual(projections.save(db, tender.id, tender.to_primitive()), False)
+        projections.mark_ready(db)
+        projections.checked = None
+        self.assertEqual(projections.is_ready(db), True)
+
+        projections.enabled = False
+        self.assertEqual(projections.is_ready(db), False)
+
+    def test_next_check_index(self):
+        db = LocalCouchDB()
+        index = NextCheckIndex(enabled=True)
+        tender_id = self.tender_data['id']
+        doc_id = '{}_next_check'.format(tender_id)
+        self.assertEqual(index.save(db, tender_id, {'status': 'draft'}), False)
+        self.assertNotIn(doc_id, db.docs)
+
+        self.assertEqual(index.save(db, tender_id, {'next_check': '2017-10-10T10:00:00+03:00', 'mode': 'test'}), True)
+        self.assertEqual(db.docs[doc_id]['doc_type'], 'TenderNextCheck')
+        self.assertEqual(db.docs[doc_id]['tender_id'], tender_id)
+        self.assertEqual(db.docs[doc_id]['mode'], 'test')
+        self.assertEqual(db.docs[doc_id]['next_check'], '2017-10-10T07:00:00+00:00')
+        self.assertEqual(index.save(db, tender_id, {'next_check': '2017-10-10T07:00:00Z', 'mode': 'test'}), False)
+        self.assertEqual(index.get_key('2017-01-10T10:00:00'), '2017-01-10T08:00:00+00:00')
+        self.assertEqual(index.get_key(datetime(2017, 10, 10, 10)), '2017-10-10T07:00:00+00:00')
+
+        self.assertEqual(index.save(db, tender_id, {'next_check': '2017-10-11T10:00:00+03:00'}), True)
+        self.assertEqual(db.docs[doc_id]['next_check'], '2017-10-11T07:00:00+00:00')
+        self.assertEqual(index.save(db, tender_id, {'status': 'complete'}), True)
+        self.assertNotIn(doc_id, db.docs)
+
+        tender = Tender(self.tender_data)
+        self.assertEqual(index.save_tender(db, tender), False)
+        index.enabled = False
+        self.assertEqual(index.save_tender(db, tender), False)
+
+    def test_next_check_index_due(self):
+        index = NextCheckIndex(enabled=True)
+        rows = [Row(id='{}_next_check'.format(i), key=['2017-10-10T0{}:00:00+00:00'.format(i), str(i)], value='') for i in xrange(3)]
+        now = TZ.localize(datetime(2017, 10, 10, 12))
+        with patch('openprocurement.tender.core.utils.tenders_next_check_view', MagicMock(return_value=rows)) as view:
+            self.assertEqual(index.get_due('db', 2, now=now), rows[:2])
+            view.assert_called_with('db', endkey=['2017-10-10T09:00:00+00:00', {}], limit=2)
+            self.assertEqual(index.get_due('db', 2, offset=rows[0].key, now=now, stale='update_after'), rows[1:])
+            view.assert_called_with('db', startkey=rows[0].key, endkey=['2017-10-10T09:00:00+00:00', {}],
+                                    limit=3, stale='update_after')
+
+    def test_listing_view(self):
+        buckets = {
+            u'': [Row(id='a', key=['dateModified', u'', '2017-01-02'], value={'status': 'active'})],
+            u'test': [Row(id='b', key=['dateModified', u'test', '2017-01-01'], value={'status': 'draft'}),
+                      Row(id='c', key=['dateModified', u'test', '2017-01-03'], value={'status': 'complete'})],
+        }
+        # rows of a view come sorted in the requested order
+        view = MagicMock(side_effect=lambda db, **options: buckets[options['startkey'][1]][::-1 if options.get('descending') else 1])
+        db = MagicMock()
+        rows = list(ListingView(view, u'dateModified', u'test')(db, startkey='2017-01-01', limit=10))
+        view.assert_called_once_with(db, startkey=['dateModified', u'test', '2017-01-01'],
+                                     endkey=['dateModified', u'test', {}], limit=10)
+        self.assertEqual([(i.id, i.key, i.value) for i in rows],
+                         [('b', '2017-01-01', {'status': 'draft'}), ('c', '2017-01-03', {'status': 'complete'})])
+
+        view.reset_mock()
+        rows = list(ListingView(view, u'dateModified', u'_all_')(db, descending=True, limit=2))
+        view.assert_has_calls([
+            call(db, startkey=['dateModified', u'', {}], endkey=['dateModified', u''], descending=True, limit=2),
+            call(db, startkey=['dateModified', u'test', {}], endkey=['dateModified', u'test'], descending=True, limit=2),
+        ])
+        self.assertEqual([(i.id, i.key) for i in rows], [('c', '2017-01-03'), ('a', '2017-01-02')])
+
+        buckets[u''] = [Row(id='a_listing', key=['dateModified', u'', '2017-01-02'],
+                            value={'_id': 'a', 'status': 'active'}, doc={'_id': 'a'})]
+        rows = ListingView(view, u'dateModified', u'', projection=True)(db, include_docs=True)
+        self.assertEqual(list(rows), [{'id': 'a', 'key': '2017-01-02', 'value': {'status': 'active'}, 'doc': {'_id': 'a'}}])
+        self.assertEqual(buckets[u''][0].value['_id'], 'a')
+
+    def test_listing_view_batches(self):
+        rows = [Row(id=str(i), key=['dateModified', u'', '2017-01-0{}'.format(i // 2)], value={}) for i in xrange(7)]
+
+        def view(db, startkey, endkey, limit, startkey_docid=None, skip=0):
+            found = [i for i in rows if (i.key, i.id) >= (startkey, startkey_docid or '')]
+            return found[skip:skip + limit]
+        view = MagicMock(side_effect=view)
+        listing_view = ListingView(view, u'dateModified', u'')
+        listing_view.batch_size = 3
+
+        results = listing_view(None, limit=5)
+        view.assert_not_called()
+        self.assertEqual([i.id for i in results], ['0', '1', '2', '3', '4'])
+        self.assertEqual([i[1]['limit'] for i in view.call_args_list], [3, 2])
+        self.assertEqual(view.call_args[1]['startkey'], rows[2].key)
+        self.assertEqual((view.call_args[1]['startkey_docid'], view.call_args[1]['skip']), ('2', 1))
+
+        view.reset_mock()
+        self.assertEqual([i.id for i in listing_view(None)], [i.id for i in rows])
+        self.assertEqual(view.call_count, 3)
+
+    def test_iter_json_listing(self):
+        items = [{'id': uuid4().hex, 'dateModified': datetime.now(TZ).isoformat()} for _ in range(3)]
+        envelope = MagicMock(return_value={'next_page': {'offset': items[-1]['dateModified']}})
+
+        chunks = list(iter_json_listing(iter(items), envelope, chunk_size=1))
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(json.loads(''.join(chunks)), {'data': items, 'next_page': envelope.return_value})
+        envelope.assert_called_once_with()
+
+        pretty = ''.join(iter_json_listing(iter(items), envelope, pretty=True))
+        self.assertIn('{\n    "', pretty)
+        self.assertEqual(json.loads(pretty), {'data': items, 'next_page': envelope.return_value})
+
+        jsonp = ''.join(iter_json_listing(iter([]), envelope, callback='callback'))
+        self.assertTrue(jsonp.startswith('callback({'))
+        self.assertTrue(jsonp.endswith(');'))
+        self.assertEqual(json.loads(jsonp[len('callback('):-2]), {'data': [], 'next_page': envelope.return_value})
+
+    def test_listing_design(self):
+        docs = {'_design/tenders': {'_id': '_design/tenders', 'views': {'all': {}, 'listing': {}}}}
+        db = MagicMock()
+        db.get.side_effect = lambda doc_id: deepcopy(docs.get(doc_id))
+        db.save.side_effect = lambda doc: docs.update({doc['_id']: deepcopy(doc)})
+        db_info = {'update_seq': 10}
+        db.info.side_effect = lambda ddoc=None: db_info if ddoc is None else index_info
+
+        listing_design = ListingDesign(DEFAULT_FIELDS)
+        self.assertIsNone(listing_design.version)
+        self.assertEqual(listing_design.view.design, 'tenders')
+        self.assertEqual(listing_design.get_fields(db), DEFAULT_FIELDS)
+        db.save.assert_not_called()
+
+        fields = DEFAULT_FIELDS + ['title', 'value']
+        listing_design.configure(fields)
+        self.assertEqual(listing_design.view.design, 'listing_{}'.format(listing_design.version))
+        index_info = {'view_index': {'updater_running': True, 'update_seq': 5}}
+        self.assertEqual(listing_design.get_fields(db), DEFAULT_FIELDS)
+        listing_design(db, limit=10)
+        self.assertEqual(db.view.call_args[0][0], 'tenders/listing')
+        self.assertNotIn(ListingDesign.marker_id, docs)
+
+        # the database is written to while the view is indexed
+        db_info = {'update_seq': 15}
+        index_info = {'view_index': {'updater_running': True, 'update_seq': 10}}
+        self.assertEqual(listing_design.get_fields(db), DEFAULT_FIELDS)  # checked once a minute
+        listing_design.checked = 0
+        self.assertEqual(listing_design.get_fields(db), fields)
+        listing_design(db, limit=10)
+        self.assertEqual(db.view.call_args[0][0], '{}/listing'.format(listing_design.view.design))
+        self.assertEqual(docs[ListingDesign.marker_id]['version'], listing_design.version)
+        self.assertEqual(docs['_design/tenders']['views'], {'all': {}})
+        db.cleanup.assert_called_once_with()
+
+        listing_design = ListingDesign(fields)
+        self.assertEqual(listing_design.get_fields(db), fields)
+
+    def test_listing_design_concurrent_switch(self):
+        docs = {'_design/tenders': {'_id': '_design/tenders', 'views': {'all': {}, 'listing': {}}}}
+        db = MagicMock()
+        db.get.side_effect = lambda doc_id: deepcopy(docs.get(doc_id))
+        db.info.side_effect = lambda ddoc=None: {'update_seq': 10} if ddoc is None else {'view_index': {'update_seq': 10}}
+        fields = DEFAULT_FIELDS + ['title']
+        listing_design = ListingDesign(fields)
+
+        def switched_by_other_worker(doc):
+            docs[ListingDesign.marker_id] = {'_id': ListingDesign.marker_id, 'version': listing_design.version, 'fields': fields}
+            raise ResourceConflict(('conflict', 'Document update conflict.'))
+        db.save.side_effect = switched_by_other_worker
+        self.assertEqual(listing_design.get_fields(db), fields)
+        self.assertEqual(listing_design.get_design(db), 'listing_{}'.format(listing_design.version))
+        db.cleanup.assert_not_called()
+
+        listing_design = ListingDesign(fields)
+        db.save.side_effect = ResourceConflict(('conflict', 'Document update conflict.'))
+        docs[ListingDesign.marker_id] = {'_id': ListingDesign.marker_id, 'version': None, 'fields': DEFAULT_FIELDS}
+        db.get.side_effect = lambda doc_id: deepcopy(docs.get(doc_id))
+        self.assertEqual(listing_design.get_fields(db), DEFAULT_FIELDS)
+
+        db.save.side_effect = None
+        db.delete.side_effect = ResourceNotFound(('not_found', 'deleted'))
+        listing_design.retire(db, 'abcdef01')
+        docs['_design/listing_abcdef01'] = {'_id': '_design/listing_abcdef01'}
+        listing_design.retire(db, 'abcdef01')
+        db.cleanup.assert_not_called()
+
     @patch('openprocurement.tender.core.utils.save_tender')
     def test_apply_patch(self, mocked_save):
         request = MagicMock()
@@ -1,18 +1,140 @@
 # -*- coding: utf-8 -*-
 
+from pyramid.authorization import ACLAuthorizationPolicy
+from pyramid.location import lineage
 from pyramid.security import (
     ALL_PERMISSIONS,
     Allow,
     Deny,
     Everyone,
+    ACLAllowed,
+    ACLDenied,
 )
-from openprocurement.api.traversal import get_item
+
+
+class ACL(list):
+    """ ACL entries with lazily built indexes by principal and by (principal, permission).
+
+    Indexes are rebuilt after entries are changed, e.g. by a model
+    extending the ACL of its base class.
+    """
+
+    def __init__(self, entries=(), index=None):
+        list.__init__(self, entries)
+        self.index = index
+
+    def changed(method):
+        def wrapper(self, *args):
+            self.index = None
+            return method(self, *args)
+        wrapper.__name__ = method.__name__
+        return wrapper
+
+    __setitem__ = changed(list.__setitem__)
+    __delitem__ = changed(list.__delitem__)
+    __setslice__ = changed(list.__setslice__)
+    __delslice__ = changed(list.__delslice__)
+    __iadd__ = changed(list.__iadd__)
+    __imul__ = changed(list.__imul__)
+    append = changed(list.append)
+    extend = changed(list.extend)
+    insert = changed(list.insert)
+    pop = changed(list.pop)
+    remove = changed(list.remove)
+    reverse = changed(list.reverse)
+    sort = changed(list.sort)
+    del changed
+
+    def get_index(self):
+        if self.index is None:
+            by_principal = {}
+            by_permission = {}
+            for position, ace in enumerate(self):
+                principal, permissions = ace[1], ace[2]
+                by_principal.setdefault(principal, []).append(ace)
+                if isinstance(permissions, basestring):
+                    permissions = [permissions]
+                elif not isinstance(permissions, (list, tuple, set, frozenset)):
+                    # containers such as ALL_PERMISSIONS are checked with ``in``
+                    by_permission.setdefault((principal, None), []).append((position, ace))
+                    continue
+                for permission in permissions:
+                    by_permission.setdefault((principal, permission), [(position, ace)])
+            self.index = (by_principal, by_permission)
+        return self.index
+
+    @property
+    def by_principal(self):
+        return self.get_index()[0]
+
+    def lookup(self, principals, permission):
+        """ The first ACE of any of the principals for the permission, None if there is no such ACE. """
+        by_permission = self.get_index()[1]
+        found = None
+        for principal in principals:
+            candidates = by_permission.get((principal, permission), []) + [
+                i for i in by_permission.get((principal, None), []) if permission in i[1][2]
+            ]
+            for position, ace in candidates:
+                if found is None or position < found[0]:
+                    found = (position, ace)
+        return found and found[1]
+
+
+class AuthorizationPolicy(ACLAuthorizationPolicy):
+    """ ``ACLAuthorizationPolicy`` looking ACEs up by (principal, permission).
+
+    ACLs that are not ``ACL`` instances are indexed per check, class
+    attribute ones once. Results are kept on the context for the rest of
+    the request, unless the context is a part of a model being changed (see
+    ``utils.track_changes``), as its ACL may change with it.
+    """
+
+    def __init__(self):
+        self.static = {}
+
+    def get_acl(self, location, acl):
+        """ Indexed ``acl``, the ``__acl__`` of the location. """
+        if callable(acl):
+            acl = acl()
+        if isinstance(acl, ACL):
+            return acl
+        if getattr(type(location), '__acl__', None) is not acl:
+            return ACL(acl or [])
+        cls = type(location)
+        if cls not in self.static or self.static[cls][0] is not acl:
+            self.static[cls] = (acl, ACL(acl))
+        return self.static[cls][1]
+
+    def permits(self, context, principals, permission):
+        if any(['_tracked_fields' in getattr(i, '__dict__', {}) for i in lineage(context)]):
+            return self.check(context, principals, permission)
+        cache = getattr(context, '__dict__', {}).setdefault('_permits', {})
+        key = (tuple(principals), permission)
+        if key not in cache:
+            cache[key] = self.check(context, principals, permission)
+        return cache[key]
+
+    def check(self, context, principals, permission):
+        acl = '<No ACL found on any object in resource lineage>'
+        for location in lineage(context):
+            try:
+                acl = location.__acl__
+            except AttributeError:
+                continue
+            # errors of ACL builders are not taken for a missing ACL
+            acl = self.get_acl(location, acl)
+            ace = acl.lookup(principals, permission)
+            if ace is not None:
+                result = ACLAllowed if ace[0] == Allow else ACLDenied
+                return result(ace, acl, permission, principals, location)
+        return ACLDenied('<default deny>', acl, permission, principals, context)
 
 
 class Root(object):
     __name__ = None
     __parent__ = None
-    __acl__ = [
+    __acl__ = ACL([
         # (Allow, Everyone, ALL_PERMISSIONS),
         (Allow, Everyone, 'view_listing'),
         (Allow, Everyone, 'view_tender'),
@@ -29,18 +151,142 @@ class Root(object):
         (Allow, 'g:contracting', 'extract_credentials'),
         (Allow, 'g:competitive_dialogue', 'create_tender'),
         (Allow, 'g:chronograph', 'edit_tender'),
+        (Allow, 'g:chronograph', 'view_due_tenders'),
         (Allow, 'g:Administrator', 'edit_tender'),
         (Allow, 'g:Administrator', 'edit_bid'),
         (Allow, 'g:admins', ALL_PERMISSIONS),
         (Allow, 'g:bots', 'upload_tender_documents')
-    ]
+    ])
 
     def __init__(self, request):
         self.request = request
         self.db = request.registry.db
 
 
+def get_item(parent, key, request, collection=None):
+    """ The ``key`` item of the parent with the id from the matchdict, the latest version of documents.
+
+    Items are looked up by an id index shared by lookups on the same parent.
+    """
+    from openprocurement.tender.core.utils import get_items, error_handler
+    item_id = request.matchdict['{}_id'.format(key)]
+    request.validated['{}_id'.format(key)] = item_id
+    items = get_items(parent, collection or '{}s'.format(key), item_id)
+    if not items:
+        request.errors.add('url', '{}_id'.format(key), 'Not Found')
+        request.errors.status = 404
+        raise error_handler(request.errors)
+    if key == 'document':
+        request.validated['{}s'.format(key)] = items
+    item = items[-1]
+    request.validated[key] = item
+    request.validated['id'] = item_id
+    item.__parent__ = parent
+    return item
+
+
+class ResourceTable(object):
+    """ Rules of resolving tender subresources from the matchdict.
+
+    Rules are ``(matchdict key, collection, child rules)`` trees, at every
+    level the first rule with its key matched is followed. ``compile``
+    turns them into paths of (item key, collection) per set of matched keys,
+    so a request is resolved with a single lookup.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = []
+        self.paths = None
+        self.keys = set()
+        for rule in rules:
+            self.add_rule(self.rules, rule)
+
+    def add_rule(self, rules, rule):
+        key, collection, children = rule
+        node = (key, collection, [])
+        rules.append(node)
+        for child in children:
+            self.add_rule(node[2], child)
+        self.paths = None
+
+    def add(self, path, collection=None):
+        """ Adds a rule for the last matchdict key of ``path`` under the rules of the preceding keys. """
+        rules = self.rules
+        for key in path[:-1]:
+            rules = [i for i in rules if i[0] == key][0][2]
+        self.add_rule(rules, (path[-1], collection or '{}s'.format(path[-1][:-len('_id')]), ()))
+
+    def walk(self, matched):
+        path = []
+        rules = self.rules
+        while True:
+            rule = [i for i in rules if i[0] in matched][:1]
+            if not rule:
+                return path
+            key, collection, rules = rule[0]
+            path.append((key[:-len('_id')], collection))
+
+    def compile(self):
+        paths = set()
+        keys = set()
+
+        def visit(rules, matched):
+            for key, collection, children in rules:
+                keys.add(key)
+                paths.add(matched.union([key]))
+                visit(children, matched.union([key]))
+
+        visit(self.rules, frozenset())
+        self.keys = keys
+        self.paths = dict([(matched, self.walk(matched)) for matched in paths])
+
+    def resolve(self, matchdict):
+        """ (item key, collection) pairs to look up from the tender to the context. """
+        if self.paths is None:
+            self.compile()
+        matched = frozenset([i for i in self.keys if matchdict.get(i)])
+        path = self.paths.get(matched)
+        if path is None:
+            # keys of different branches, resolved the way the rules order them
+            path = self.paths[matched] = self.walk(matched)
+        return path
+
+
+RESOURCES = ResourceTable([
+    ('award_id', 'awards', [
+        ('complaint_id', 'complaints', [
+            ('document_id', 'documents', []),
+        ]),
+        ('document_id', 'documents', []),
+    ]),
+    ('contract_id', 'contracts', [
+        ('document_id', 'documents', []),
+    ]),
+    ('bid_id', 'bids', [
+        ('document_id', 'documents', []),
+    ]),
+    ('complaint_id', 'complaints', [
+        ('document_id', 'documents', []),
+    ]),
+    ('cancellation_id', 'cancellations', [
+        ('document_id', 'documents', []),
+    ]),
+    ('document_id', 'documents', []),
+    ('question_id', 'questions', []),
+    ('lot_id', 'lots', []),
+])
+
+
+def add_tender_resource(config, path, collection=None):
+    """ Registers a tender subresource, ``path`` are matchdict keys from the tender down to it.
+
+    For example ``config.add_tender_resource(('award_id', 'milestone_id'))``.
+    """
+    RESOURCES.add(path, collection)
+
+
 def factory(request):
+    from openprocurement.tender.core.utils import get_tender_src, track_changes  # utils imports this module
     request.validated['tender_src'] = {}
     root = Root(request)
     if not request.matchdict or not request.matchdict.get('tender_id'):
@@ -51,50 +297,13 @@ def factory(request):
     request.validated['tender'] = request.validated['db_doc'] = tender
     request.validated['tender_status'] = tender.status
     if request.method != 'GET':
-        request.validated['tender_src'] = tender.serialize('plain')
-        if tender._initial.get('next_check'):
-            request.validated['tender_src']['next_check'] = tender._initial.get('next_check')
-    if request.matchdict.get('award_id'):
-        award = get_item(tender, 'award', request)
-        if request.matchdict.get('complaint_id'):
-            complaint = get_item(award, 'complaint', request)
-            if request.matchdict.get('document_id'):
-                return get_item(complaint, 'document', request)
-            else:
-                return complaint
-        elif request.matchdict.get('document_id'):
-            return get_item(award, 'document', request)
-        else:
-            return award
-    elif request.matchdict.get('contract_id'):
-        contract = get_item(tender, 'contract', request)
-        if request.matchdict.get('document_id'):
-            return get_item(contract, 'document', request)
-        else:
-            return contract
-    elif request.matchdict.get('bid_id'):
-        bid = get_item(tender, 'bid', request)
-        if request.matchdict.get('document_id'):
-            return get_item(bid, 'document', request)
-        else:
-            return bid
-    elif request.matchdict.get('complaint_id'):
-        complaint = get_item(tender, 'complaint', request)
-        if request.matchdict.get('document_id'):
-            return get_item(complaint, 'document', request)
-        else:
-            return complaint
-    elif request.matchdict.get('cancellation_id'):
-        cancellation = get_item(tender, 'cancellation', request)
-        if request.matchdict.get('document_id'):
-            return get_item(cancellation, 'document', request)
-        else:
-            return cancellation
-    elif request.matchdict.get('document_id'):
-        return get_item(tender, 'document', request)
-    elif request.matchdict.get('question_id'):
-        return get_item(tender, 'question', request)
-    elif request.matchdict.get('lot_id'):
-        return get_item(tender, 'lot', request)
-    request.validated['id'] = request.matchdict['tender_id']
-    return tender
+        request.validated['tender_src'] = get_tender_src(tender, 'plain')
+        track_changes(tender)
+    path = RESOURCES.resolve(request.matchdict)
+    if not path:
+        request.validated['id'] = request.matchdict['tender_id']
+        return tender
+    context = tender
+    for key, collection in path:
+        context = get_item(context, key, request, collection)
+    return context
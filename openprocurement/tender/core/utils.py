@@ -1,14 +1,28 @@
 # -*- coding: utf-8 -*-
 from re import compile
 from barbecue import chef
+from json import dumps, loads
 from jsonpointer import resolve_pointer
+from calendar import timegm
+from collections import namedtuple, OrderedDict
+from copy import deepcopy
 from functools import partial
-from datetime import datetime, time, timedelta
+from iso8601 import parse_date
+from bisect import bisect_left
+from hashlib import md5
+from datetime import date, datetime, time, timedelta
 from pkg_resources import get_distribution
 from logging import getLogger
+from pytz import utc
 from schematics.exceptions import ModelValidationError
+from schematics.models import Model
+from schematics.transforms import export_loop, wholelist
+from schematics.types import StringType
+from schematics.types.compound import ModelType, MultiType, ListType, DictType
 from time import sleep
+from threading import Lock
 from pyramid.exceptions import URLDecodeError
+from pyramid.httpexceptions import HTTPNotModified
 from pyramid.compat import decode_path_info
 from cornice.resource import resource
 from couchdb.http import ResourceConflict
@@ -21,43 +35,135 @@ from openprocurement.api.utils import (
 from openprocurement.tender.core.constants import (
     BIDDER_TIME, SERVICE_TIME, AUCTION_STAND_STILL_TIME
 )
-from openprocurement.tender.core.traversal import factory
+from openprocurement.tender.core.design import CHANGES_FIELDS, tenders_next_check_view, get_listing_version
+from openprocurement.tender.core.traversal import factory, ACL
 PKG = get_distribution(__package__)
 LOGGER = getLogger(PKG.project_name)
 
 ACCELERATOR_RE = compile(r'.accelerator=(?P<accelerator>\d+)')
+SandboxDirectives = namedtuple('SandboxDirectives', ['accelerator', 'quick', 'no_auction', 'fast_forward'])
 
 
 optendersresource = partial(resource, error_handler=error_handler,
                             factory=factory)
 
+
+def parse_sandbox_directives(procurementMethodDetails, submissionMethodDetails):
+    re_obj = procurementMethodDetails and ACCELERATOR_RE.search(procurementMethodDetails)
+    quick = bool(SANDBOX_MODE and submissionMethodDetails and u'quick' in submissionMethodDetails)
+    return SandboxDirectives(
+        accelerator=int(re_obj.group('accelerator')) if re_obj else None,
+        quick=quick,
+        no_auction=quick and submissionMethodDetails == u'quick(mode:no-auction)',
+        fast_forward=quick and submissionMethodDetails == u'quick(mode:fast-forward)',
+    )
+
+
+def get_sandbox_directives(context):
+    """ Sandbox directives from procurementMethodDetails and submissionMethodDetails.
+
+    ``context`` is a tender model or its data. Models cache the parsed
+    directives until any of the two fields changes.
+    """
+    is_model = isinstance(context, Model)
+    get = partial(getattr, context) if is_model else (context or {}).get
+    key = tuple([
+        i if isinstance(i, basestring) else None
+        for i in (get('procurementMethodDetails', None), get('submissionMethodDetails', None))
+    ])
+    if not is_model:
+        return parse_sandbox_directives(*key)
+    cached = context.__dict__.get('_sandbox_directives')
+    if not cached or cached[0] != key:
+        cached = context.__dict__['_sandbox_directives'] = key, parse_sandbox_directives(*key)
+    return cached[1]
+
+
 def rounding_shouldStartAfter(start_after, tender, use_from=datetime(2016, 7, 16, tzinfo=TZ)):
-    if (tender.enquiryPeriod and tender.enquiryPeriod.startDate or get_now()) > use_from and not (SANDBOX_MODE and tender.submissionMethodDetails and u'quick' in tender.submissionMethodDetails):
+    if (tender.enquiryPeriod and tender.enquiryPeriod.startDate or get_now()) > use_from and not get_sandbox_directives(tender).quick:
         midnigth = datetime.combine(start_after.date(), time(0, tzinfo=start_after.tzinfo))
         if start_after > midnigth:
             start_after = midnigth + timedelta(1)
     return start_after
 
 
+def get_tender_index(tender):
+    """ The index shared by the current ``BaseTender.indexed`` block, None outside of it. """
+    return getattr(tender, '__dict__', {}).get('_index')
+
+
 def calc_auction_end_time(bids, start):
     return start + bids * BIDDER_TIME + SERVICE_TIME + AUCTION_STAND_STILL_TIME
 
 
-def generate_tender_id(ctime, db, server_id=''):
-    key = ctime.date().isoformat()
-    tenderIDdoc = 'tenderID_' + server_id if server_id else 'tenderID'
-    while True:
+class TenderIDAllocator(object):
+    """ Hands out daily tenderID sequence numbers leased in blocks.
+
+    Each lease reserves ``block_size`` numbers in the ``tenderID`` counter
+    document with a single write, so concurrent workers do not fight over
+    the counter for every created tender. Unused numbers are given back on
+    day rollover and on ``release`` if no other worker leased after us.
+    """
+
+    def __init__(self, block_size=1):
+        self.block_size = block_size
+        self.leases = {}
+        self.lock = Lock()
+
+    def lease(self, db, doc_id, key):
+        while True:
+            try:
+                counter = db.get(doc_id, {'_id': doc_id})
+                start = counter.get(key, 1)
+                counter[key] = start + self.block_size
+                db.save(counter)
+            except ResourceConflict:  # pragma: no cover
+                pass
+            except Exception:  # pragma: no cover
+                sleep(1)
+            else:
+                return {'db': db, 'key': key, 'next': start, 'stop': start + self.block_size}
+
+    def return_lease(self, doc_id, lease):
+        if lease['next'] >= lease['stop']:
+            return
+        db = lease['db']
         try:
-            tenderID = db.get(tenderIDdoc, {'_id': tenderIDdoc})
-            index = tenderID.get(key, 1)
-            tenderID[key] = index + 1
-            db.save(tenderID)
-        except ResourceConflict:  # pragma: no cover
-            pass
+            counter = db.get(doc_id)
+            if counter and counter.get(lease['key']) == lease['stop']:
+                counter[lease['key']] = lease['next']
+                db.save(counter)
         except Exception:  # pragma: no cover
-            sleep(1)
-        else:
-            break
+            # counter was moved by other worker, unused numbers stay as a gap
+            pass
+
+    def next_index(self, db, doc_id, key):
+        with self.lock:
+            lease_id = (getattr(db, 'name', None), doc_id)
+            lease = self.leases.get(lease_id)
+            if lease and lease['key'] != key:
+                self.return_lease(doc_id, lease)
+                lease = None
+            if not lease or lease['next'] >= lease['stop']:
+                lease = self.leases[lease_id] = self.lease(db, doc_id, key)
+            index = lease['next']
+            lease['next'] += 1
+            return index
+
+    def release(self):
+        with self.lock:
+            for (_, doc_id), lease in self.leases.items():
+                self.return_lease(doc_id, lease)
+            self.leases.clear()
+
+
+TENDER_ID_ALLOCATOR = TenderIDAllocator()
+
+
+def generate_tender_id(ctime, db, server_id='', allocator=None):
+    key = ctime.date().isoformat()
+    tenderIDdoc = 'tenderID_' + server_id if server_id else 'tenderID'
+    index = (allocator or TENDER_ID_ALLOCATOR).next_index(db, tenderIDdoc, key)
     return 'UA-{:04}-{:02}-{:02}-{:06}{}'.format(ctime.year,
                                                  ctime.month,
                                                  ctime.day,
@@ -66,18 +172,1026 @@ def generate_tender_id(ctime, db, server_id=''):
 
 
 def tender_serialize(request, tender_data, fields):
-    tender = request.tender_from_data(tender_data, raise_error=False)
+    tender = request.tender_from_data(tender_data, raise_error=False, lazy=True)
     if tender is None:
         return dict([(i, tender_data.get(i, '')) for i in ['procurementMethodType', 'dateModified', 'id']])
     tender.__parent__ = request.context
-    return dict([(i, j) for i, j in tender.serialize(tender.status).items() if i in fields])
+    return serialize_fields(tender, tender.status, get_serialized_fields(type(tender), fields))
+
+
+def tender_listing_serialize(request, tender_data, fields):
+    """ Same as ``tender_serialize``, but stored values are used as they are.
+
+    Only the fields that may be exported differently from how they are
+    stored (serializables, defaults, nested role filtering) are taken from
+    a lazy model, which is not built at all if there are no such fields.
+    """
+    model_class = tender_from_data(request, tender_data, raise_error=False, create=False)
+    if model_class is None:
+        return dict([(i, tender_data.get(i, '')) for i in ['procurementMethodType', 'dateModified', 'id']])
+    status = tender_data.get('status') or getattr(model_class._fields.get('status'), 'default', None)
+    data = {}
+    if 'id' in fields and tender_data.get('_id'):
+        # doc_id serializable
+        data['id'] = tender_data['_id']
+        fields = [i for i in fields if i != 'id']
+    data, rest = prune_fields(model_class, tender_data, status, get_serialized_fields(model_class, fields), data)
+    if not rest:
+        return data
+    tender = lazy_model(model_class, tender_data)
+    tender.__parent__ = request.context
+    return serialize_fields(tender, status, rest, data)
+
+
+def prune_fields(model_class, raw, role, fields, data):
+    """ Copies values of ``fields`` that are exported with the ``role`` the way they are stored.
+
+    Returns the data and the fields to be exported from the model.
+    """
+    gottago = get_role_filter(model_class, role)
+    exported = get_volatile_fields(model_class).union(get_role_fields(model_class, role))
+    rest = set()
+    for field_name in fields:
+        field = model_class._fields.get(field_name)
+        value = field and raw.get(field.serialized_name or field_name)
+        if field is None or field_name in exported or value in (None, [], {}):
+            rest.add(field_name)
+        elif not gottago(field_name, value):
+            data[field.serialized_name or field_name] = value
+    return data, rest
+
+
+def fetch_docs(db, doc_ids):
+    """ Documents by ids with a single request, missing ones are skipped. """
+    if not doc_ids:
+        return {}
+    return dict([
+        (row.id, row.doc)
+        for row in db.view('_all_docs', keys=list(doc_ids), include_docs=True)
+        if row.doc
+    ])
+
+
+def resolving(method):
+    def wrapper(self, *args, **kwargs):
+        self.resolve_all()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+class LazyModelData(dict):
+    """ Model data with compound fields converted from raw data on first access. """
+
+    def __init__(self, model, data, pending):
+        dict.__init__(self, data)
+        self.model = model
+        self.pending = pending
+
+    def resolve(self, key):
+        raw = self.pending.pop(key, None)
+        if raw is not None:
+            context = dict.fromkeys([i for i in self.model._fields if i != key])
+            dict.__setitem__(self, key, self.model.convert(raw, context=context)[key])
+
+    def resolve_all(self):
+        for key in self.pending.keys():
+            self.resolve(key)
+
+    def __getitem__(self, key):
+        self.resolve(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        self.resolve(key)
+        return dict.get(self, key, default)
+
+    def __setitem__(self, key, value):
+        self.pending.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.pending.pop(key, None)
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *args):
+        self.resolve(key)
+        return dict.pop(self, key, *args)
+
+    items = resolving(dict.items)
+    iteritems = resolving(dict.iteritems)
+    values = resolving(dict.values)
+    itervalues = resolving(dict.itervalues)
+    copy = resolving(dict.copy)
+    update = resolving(dict.update)
+    setdefault = resolving(dict.setdefault)
+    popitem = resolving(dict.popitem)
+    __eq__ = resolving(dict.__eq__)
+    __ne__ = resolving(dict.__ne__)
+    __repr__ = resolving(dict.__repr__)
+
+
+COMPOUND_FIELDS = {}
+
+
+def get_compound_fields(model_class):
+    """ Compound fields of the model with raw data keys they are loaded from. """
+    if model_class not in COMPOUND_FIELDS:
+        compound_fields = {}
+        for name, field in model_class._fields.items():
+            if isinstance(field, MultiType):
+                keys = field.deserialize_from or []
+                keys = [keys] if isinstance(keys, basestring) else list(keys)
+                compound_fields[name] = set(keys + [field.serialized_name or name, name])
+        COMPOUND_FIELDS[model_class] = compound_fields
+    return COMPOUND_FIELDS[model_class]
+
+
+def get_simple_data(model_class, data):
+    """ Raw data without the keys of compound fields. """
+    lazy_keys = set().union(*get_compound_fields(model_class).values())
+    return dict([(k, v) for k, v in data.items() if k not in lazy_keys])
+
+
+def set_lazy_data(model, data):
+    """ Makes compound fields of the model built from simple fields of ``data`` converted on access. """
+    pending = {}
+    for name, keys in get_compound_fields(type(model)).items():
+        raw = dict([(k, data[k]) for k in keys if data.get(k) is not None])
+        if raw:
+            pending[name] = raw
+    model._initial = data
+    model._data = LazyModelData(model, model._data, pending)
+    return model
+
+
+def lazy_model(model_class, data):
+    """ Model built from ``data`` converting only simple fields up front.
+
+    Compound fields (nested models, lists, dicts) are converted on first
+    access, so reading a few fields of the model stays cheap.
+    """
+    return set_lazy_data(model_class(get_simple_data(model_class, data)), data)
+
+
+def get_lazy_items(parent, name, item_id):
+    """ Items with ``item_id`` of the list field ``name`` of a lazy model.
+
+    While the field is not converted only the matching raw items are
+    converted, as lazy models, and the rest of the list stays raw. Returns
+    None when the model is not lazy, the field is converted already or its
+    items are not models.
+    """
+    data = getattr(parent, '_data', None)
+    if not isinstance(data, LazyModelData) or name not in data.pending:
+        return
+    field = type(parent)._fields[name]
+    model_class = getattr(getattr(field, 'field', None), 'model_class', None)
+    if model_class is None:
+        return
+    raw_lists = [(k, v) for k, v in data.pending[name].items() if isinstance(v, list)]
+    if not raw_lists:
+        return
+    key, values = raw_lists[0]
+    converted = parent.__dict__.setdefault('_lazy_items', {})
+    context = dict.fromkeys([i for i in parent._fields if i != name])
+    items = []
+    for index in get_id_index(parent, name, values).get(item_id, []):
+        if (name, index) not in converted:
+            raw = values[index]
+            item = parent.convert({key: [get_simple_data(model_class, raw)]}, context=context)[name][0]
+            converted[(name, index)] = set_lazy_data(item, raw)
+        items.append(converted[(name, index)])
+    return items
+
+
+def get_id_index(parent, name, values):
+    """ Positions of the items (models or raw dicts) of the ``values`` list by id.
+
+    The index is kept on the parent and rebuilt when the list is replaced
+    or its length changes.
+    """
+    indexes = parent.__dict__.setdefault('_id_indexes', {})
+    index = indexes.get(name)
+    if index is None or index[0] is not values or index[1] != len(values):
+        positions = {}
+        for position, value in enumerate(values):
+            item_id = value.get('id') if isinstance(value, dict) else getattr(value, 'id', None)
+            positions.setdefault(item_id, []).append(position)
+        index = indexes[name] = (values, len(values), positions)
+    return index[2]
+
+
+def get_items(parent, name, item_id):
+    """ Items of the list field ``name`` with ``item_id`` in the list order, document versions go oldest first. """
+    items = get_lazy_items(parent, name, item_id)
+    if items is not None:
+        return items
+    values = getattr(parent, name, None) or []
+    return [values[i] for i in get_id_index(parent, name, values).get(item_id, [])]
+
+
+def get_serialized_fields(model_class, serialized_names):
+    return set([
+        name
+        for name, field in model_class._fields.items() + model_class._serializables.items()
+        if (field.serialized_name or name) in serialized_names
+    ])
+
+
+class RevisionsStorage(object):
+    """ Moves old tender revisions out of the tender document.
+
+    The first revision (the tender creation) and the last ``inline_limit``
+    revisions stay in the tender, older ones are moved to append-only chunk
+    documents once there are at least ``chunk_size`` of them. All
+    revisions stay inline when ``inline_limit`` is not set.
+    """
+    doc_type = 'TenderRevisions'
+
+    def __init__(self, inline_limit=None, chunk_size=None):
+        self.inline_limit = inline_limit
+        self.chunk_size = chunk_size
+
+    def get_chunk_prefix(self, tender_id):
+        return u'{}_revisions_'.format(tender_id)
+
+    def get_chunk_id(self, tender_id, revision):
+        # revisions keep the tender _rev they were made on, its number orders chunks
+        return u'{}{:010d}'.format(self.get_chunk_prefix(tender_id), int((revision.get('rev') or '0').split('-')[0]))
+
+    def get_overflow(self, revisions):
+        if self.inline_limit is None:
+            return 0
+        overflow = len(revisions) - 1 - self.inline_limit
+        return overflow if overflow > 0 and overflow >= (self.chunk_size or 1) else 0
+
+    def save_chunk(self, db, tender_id, revisions):
+        doc = {
+            '_id': self.get_chunk_id(tender_id, revisions[0]),
+            'doc_type': self.doc_type,
+            'tender_id': tender_id,
+            'revisions': revisions,
+        }
+        doc['_id'], doc['_rev'] = db.save(doc)
+        return doc
+
+    def offload(self, db, tender):
+        """ Moves revisions over the limit to a new chunk document.
+
+        Returns the chunk document or None if nothing was moved.
+        """
+        overflow = self.get_overflow(tender.revisions)
+        if not overflow:
+            return
+        revisions = tender.revisions[1:overflow + 1]
+        doc = self.save_chunk(db, tender.id, [i.to_primitive() for i in revisions])
+        tender.revisions = tender.revisions[:1] + tender.revisions[overflow + 1:]
+        return doc
+
+    def restore(self, db, tender, doc):
+        """ Returns revisions of the chunk back to the tender and removes the chunk. """
+        model_class = type(tender).revisions.model_class
+        tender.revisions = tender.revisions[:1] + [model_class(i) for i in doc['revisions']] + tender.revisions[1:]
+        try:
+            db.delete(doc)
+        except Exception:  # pragma: no cover
+            LOGGER.warning('Failed to remove revisions chunk {}'.format(doc['_id']))
+
+    def offload_doc(self, db, doc):
+        """ Moves revisions over the limit out of the raw tender document. """
+        overflow = self.get_overflow(doc.get('revisions', []))
+        if not overflow:
+            return False
+        chunk = self.save_chunk(db, doc['_id'], doc['revisions'][1:overflow + 1])
+        doc['revisions'] = doc['revisions'][:1] + doc['revisions'][overflow + 1:]
+        try:
+            db.save(doc)
+        except ResourceConflict:
+            db.delete(chunk)
+            return False
+        return True
+
+    def load(self, db, tender):
+        """ All revisions of the tender, the offloaded ones included. """
+        revisions = list(tender.revisions)
+        if not revisions:
+            return revisions
+        model_class = type(tender).revisions.model_class
+        prefix = self.get_chunk_prefix(tender.id)
+        offloaded = [
+            model_class(i)
+            for row in db.view('_all_docs', startkey=prefix, endkey=prefix + u'\ufff0', include_docs=True)
+            if row.doc and row.doc.get('doc_type') == self.doc_type
+            for i in row.doc['revisions']
+        ]
+        return revisions[:1] + offloaded + revisions[1:]
+
+
+REVISIONS_STORAGE = RevisionsStorage()
+
+
+def get_tender_revisions(request, tender=None):
+    """ Full revisions history of the tender, loaded on demand. """
+    return REVISIONS_STORAGE.load(request.registry.db, tender or request.validated['tender'])
+
+
+class ListingProjections(object):
+    """ Compact listing documents kept next to tenders.
+
+    Every saved tender gets a ``TenderListing`` document with the fields
+    the listing views emit, so listings are served by small views over those
+    documents instead of mapping full tenders. Nothing is written unless
+    ``enabled``.
+
+    Documents carry the ``version`` of the fields they were projected with.
+    Listings are served from them once the backfill of existing tenders for
+    that version is recorded in a local document (see ``is_ready``), until
+    then and every ``check_interval`` seconds the tenders views are used.
+    """
+    doc_type = 'TenderListing'
+    marker_id = '_local/tenders_listing_projections'
+    check_interval = 60
+
+    def __init__(self, fields=CHANGES_FIELDS, enabled=False):
+        self.fields = fields
+        self.enabled = enabled
+        self.ready = False
+        self.checked = None
+
+    @property
+    def version(self):
+        # fields are configured after the instance is created
+        return get_listing_version(self.fields)
+
+    def get_doc_id(self, tender_id):
+        return u'{}_listing'.format(tender_id)
+
+    def is_ready(self, db):
+        """ Whether projections of all tenders are of the current version. """
+        if not self.enabled:
+            return False
+        now = get_now()
+        if not self.ready and (self.checked is None or (now - self.checked).total_seconds() > self.check_interval):
+            self.checked = now
+            marker = db.get(self.marker_id)
+            self.ready = bool(marker) and marker.get('version') == self.version
+        return self.ready
+
+    def mark_ready(self, db):
+        """ Records that projections of all tenders are of the current version. """
+        marker = db.get(self.marker_id) or {'_id': self.marker_id}
+        if marker.get('version') == self.version:
+            return
+        marker['version'] = self.version
+        try:
+            db.save(marker)
+        except ResourceConflict:
+            # recorded by another worker at the same time
+            return
+
+    def project(self, tender_id, data):
+        """ The listing document for the tender data (as stored). """
+        return {
+            '_id': self.get_doc_id(tender_id),
+            'doc_type': self.doc_type,
+            'tender_id': tender_id,
+            'version': self.version,
+            'status': data.get('status'),
+            'mode': data.get('mode'),
+            'dateModified': data.get('dateModified'),
+            # the views used to copy the values that are true in javascript
+            'data': dict([
+                (i, data[i])
+                for i in self.fields
+                if data.get(i) or isinstance(data.get(i), (list, dict))
+            ]),
+        }
+
+    def save(self, db, tender_id, data):
+        doc = self.project(tender_id, data)
+        current = db.get(doc['_id'])
+        if current:
+            if all([current.get(i) == j for i, j in doc.items()]):
+                return False
+            doc['_rev'] = current['_rev']
+        db.save(doc)
+        return True
+
+    def save_tender(self, db, tender):
+        if not self.enabled:
+            return False
+        fields = set(self.fields).union(['status', 'mode', 'dateModified'])
+        return self.save(db, tender.id, export_fields(tender, None, fields, {}))
+
+
+LISTING_PROJECTIONS = ListingProjections()
+
+
+class NextCheckIndex(object):
+    """ Time ordered index of the tenders to be checked by the chronograph.
+
+    Every saved tender with ``next_check`` gets a ``TenderNextCheck`` document,
+    the ``next_check`` view keys those by (``next_check`` in UTC, tender id),
+    so due tenders are read from the start of the view and polling costs
+    depend on the number of due tenders only. Nothing is written unless
+    ``enabled``.
+    """
+    doc_type = 'TenderNextCheck'
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+
+    def get_doc_id(self, tender_id):
+        return u'{}_next_check'.format(tender_id)
+
+    def get_key(self, value):
+        """ ``next_check`` in UTC, keys of different offsets sort in time order. """
+        if isinstance(value, basestring):
+            value = parse_date(value, None)
+        if value.tzinfo is None:
+            value = TZ.localize(value)
+        return value.astimezone(utc).isoformat()
+
+    def project(self, tender_id, data):
+        """ The index document for the tender data (as stored), None without ``next_check``. """
+        if not data.get('next_check'):
+            return
+        return {
+            '_id': self.get_doc_id(tender_id),
+            'doc_type': self.doc_type,
+            'tender_id': tender_id,
+            'mode': data.get('mode'),
+            'next_check': self.get_key(data['next_check']),
+        }
+
+    def save(self, db, tender_id, data):
+        doc = self.project(tender_id, data)
+        current = db.get(self.get_doc_id(tender_id))
+        if doc is None:
+            if current:
+                db.delete(current)
+                return True
+            return False
+        if current:
+            if all([current.get(i) == j for i, j in doc.items()]):
+                return False
+            doc['_rev'] = current['_rev']
+        db.save(doc)
+        return True
+
+    def save_tender(self, db, tender):
+        if not self.enabled:
+            return False
+        return self.save(db, tender.id, export_fields(tender, None, ['next_check', 'mode'], {}))
+
+    def get_due(self, db, limit, offset=None, now=None, stale=None):
+        """ Rows of the tenders due by ``now``, keyed by (next_check, tender id).
+
+        ``offset`` is the key of the last row of the previous page, the row
+        itself is not returned again.
+        """
+        options = {'endkey': [self.get_key(now or get_now()), {}], 'limit': limit + 1 if offset else limit}
+        if offset:
+            options['startkey'] = list(offset)
+        if stale:
+            options['stale'] = stale
+        rows = [i for i in tenders_next_check_view(db, **options) if not offset or i.key != list(offset)]
+        return rows[:limit]
+
+
+NEXT_CHECK_INDEX = NextCheckIndex()
+
+
+def get_time_bucket(doc, interval, model_class=None):
+    """ Time bucket of the time dependent serializables of the tender document.
+
+    ``shouldStartAfter`` of auction periods that started and have not ended
+    depends on the current time, as do serializables of tenders in the
+    ``time_dependent_statuses`` of the model class (``next_check``, for
+    example). Such documents get a new bucket every ``interval`` seconds,
+    others are always in the bucket 0.
+    """
+    periods = [doc.get('auctionPeriod')] + [i.get('auctionPeriod') for i in doc.get('lots') or []]
+    if interval and (doc.get('status') in getattr(model_class, 'time_dependent_statuses', ()) or
+                     any([i and i.get('startDate') and not i.get('endDate') for i in periods])):
+        return timegm(get_now().utctimetuple()) // interval
+    return 0
+
+
+class SerializationCache(object):
+    """ LRU cache of tender serializations keyed by (id, rev, role, time bucket).
+
+    Keeps up to ``size`` serializations of this process, ``shared`` is an
+    optional memcached compatible client (``get`` and ``set``) shared by
+    processes. Serializations are cached as JSON, every lookup gets its own
+    copy decoded from it, misses included, so the data looks the same whether
+    it came from the cache or not. Nothing is cached unless ``size`` is set.
+    """
+
+    def __init__(self, size=0, time_bucket=60, shared=None, report_interval=10000):
+        self.size = size
+        self.time_bucket = time_bucket
+        self.shared = shared
+        self.report_interval = report_interval
+        self.items = OrderedDict()
+        self.lock = Lock()
+        self.hits = self.shared_hits = self.misses = self.evictions = 0
+
+    @property
+    def enabled(self):
+        return bool(self.size)
+
+    def bind(self, tender, doc):
+        """ Marks the tender built from the stored document as cacheable. """
+        if self.enabled:
+            tender.__dict__['_serialization_key'] = (doc['_id'], doc['_rev'], get_time_bucket(doc, self.time_bucket, type(tender)))
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.pop(key, None)
+            if value is not None:
+                self.items[key] = value
+                self.hits += 1
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                with self.lock:
+                    self.shared_hits += 1
+                self.store(key, value)
+        return value
+
+    def store(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def set(self, key, value):
+        self.store(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def serialize(self, model, role, serialize):
+        """ ``serialize(role)`` of the model bound to a stored document, from the cache if possible. """
+        tender_id, rev, bucket = model.__dict__['_serialization_key']
+        key = 'tender:{}:{}:{}:{}'.format(tender_id, rev, role, bucket)
+        value = self.get(key)
+        if value is None:
+            with self.lock:
+                self.misses += 1
+            value = dumps(serialize(role))
+            self.set(key, value)
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+        if self.report_interval and lookups % self.report_interval == 0:
+            LOGGER.info('Serialization cache: {}'.format(', '.join(['{}={}'.format(i, j) for i, j in sorted(self.metrics().items())])),
+                        extra={'MESSAGE_ID': 'serialization_cache_metrics'})
+        return loads(value)
+
+    def metrics(self):
+        with self.lock:
+            size, hits, shared_hits, misses, evictions = (
+                len(self.items), self.hits, self.shared_hits, self.misses, self.evictions)
+        lookups = hits + shared_hits + misses
+        return {
+            'size': size,
+            'hits': hits,
+            'shared_hits': shared_hits,
+            'misses': misses,
+            'evictions': evictions,
+            'hit_rate': round(float(hits + shared_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = self.shared_hits = self.misses = self.evictions = 0
+
+
+SERIALIZATION_CACHE = SerializationCache()
+
+
+class RevisionCache(object):
+    """ Values computed from stored tenders, keyed by model class, tender id and revision.
+
+    Models that were not stored yet and models that are being changed
+    (see ``track_changes``) are not cached.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, model, name, build):
+        rev = model.rev
+        if not rev or not self.size or '_tracked_fields' in model.__dict__:
+            return build()
+        key = (type(model), model.id, rev, name)
+        with self.lock:
+            value = self.items.pop(key, None)
+            if value is not None:
+                self.items[key] = value
+        if value is None:
+            value = build()
+            with self.lock:
+                self.items[key] = value
+                while len(self.items) > self.size:
+                    self.items.popitem(last=False)
+        return value
+
+
+REVISION_CACHE = RevisionCache()
+
+
+def memoize(model, name, key, build):
+    """ ``build()`` kept in the model while ``key`` stays the same. """
+    cached = model.__dict__.get(name)
+    if cached is None or cached[0] != key:
+        cached = model.__dict__[name] = (key, build())
+    return cached[1]
+
+
+def get_owners(model, name):
+    """ (owner, owner_token) of the items of the list field, read from raw data while the field is not converted. """
+    data = getattr(model, '_data', None)
+    if isinstance(data, LazyModelData) and name in data.pending:
+        values = [v for v in data.pending[name].values() if isinstance(v, list)][:1]
+        return [(i.get('owner'), i.get('owner_token')) for i in (values[0] if values else []) if isinstance(i, dict)]
+    return [(i.owner, i.owner_token) for i in getattr(model, name) or []]
+
+
+def copy_acl(acl):
+    """ A copy of the cached ACL sharing its index, so the cache is not changed through it. """
+    return ACL(acl, acl.get_index())
+
+
+def iter_json_listing(items, envelope, pretty=False, callback=None, chunk_size=2 ** 16):
+    """ Yields ``{"data": [items...], ...envelope()}`` as JSON in chunks.
+
+    ``envelope`` is called once ``items`` are exhausted, so it can describe
+    the page that has been written. ``callback`` wraps the JSON for JSONP.
+    """
+    if pretty:
+        def encode(value, level):
+            return dumps(value, indent=4, separators=(',', ': ')).replace('\n', '\n' + ' ' * 4 * level)
+        head, item_sep, data_end, key_sep, end = '{\n    "data": [', ',', '\n    ]', ',\n    ', '\n}'
+        item_prefix = '\n' + ' ' * 8
+    else:
+        def encode(value, level):
+            return dumps(value)
+        head, item_sep, data_end, key_sep, end = '{"data": [', ', ', ']', ', ', '}'
+        item_prefix = ''
+    chunk = ['{}({}'.format(callback, head) if callback else head]
+    size = 0
+    empty = True
+    for item in items:
+        chunk.append('{}{}{}'.format('' if empty else item_sep, item_prefix, encode(item, 2)))
+        empty = False
+        size += len(chunk[-1])
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    chunk.append(']' if empty else data_end)
+    for key, value in sorted(envelope().items()):
+        chunk.append('{}{}: {}'.format(key_sep, dumps(key), encode(value, 1)))
+    chunk.append(end + (');' if callback else ''))
+    yield ''.join(chunk)
+
+
+def get_role_filter(model_class, role):
+    roles = model_class._options.roles
+    if role in roles:
+        return roles[role]
+    elif role:
+        raise ValueError(u'%s Model has no role "%s"' % (model_class.__name__, role))
+    return roles.get('default', wholelist())
+
+
+def serialize_fields(model, role, fields, data=None):
+    """ Exports only ``fields`` of the model the same way ``model.serialize(role)`` does.
+
+    Exported values are put into ``data``, fields that are not exported
+    (skipped by the role or empty) are removed from it.
+    """
+    if hasattr(model, 'indexed'):
+        with model.indexed():
+            return export_fields(model, role, fields, {} if data is None else data)
+    return export_fields(model, role, fields, {} if data is None else data)
+
+
+class FieldsSubset(object):
+    """ The model class limited to some of its fields, for ``schematics.transforms.export_loop``. """
+
+    def __init__(self, model_class, fields):
+        self.__name__ = model_class.__name__
+        self._options = model_class._options
+        self._fields = dict([(k, v) for k, v in model_class._fields.items() if k in fields])
+        self._serializables = dict([(k, v) for k, v in model_class._serializables.items() if k in fields])
+
+
+def export_fields(model, role, fields, data):
+    cls = FieldsSubset(type(model), fields)
+    exported = export_loop(cls, model, lambda f, v: f.to_primitive(v), role=role, raise_error_on_role=True) or {}
+    for field_name, field in cls._fields.items() + cls._serializables.items():
+        serialized_name = field.serialized_name or field_name
+        if serialized_name in exported:
+            data[serialized_name] = exported[serialized_name]
+        else:
+            data.pop(serialized_name, None)
+    return data
+
+
+def is_empty_export(value):
+    return value is None or value == [] or value == {}
+
+
+def is_stored_as_exported(field, value):
+    """ Whether the stored (not None) value is what the export of the field gives.
+
+    Legacy documents may have unknown keys, lack defaults, keep empty values
+    or values in other formats, their export differs from the stored data.
+    """
+    if isinstance(field, ListType):
+        return isinstance(value, list) and bool(value) and all([
+            i is not None and is_stored_as_exported(field.field, i) for i in value
+        ])
+    elif isinstance(field, DictType):
+        return isinstance(value, dict) and bool(value) and all([
+            i is not None and is_stored_as_exported(field.field, i) for i in value.values()
+        ])
+    elif isinstance(field, ModelType):
+        return isinstance(value, dict) and bool(value) and is_stored_model(field.model_class, value)
+    elif isinstance(field, StringType):
+        return isinstance(value, basestring)
+    try:
+        return field.to_primitive(field.to_native(value)) == value
+    except Exception:
+        return False
+
+
+def is_stored_model(model_class, data):
+    fields = dict([(field.serialized_name or name, field) for name, field in model_class._fields.items()])
+    gottago = model_class._options.roles.get('default')
+    if model_class._serializables or any([i not in fields for i in data]):
+        return False
+    for name, field in fields.items():
+        value = data.get(name)
+        if value is None:
+            if name in data or not is_empty_export(field.default):
+                return False
+        elif gottago and gottago(name, value) or not is_stored_as_exported(field, value):
+            return False
+    return True
+
+
+def get_tender_src(tender, role):
+    """ The stored tender document as ``tender.serialize(role)`` would show it.
+
+    Values are taken from the raw document the tender was loaded from and
+    are shared with it, so they must not be modified. Serializables, fields
+    with nested models that define ``role`` or serializables, and fields
+    whose stored values differ from their export are exported. ``next_check``
+    is the stored one, so that a save moving it forward is not taken for a
+    save without changes.
+    """
+    cls = type(tender)
+    gottago = get_role_filter(cls, role)
+    exported = get_role_fields(cls, role).union(get_volatile_fields(cls))
+    raw = tender._initial or {}
+    src = {}
+    missing = set()
+    for field_name, field in cls._fields.items() + cls._serializables.items():
+        serialized_name = field.serialized_name or field_name
+        value = raw.get(serialized_name)
+        if field_name in exported:
+            missing.add(field_name)
+        elif value is not None:
+            if gottago(field_name, value):
+                continue
+            if is_stored_as_exported(field, value):
+                src[serialized_name] = value
+            else:
+                missing.add(field_name)
+        elif serialized_name in raw or not is_empty_export(field.default):
+            missing.add(field_name)
+    src = serialize_fields(tender, role, missing, src) if missing else src
+    if raw.get('next_check'):
+        src['next_check'] = raw['next_check']
+    return src
+
+
+def iter_field_models(field):
+    if isinstance(field, ModelType):
+        yield field.model_class
+    elif hasattr(field, 'field'):
+        for model_class in iter_field_models(field.field):
+            yield model_class
+
+
+def iter_nested_models(model_class, seen=None):
+    seen = set() if seen is None else seen
+    for cls in [model_class] + model_class._subclasses:
+        if cls in seen:
+            continue
+        seen.add(cls)
+        yield cls
+        for field in cls._fields.values():
+            for i in iter_field_models(field):
+                for nested in iter_nested_models(i, seen):
+                    yield nested
+
+
+def get_nested_fields(model_class, predicate):
+    return set([
+        name
+        for name, field in model_class._fields.items()
+        if any([predicate(cls) for i in iter_field_models(field) for cls in iter_nested_models(i)])
+    ])
+
+
+VOLATILE_FIELDS = {}
+ROLE_FIELDS = {}
+
+
+def get_volatile_fields(model_class):
+    """ Fields which export may change without changes of their own data.
+
+    These are serializables and compound fields that contain serializables
+    somewhere inside, as those may be computed from other parts of the tender.
+    """
+    if model_class not in VOLATILE_FIELDS:
+        VOLATILE_FIELDS[model_class] = set(model_class._serializables).union(
+            get_nested_fields(model_class, lambda cls: cls._serializables))
+    return VOLATILE_FIELDS[model_class]
+
+
+def get_role_fields(model_class, role):
+    """ Compound fields with nested models that define ``role``. """
+    if (model_class, role) not in ROLE_FIELDS:
+        ROLE_FIELDS[(model_class, role)] = get_nested_fields(
+            model_class, lambda cls: role in cls._options.roles)
+    return ROLE_FIELDS[(model_class, role)]
+
+
+def take_snapshot(value):
+    if isinstance(value, Model):
+        return (value, dict([(k, take_snapshot(v)) for k, v in value._data.items() if k != '__parent__']))
+    elif isinstance(value, list):
+        return (value, [take_snapshot(i) for i in value])
+    elif isinstance(value, dict):
+        return deepcopy(value)
+    return value
+
+
+def is_changed(value, snapshot):
+    if isinstance(value, (Model, list)):
+        if not isinstance(snapshot, tuple) or snapshot[0] is not value:
+            return True
+        if isinstance(value, list):
+            return len(value) != len(snapshot[1]) or any([is_changed(i, j) for i, j in zip(value, snapshot[1])])
+        data = dict([(k, v) for k, v in value._data.items() if k != '__parent__'])
+        return set(data) != set(snapshot[1]) or any([is_changed(v, snapshot[1][k]) for k, v in data.items()])
+    return isinstance(snapshot, tuple) or value != snapshot
+
+
+def reading(method):
+    def wrapper(self, *args, **kwargs):
+        self.read_all()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+def assigning(method):
+    def wrapper(self, *args, **kwargs):
+        before = dict(self)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.assigned.update([
+                k for k in set(before).union(self)
+                if k not in self or k not in before or dict.__getitem__(self, k) is not before[k]
+            ])
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+class TrackedModelData(dict):
+    """ Model data remembering the state of the fields as they are first read.
+
+    Assigned (through field setters) and deleted fields are recorded, so
+    values that were never read need no snapshot, they can only be changed
+    by assignment.
+    """
+
+    def __init__(self, data):
+        dict.__init__(self, data)
+        self.snapshots = {}
+        self.assigned = set()
+
+    def read(self, key):
+        if key not in self.snapshots and key not in self.assigned and key != '__parent__' and dict.__contains__(self, key):
+            self.snapshots[key] = take_snapshot(dict.__getitem__(self, key))
+
+    def read_all(self):
+        for key in self.keys():
+            self.read(key)
+
+    def get_changed(self):
+        return set([
+            k
+            for k, v in self.snapshots.items()
+            if k not in self.assigned and is_changed(dict.__getitem__(self, k), v)
+        ]).union(self.assigned)
+
+    def __getitem__(self, key):
+        self.read(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        self.read(key)
+        return dict.get(self, key, default)
+
+    def __setitem__(self, key, value):
+        if not dict.__contains__(self, key) or dict.__getitem__(self, key) is not value:
+            self.assigned.add(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.assigned.add(key)
+        dict.__delitem__(self, key)
+
+    def setdefault(self, key, default=None):
+        self.read(key)
+        if not dict.__contains__(self, key):
+            self.assigned.add(key)
+        return dict.setdefault(self, key, default)
+
+    items = reading(dict.items)
+    iteritems = reading(dict.iteritems)
+    values = reading(dict.values)
+    itervalues = reading(dict.itervalues)
+    copy = reading(dict.copy)
+    __eq__ = reading(dict.__eq__)
+    __ne__ = reading(dict.__ne__)
+    __repr__ = reading(dict.__repr__)
+    update = assigning(dict.update)
+    pop = assigning(dict.pop)
+    popitem = assigning(dict.popitem)
+    clear = assigning(dict.clear)
+
+
+def track_changes(model):
+    """ Starts tracking changes of the model fields.
+
+    The state of a field is remembered when it is first read, the deep walk
+    of ``take_snapshot`` is limited to the fields the request reads.
+    """
+    data = model._data
+    if isinstance(data, LazyModelData):
+        data.resolve_all()
+    model._data = TrackedModelData(data)
+    model.__dict__['_tracked_fields'] = model._data
+
+
+def get_changed_fields(model):
+    """ Names of the fields that were changed since ``track_changes``.
+
+    Returns None when changes of the model are not tracked.
+    """
+    tracked = model.__dict__.get('_tracked_fields')
+    if tracked is None:
+        return
+    if tracked is not model._data:
+        # the data was replaced as a whole
+        return set(tracked).union(model._data)
+    return tracked.get_changed()
+
+
+def serialize_changes(model, role, src):
+    """ Export of the model for diffing against ``src``, the export of its tracked state.
+
+    Only changed fields and fields with serializables are exported, the rest
+    of the data is taken from ``src`` as is. Returns None when changes of
+    the model are not tracked.
+    """
+    changed = get_changed_fields(model)
+    if changed is None:
+        return
+    return serialize_fields(model, role, changed.union(get_volatile_fields(type(model))), dict(src))
 
 
 def save_tender(request):
     tender = request.validated['tender']
     if tender.mode == u'test':
         set_modetest_titles(tender)
-    patch = get_revision_changes(tender.serialize("plain"), request.validated['tender_src'])
+    tender_src = request.validated['tender_src']
+    data = tender_src and serialize_changes(tender, "plain", tender_src)
+    patch = get_revision_changes(data or tender.serialize("plain"), tender_src)
     if patch:
         now = get_now()
         status_changes = [
@@ -101,10 +1215,13 @@ def save_tender(request):
             'changes': patch,
             'rev': tender.rev
         }))
+        offloaded = None
         old_dateModified = tender.dateModified
         if getattr(tender, 'modified', True):
             tender.dateModified = now
         try:
+            # chunk conflicts come from concurrent saves of the same revision
+            offloaded = REVISIONS_STORAGE.offload(request.registry.db, tender)
             tender.store(request.registry.db)
         except ModelValidationError, e:
             for i in e.message:
@@ -118,7 +1235,19 @@ def save_tender(request):
         else:
             LOGGER.info('Saved tender {}: dateModified {} -> {}'.format(tender.id, old_dateModified and old_dateModified.isoformat(), tender.dateModified.isoformat()),
                         extra=context_unpack(request, {'MESSAGE_ID': 'save_tender'}, {'RESULT': tender.rev}))
+            try:
+                LISTING_PROJECTIONS.save_tender(request.registry.db, tender)
+            except Exception, e:  # pragma: no cover
+                LOGGER.warning('Failed to save listing of tender {}: {}'.format(tender.id, e),
+                               extra=context_unpack(request, {'MESSAGE_ID': 'save_tender_listing_failed'}))
+            try:
+                NEXT_CHECK_INDEX.save_tender(request.registry.db, tender)
+            except Exception, e:  # pragma: no cover
+                LOGGER.warning('Failed to index next check of tender {}: {}'.format(tender.id, e),
+                               extra=context_unpack(request, {'MESSAGE_ID': 'save_tender_next_check_failed'}))
             return True
+        if offloaded:
+            REVISIONS_STORAGE.restore(request.registry.db, tender, offloaded)
 
 
 def apply_patch(request, data=None, save=True, src=None):
@@ -138,42 +1267,245 @@ def remove_draft_bids(request):
         tender.bids = [bid for bid in tender.bids if getattr(bid, "status", "active") != "draft"]
 
 
-def cleanup_bids_for_cancelled_lots(tender):  # pragma: no cover
-    cancelled_lots = [i.id for i in tender.lots if i.status == 'cancelled']
-    if cancelled_lots:
-        return
-    cancelled_items = [i.id for i in tender.items if i.relatedLot in cancelled_lots]
-    cancelled_features = [
+def cleanup_bids_for_cancelled_lots(tender, request=None):
+    """ Removes data of the cancelled lots from the bids of the tender.
+
+    Lot values, lot documents and parameters of the lot and item features of
+    the cancelled lots are removed. Once a lot is cancelled, bids without
+    lot values, those left without them and those that never had them, are
+    removed too. Returns what was removed: ids of the cancelled lots and
+    removed bids and the numbers of removed lot values, parameters and
+    documents, the summary is logged with the context of ``request`` when it
+    is given. The removed data is recorded by the revision of the next save,
+    like any other change.
+    """
+    cancelled_lots = set([i.id for i in getattr(tender, 'lots', None) or [] if i.status == 'cancelled'])
+    removed = {'lots': sorted(cancelled_lots), 'bids': [], 'lotValues': 0, 'parameters': 0, 'documents': 0}
+    if not cancelled_lots:
+        return removed
+    cancelled_items = set([i.id for i in getattr(tender, 'items', None) or [] if i.relatedLot in cancelled_lots])
+    cancelled_features = set([
         i.code
-        for i in (tender.features or [])
+        for i in getattr(tender, 'features', None) or []
         if i.featureOf == 'lot' and i.relatedItem in cancelled_lots or i.featureOf == 'item' and i.relatedItem in cancelled_items
-    ]
-    for bid in tender.bids:
-        bid.documents = [i for i in bid.documents if i.documentOf != 'lot' or i.relatedItem not in cancelled_lots]
-        bid.parameters = [i for i in bid.parameters if i.code not in cancelled_features]
-        bid.lotValues = [i for i in bid.lotValues if i.relatedLot not in cancelled_lots]
-        if not bid.lotValues:
-            tender.bids.remove(bid)
+    ])
+    bids = []
+    for bid in getattr(tender, 'bids', None) or []:
+        lotValues = [i for i in bid.lotValues or [] if i.relatedLot not in cancelled_lots]
+        removed['lotValues'] += len(bid.lotValues or []) - len(lotValues)
+        if not lotValues:
+            removed['bids'].append(bid.id)
+            continue
+        if len(lotValues) != len(bid.lotValues):
+            bid.lotValues = lotValues
+        if cancelled_features:
+            parameters = [i for i in bid.parameters or [] if i.code not in cancelled_features]
+            if len(parameters) != len(bid.parameters or []):
+                removed['parameters'] += len(bid.parameters) - len(parameters)
+                bid.parameters = parameters
+        documents = [i for i in bid.documents or [] if i.documentOf != 'lot' or i.relatedItem not in cancelled_lots]
+        if len(documents) != len(bid.documents or []):
+            removed['documents'] += len(bid.documents) - len(documents)
+            bid.documents = documents
+        bids.append(bid)
+    if removed['bids']:
+        tender.bids = bids
+    if request is not None and (removed['bids'] or removed['lotValues'] or removed['parameters'] or removed['documents']):
+        LOGGER.info('Cleaned up bids of cancelled lots {}: removed bids {}, {} lot values, {} parameters, {} documents'.format(
+                    ', '.join(removed['lots']), ', '.join(removed['bids']) or '-',
+                    removed['lotValues'], removed['parameters'], removed['documents']),
+                    extra=context_unpack(request, {'MESSAGE_ID': 'cleanup_bids_for_cancelled_lots'}))
+    return removed
+
+
+class LotState(object):
+    """ State of a lot in a ``TenderStateSummary``, the ``None`` lot is the tender itself. """
+
+    def __init__(self, status=None):
+        self.status = status
+        self.unanswered_questions = 0
+        self.blocking_complaints = 0  # in block_tender_complaint_status
+        self.pending_complaints = 0  # in block_complaint_status
+        self.pending_award_complaints = 0
+        self.pending_cancellations = 0
+        self.active_bids = 0
+        self.awards = []
+        self.stand_still_end = None  # the latest end of award complaint periods
+
+    @property
+    def last_award(self):
+        return self.awards[-1] if self.awards else None
+
+    @property
+    def blocked(self):
+        """ Whether unanswered questions or complaints block the lot. """
+        return bool(self.unanswered_questions or self.blocking_complaints)
+
+
+class TenderStateSummary(object):
+    """ Counters of the tender state collected in one pass over its lists.
+
+    Questions, complaints, awards, bids and cancellations are counted per
+    lot (``lots[None]`` counts the tender level ones), so status checks are
+    dictionary lookups. Like ``TenderIndex`` it is only valid while the
+    tender data does not change.
+    """
+
+    def __init__(self, tender):
+        lots = getattr(tender, 'lots', None) or []
+        self.lots = OrderedDict([(None, LotState(tender.status))] + [(i.id, LotState(i.status)) for i in lots])
+        self.has_lots = bool(lots)
+        self.active_lots = set([i.id for i in lots if i.status == 'active'])
+        item_lots = dict([(i.id, i.relatedLot) for i in getattr(tender, 'items', None) or []])
+        tender_level = self.lots[None]
+
+        self.unanswered_questions = self.active_unanswered_questions = 0
+        for question in getattr(tender, 'questions', None) or []:
+            if question.answer:
+                continue
+            self.unanswered_questions += 1
+            if question.questionOf == 'tender':
+                lot_id, related = None, True
+            elif question.questionOf == 'lot':
+                lot_id = question.relatedItem
+                related = lot_id is not None and lot_id in self.lots
+            elif question.questionOf == 'item':
+                lot_id, related = item_lots.get(question.relatedItem), question.relatedItem in item_lots
+            else:
+                continue
+            if related and lot_id in self.lots:
+                self.lots[lot_id].unanswered_questions += 1
+                if lot_id is None or lot_id in self.active_lots:
+                    self.active_unanswered_questions += 1
+
+        blocking_statuses = getattr(tender, 'block_tender_complaint_status', None) or []
+        pending_statuses = getattr(tender, 'block_complaint_status', None) or []
+        self.blocking_complaints = self.active_blocking_complaints = 0
+        for complaint in getattr(tender, 'complaints', None) or []:
+            state = self.lots.get(complaint.relatedLot or None)
+            if complaint.status in pending_statuses and state:
+                state.pending_complaints += 1
+            if complaint.status in blocking_statuses:
+                self.blocking_complaints += 1
+                if state:
+                    state.blocking_complaints += 1
+                if not complaint.relatedLot or complaint.relatedLot in self.active_lots:
+                    self.active_blocking_complaints += 1
+
+        for award in getattr(tender, 'awards', None) or []:
+            state = self.lots.get(award.lotID or None) or tender_level
+            state.awards.append(award)
+            complaint_period = getattr(award, 'complaintPeriod', None)
+            end = complaint_period and complaint_period.endDate
+            if end and (state.stand_still_end is None or end > state.stand_still_end):
+                state.stand_still_end = end
+            state.pending_award_complaints += len([
+                i for i in getattr(award, 'complaints', None) or [] if i.status in pending_statuses])
+
+        for bid in getattr(tender, 'bids', None) or []:
+            if getattr(bid, 'status', 'active') != 'active':
+                continue
+            tender_level.active_bids += 1
+            for lot_id in set([i.relatedLot for i in getattr(bid, 'lotValues', None) or []]):
+                if lot_id in self.lots:
+                    self.lots[lot_id].active_bids += 1
+
+        for cancellation in getattr(tender, 'cancellations', None) or []:
+            if cancellation.status == 'pending':
+                lot_id = cancellation.relatedLot if cancellation.cancellationOf == 'lot' else None
+                (self.lots.get(lot_id) or tender_level).pending_cancellations += 1
+
+    def lot(self, lot_id=None):
+        return self.lots[lot_id]
+
+    def has_unanswered_questions(self, filter_cancelled_lots=True):
+        if filter_cancelled_lots and self.has_lots:
+            return bool(self.active_unanswered_questions)
+        return bool(self.unanswered_questions)
+
+    def has_unanswered_complaints(self, filter_cancelled_lots=True):
+        if filter_cancelled_lots and self.has_lots:
+            return bool(self.active_blocking_complaints)
+        return bool(self.blocking_complaints)
+
+
+def get_state_summary(tender):
+    """ The summary shared by the current ``BaseTender.indexed`` block, a new one outside of it. """
+    index = get_tender_index(tender)
+    return index.state_summary if index is not None else TenderStateSummary(tender)
+
+
+def get_active_lots(tender):
+    return set([i.id for i in getattr(tender, 'lots', None) or [] if i.status == 'active'])
 
 
 def has_unanswered_questions(tender, filter_cancelled_lots=True):
-    if filter_cancelled_lots and tender.lots:
-        active_lots = [l.id for l in tender.lots if l.status == 'active']
-        active_items = [i.id for i in tender.items if not i.relatedLot or i.relatedLot in active_lots]
-        return any([
-            not i.answer
-            for i in tender.questions
-            if i.questionOf == 'tender' or i.questionOf == 'lot' and i.relatedItem in active_lots or i.questionOf == 'item' and i.relatedItem in active_items
-        ])
-    return any([not i.answer for i in tender.questions])
+    index = get_tender_index(tender)
+    if index is not None:
+        return index.state_summary.has_unanswered_questions(filter_cancelled_lots)
+    # outside of indexed blocks only the questions are scanned, as TenderStateSummary counts them
+    questions = [i for i in getattr(tender, 'questions', None) or [] if not i.answer]
+    if not questions or not filter_cancelled_lots or not getattr(tender, 'lots', None):
+        return bool(questions)
+    active_lots = get_active_lots(tender)
+    item_lots = dict([(i.id, i.relatedLot) for i in getattr(tender, 'items', None) or []])
+    for question in questions:
+        if question.questionOf == 'tender':
+            return True
+        elif question.questionOf == 'lot' and question.relatedItem in active_lots:
+            return True
+        elif question.questionOf == 'item' and question.relatedItem in item_lots:
+            lot_id = item_lots[question.relatedItem]
+            if lot_id is None or lot_id in active_lots:
+                return True
+    return False
 
 
 def has_unanswered_complaints(tender, filter_cancelled_lots=True):
-    if filter_cancelled_lots and tender.lots:
-        active_lots = [l.id for l in tender.lots if l.status == 'active']
-        return any([i.status in tender.block_tender_complaint_status for i in tender.complaints if not i.relatedLot \
-                    or (i.relatedLot and i.relatedLot in active_lots)])
-    return any([i.status in tender.block_tender_complaint_status for i in tender.complaints])
+    index = get_tender_index(tender)
+    if index is not None:
+        return index.state_summary.has_unanswered_complaints(filter_cancelled_lots)
+    # outside of indexed blocks only the complaints are scanned, as TenderStateSummary counts them
+    blocking_statuses = getattr(tender, 'block_tender_complaint_status', None) or []
+    complaints = [i for i in getattr(tender, 'complaints', None) or [] if i.status in blocking_statuses]
+    if not complaints or not filter_cancelled_lots or not getattr(tender, 'lots', None):
+        return bool(complaints)
+    active_lots = get_active_lots(tender)
+    return any([not i.relatedLot or i.relatedLot in active_lots for i in complaints])
+
+
+def make_etag(*parts):
+    return md5(dumps(parts)).hexdigest()
+
+
+def check_etag(request, etag, vary=None):
+    """ Answers 304 if the client has the representation, otherwise sets the ETag of the response.
+
+    ``vary`` are the request headers the representation depends on.
+    """
+    if etag in request.if_none_match:
+        response = HTTPNotModified()
+        response.etag = etag
+        if vary:
+            response.vary = vary
+        raise response
+    request.response.etag = etag
+    if vary:
+        request.response.vary = vary
+
+
+def get_tender_etag(request, doc):
+    """ Strong ETag of a tender (sub)resource representation.
+
+    The representation depends on the document revision, the role it is
+    serialized with (the tender status) and the variant requested: path,
+    query (opt_fields, opt_pretty, acc_token, ...) and the principals, which
+    include the user and the token of the X-Access-Token header. Time
+    dependent serializables change it with the time bucket.
+    """
+    model_class = tender_from_data(request, doc, raise_error=False, create=False)
+    return make_etag(doc['_rev'], doc.get('status'), get_time_bucket(doc, SERIALIZATION_CACHE.time_bucket, model_class),
+                     request.path_qs, sorted(request.effective_principals))
 
 
 def extract_tender_adapter(request, tender_id):
@@ -188,7 +1520,13 @@ def extract_tender_adapter(request, tender_id):
         request.errors.status = 404
         raise error_handler(request.errors)
 
-    return request.tender_from_data(doc)
+    # conditional GET is answered before the model is built
+    if request.method in ('GET', 'HEAD') and doc.get('_rev'):
+        check_etag(request, get_tender_etag(request, doc), vary=('Authorization', 'X-Access-Token'))
+        tender = request.tender_from_data(doc, lazy=request.method == 'GET')
+        SERIALIZATION_CACHE.bind(tender, doc)
+        return tender
+    return request.tender_from_data(doc, lazy=request.method == 'GET')
 
 
 def extract_tender(request):
@@ -246,7 +1584,7 @@ def register_tender_procurementMethodType(config, model):
     config.registry.tender_procurementMethodTypes[model.procurementMethodType.default] = model
 
 
-def tender_from_data(request, data, raise_error=True, create=True):
+def tender_from_data(request, data, raise_error=True, create=True, lazy=False):
     procurementMethodType = data.get('procurementMethodType', 'belowThreshold')
     model = request.registry.tender_procurementMethodTypes.get(procurementMethodType)
     if model is None and raise_error:
@@ -255,31 +1593,113 @@ def tender_from_data(request, data, raise_error=True, create=True):
         raise error_handler(request.errors)
     update_logging_context(request, {'tender_type': procurementMethodType})
     if model is not None and create:
-        model = model(data)
+        model = lazy_model(model, data) if lazy else model(data)
     return model
 
 
+def is_holiday(day, working_days=None):
+    """ Whether the date is a day off: a weekend day or a holiday from WORKING_DAYS. """
+    working_days = WORKING_DAYS if working_days is None else working_days
+    key = day.isoformat()
+    return bool(working_days[key]) if key in working_days else day.weekday() in [5, 6]
+
+
+class WorkingDaysCalendar(object):
+    """ Cumulative working day counts for the dates in [start, end).
+
+    ``counts[i]`` is the number of working days before ``start + i`` days, so
+    the n-th working day from a date is found by binary search. Lookups out
+    of the range return None.
+    """
+
+    def __init__(self, working_days, start, end):
+        self.working_days = working_days
+        self.size = len(working_days)
+        self.start = start
+        self.counts = [0]
+        for i in xrange((end - start).days):
+            self.counts.append(self.counts[-1] + (not is_holiday(start + timedelta(i), working_days)))
+
+    def is_actual(self, working_days):
+        return self.working_days is working_days and self.size == len(working_days)
+
+    def index(self, day):
+        index = (day - self.start).days
+        if 0 <= index < len(self.counts) - 1:
+            return index
+
+    def working_day_after(self, day, count):
+        """ The count-th working day after the date. """
+        index = self.index(day)
+        if index is None:
+            return
+        index = bisect_left(self.counts, self.counts[index + 1] + count)
+        if index < len(self.counts):
+            return self.start + timedelta(index - 1)
+
+    def working_day_before(self, day, count):
+        """ The count-th working day before the date. """
+        index = self.index(day)
+        if index is None or self.counts[index] < count:
+            return
+        return self.start + timedelta(bisect_left(self.counts, self.counts[index] - count + 1) - 1)
+
+
+WORKING_DAYS_CALENDAR = []
+
+
+def get_working_days_calendar():
+    """ The calendar compiled from WORKING_DAYS, recompiled when they change. """
+    if not WORKING_DAYS_CALENDAR or not WORKING_DAYS_CALENDAR[0].is_actual(WORKING_DAYS):
+        years = [int(i[:4]) for i in WORKING_DAYS] + [get_now().year]
+        calendar = WorkingDaysCalendar(WORKING_DAYS, date(min(years) - 2, 1, 1), date(max(years) + 10, 1, 1))
+        WORKING_DAYS_CALENDAR[:] = [calendar]
+    return WORKING_DAYS_CALENDAR[0]
+
+
+def calendar_business_date(calendar, date_obj, timedelta_obj):
+    day = date_obj.date()
+    days = abs(timedelta_obj.days)
+    if timedelta_obj > timedelta():
+        if is_holiday(day, calendar.working_days):
+            date_obj = datetime.combine(day, time(0, tzinfo=date_obj.tzinfo))
+            day = calendar.working_day_after(day, 1)
+        if day and days:
+            day = calendar.working_day_after(day, days)
+    else:
+        if is_holiday(day, calendar.working_days):
+            date_obj = datetime.combine(day, time(0, tzinfo=date_obj.tzinfo))
+            day = calendar.working_day_before(day, 1)
+            day = day and day + timedelta(1)
+        if day and days:
+            day = calendar.working_day_before(day, days)
+    if day:
+        return date_obj + timedelta((day - date_obj.date()).days)
+
+
+def iterate_business_date(date_obj, timedelta_obj):
+    step = timedelta(1) if timedelta_obj > timedelta() else -timedelta(1)
+    if is_holiday(date_obj.date()):
+        date_obj = datetime.combine(date_obj.date(), time(0, tzinfo=date_obj.tzinfo))
+        if timedelta_obj > timedelta():
+            date_obj += timedelta(1)
+        while is_holiday(date_obj.date()):
+            date_obj += step
+        if timedelta_obj <= timedelta():
+            date_obj += timedelta(1)
+    for _ in xrange(abs(timedelta_obj.days)):
+        date_obj += step
+        while is_holiday(date_obj.date()):
+            date_obj += step
+    return date_obj
+
+
 def calculate_business_date(date_obj, timedelta_obj, context=None,
                             working_days=False):
-    if context and 'procurementMethodDetails' in context and context['procurementMethodDetails']:
-        re_obj = ACCELERATOR_RE.search(context['procurementMethodDetails'])
-        if re_obj and 'accelerator' in re_obj.groupdict():
-            return date_obj + (timedelta_obj / int(re_obj.groupdict()['accelerator']))
+    accelerator = context and get_sandbox_directives(context).accelerator
+    if accelerator:
+        return date_obj + (timedelta_obj / accelerator)
     if working_days:
-        if timedelta_obj > timedelta():
-            if date_obj.weekday() in [5, 6] and WORKING_DAYS.get(date_obj.date().isoformat(), True) or WORKING_DAYS.get(date_obj.date().isoformat(), False):
-                date_obj = datetime.combine(date_obj.date(), time(0, tzinfo=date_obj.tzinfo)) + timedelta(1)
-                while date_obj.weekday() in [5, 6] and WORKING_DAYS.get(date_obj.date().isoformat(), True) or WORKING_DAYS.get(date_obj.date().isoformat(), False):
-                    date_obj += timedelta(1)
-        else:
-            if date_obj.weekday() in [5, 6] and WORKING_DAYS.get(date_obj.date().isoformat(), True) or WORKING_DAYS.get(date_obj.date().isoformat(), False):
-                date_obj = datetime.combine(date_obj.date(), time(0, tzinfo=date_obj.tzinfo))
-                while date_obj.weekday() in [5, 6] and WORKING_DAYS.get(date_obj.date().isoformat(), True) or WORKING_DAYS.get(date_obj.date().isoformat(), False):
-                    date_obj -= timedelta(1)
-                date_obj += timedelta(1)
-        for _ in xrange(abs(timedelta_obj.days)):
-            date_obj += timedelta(1) if timedelta_obj > timedelta() else -timedelta(1)
-            while date_obj.weekday() in [5, 6] and WORKING_DAYS.get(date_obj.date().isoformat(), True) or WORKING_DAYS.get(date_obj.date().isoformat(), False):
-                date_obj += timedelta(1) if timedelta_obj > timedelta() else -timedelta(1)
-        return date_obj
+        business_date = calendar_business_date(get_working_days_calendar(), date_obj, timedelta_obj)
+        return business_date or iterate_business_date(date_obj, timedelta_obj)
     return date_obj + timedelta_obj
@@ -3,7 +3,9 @@ from openprocurement.api.validation import validate_data, validate_json_data, OP
 from openprocurement.api.constants import SANDBOX_MODE
 from openprocurement.api.utils import get_now  # move
 from openprocurement.api.utils import update_logging_context, error_handler, raise_operation_error, check_document_batch # XXX tender context
-from openprocurement.tender.core.utils import calculate_business_date
+from openprocurement.tender.core.utils import (
+    calculate_business_date, get_tender_index, get_sandbox_directives
+)
 from schematics.exceptions import ValidationError
 
 
@@ -100,7 +102,8 @@ def validate_tender_auction_data(request):
         data = {}
     if request.method == 'POST':
         now = get_now().isoformat()
-        if (SANDBOX_MODE and tender.submissionMethodDetails and tender.submissionMethodDetails in [u'quick(mode:no-auction)', u'quick(mode:fast-forward)']):
+        directives = get_sandbox_directives(tender)
+        if directives.no_auction or directives.fast_forward:
             if tender.lots:
                 data['lots'] = [{'auctionPeriod': {'startDate': now, 'endDate': now}} if i.id == lot_id else {} for i in tender.lots]
             else:
@@ -239,10 +242,13 @@ def validate_patch_lot_data(request):
 
 
 def validate_LotValue_value(tender, relatedLot, value):
-    lots = [i for i in tender.lots if i.id == relatedLot]
-    if not lots:
+    index = get_tender_index(tender)
+    if index is not None:
+        lot = index.lots.get(relatedLot)
+    else:
+        lot = next((i for i in tender.lots if i.id == relatedLot), None)
+    if lot is None:
         return
-    lot = lots[0]
     if lot.value.amount < value.amount:
         raise ValidationError(u"value of bid should be less than value of lot")
     if lot.get('value').currency != value.currency:
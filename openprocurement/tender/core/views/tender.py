@@ -1,20 +1,24 @@
 # -*- coding: utf-8 -*-
 from functools import partial
+from itertools import islice
 from openprocurement.tender.core.events import TenderInitializeEvent
 from openprocurement.tender.core.design import (
-    FIELDS,
+    FIELDS, LISTING_DESIGN,
     tenders_by_dateModified_view, tenders_real_by_dateModified_view,
     tenders_test_by_dateModified_view, tenders_by_local_seq_view,
     tenders_real_by_local_seq_view, tenders_test_by_local_seq_view,
+    tenders_listing_projections_view, ListingView,
 )
 
 from openprocurement.api.utils import (
     get_now, decrypt, encrypt, generate_id, json_view, set_ownership,
-    context_unpack, APIResourceListing
+    context_unpack, APIResourceListing, error_handler
 )
 
 from openprocurement.tender.core.utils import (
-    save_tender, tender_serialize, optendersresource, generate_tender_id
+    save_tender, tender_listing_serialize, optendersresource, generate_tender_id,
+    iter_json_listing, fetch_docs, make_etag, check_etag, LISTING_PROJECTIONS,
+    NEXT_CHECK_INDEX
 )
 
 from openprocurement.tender.core.validation import (
@@ -36,24 +40,225 @@ FEED = {
     u'dateModified': VIEW_MAP,
     u'changes': CHANGES_VIEW_MAP,
 }
+LISTING_VIEW_MAP = dict([
+    (mode, ListingView(tenders_listing_projections_view, u'dateModified', mode, projection=True))
+    for mode in VIEW_MAP
+])
+LISTING_CHANGES_VIEW_MAP = dict([
+    (mode, ListingView(tenders_listing_projections_view, u'changes', mode, projection=True))
+    for mode in CHANGES_VIEW_MAP
+])
+LISTING_FEED = {
+    u'dateModified': LISTING_VIEW_MAP,
+    u'changes': LISTING_CHANGES_VIEW_MAP,
+}
 
 
 @optendersresource(name='Tenders',
                    path='/tenders',
                    description="Open Contracting compatible data exchange format. See http://ocds.open-contracting.org/standard/r/master/#tender for more info")
 class TendersResource(APIResourceListing):
+    fetch_batch_size = 100
 
     def __init__(self, request, context):
         super(TendersResource, self).__init__(request, context)
-        # params for listing
-        self.VIEW_MAP = VIEW_MAP
-        self.CHANGES_VIEW_MAP = CHANGES_VIEW_MAP
-        self.FEED = FEED
-        self.FIELDS = FIELDS
-        self.serialize_func = tender_serialize
+        self.serialize_func = tender_listing_serialize
         self.object_name_for_listing = 'Tenders'
         self.log_message_id = 'tender_list_custom'
 
+    def configure_listing(self):
+        """ Views and fields of the listing, they may need database requests. """
+        if LISTING_PROJECTIONS.is_ready(self.db):
+            self.VIEW_MAP = LISTING_VIEW_MAP
+            self.CHANGES_VIEW_MAP = LISTING_CHANGES_VIEW_MAP
+            self.FEED = LISTING_FEED
+            self.FIELDS = FIELDS
+        else:
+            self.VIEW_MAP = VIEW_MAP
+            self.CHANGES_VIEW_MAP = CHANGES_VIEW_MAP
+            self.FEED = FEED
+            # fields of the listing view version in use
+            self.FIELDS = LISTING_DESIGN.get_fields(self.db)
+
+    @json_view(permission='view_listing')
+    def get(self):
+        self.configure_listing()
+        query = self.get_listing_query()
+        if getattr(self.request.registry, 'listing_etag', False):
+            check_etag(self.request, self.get_listing_etag(query))
+        items, envelope = self.get_listing_page(query)
+        if getattr(self.request.registry, 'listing_streaming', False):
+            return self.stream_listing(items, envelope)
+        data = {'data': list(items)}
+        data.update(envelope())
+        return data
+
+    def get_listing_query(self):
+        """ Listing parameters, parsed the same way as APIResourceListing.get does """
+        params = {}
+        pparams = {}
+        fields = self.request.params.get('opt_fields', '')
+        view_fields = []
+        if fields:
+            params['opt_fields'] = fields
+            pparams['opt_fields'] = fields
+            fields = fields.split(',')
+            view_fields = fields + ['dateModified', 'id']
+        limit = self.request.params.get('limit', '')
+        if limit:
+            params['limit'] = limit
+            pparams['limit'] = limit
+        limit = int(limit) if limit.isdigit() and (100 if fields else 1000) >= int(limit) > 0 else 100
+        descending = bool(self.request.params.get('descending'))
+        offset = self.request.params.get('offset', '')
+        if descending:
+            params['descending'] = 1
+        else:
+            pparams['descending'] = 1
+        feed = self.request.params.get('feed', '')
+        view_map = self.FEED.get(feed, self.VIEW_MAP)
+        changes = view_map is self.CHANGES_VIEW_MAP
+        if feed and feed in self.FEED:
+            params['feed'] = feed
+            pparams['feed'] = feed
+        mode = self.request.params.get('mode', '')
+        if mode and mode in view_map:
+            params['mode'] = mode
+            pparams['mode'] = mode
+        view_limit = limit + 1 if offset else limit
+        if changes:
+            if offset:
+                view_offset = decrypt(self.server.uuid, self.db.name, offset)
+                if view_offset and view_offset.isdigit():
+                    view_offset = int(view_offset)
+                else:
+                    self.request.errors.add('params', 'offset', 'Offset expired/invalid')
+                    self.request.errors.status = 404
+                    raise error_handler(self.request.errors)
+            else:
+                view_offset = 'now' if descending else 0
+        else:
+            view_offset = offset or ('9' if descending else '')
+        list_view = view_map.get(mode, view_map[u''])
+        options = {'limit': view_limit, 'startkey': view_offset, 'descending': descending}
+        if self.update_after:
+            options['stale'] = 'update_after'
+        return {
+            'params': params,
+            'pparams': pparams,
+            'fields': fields,
+            'view_fields': view_fields,
+            'limit': limit,
+            'descending': descending,
+            'offset': offset,
+            'view_offset': view_offset,
+            'changes': changes,
+            'list_view': list_view,
+            'view': partial(list_view, self.db, **options),
+        }
+
+    def get_listing_etag(self, query):
+        """ ETag of the listing page, read before the view is queried.
+
+        Pages change with the database update sequence. Stale queries are
+        served from the index as it is, so the update sequence of the index
+        is used for them, it only changes when the index is updated.
+        """
+        design = query['list_view'].get_design(self.db)
+        if self.update_after:
+            seq = self.db.info(design)['view_index']['update_seq']
+        else:
+            seq = self.db.info()['update_seq']
+        return make_etag(seq, design, self.request.path_qs)
+
+    def iter_listing_results(self, query):
+        """ Yields (listing item, view key) pairs. """
+        view, fields, view_fields = query['view'], query['fields'], query['view_fields']
+        if not fields:
+            for i in view():
+                yield {'id': i.id, 'dateModified': i.value['dateModified'] if query['changes'] else i.key}, i.key
+        elif set(fields).issubset(set(self.FIELDS)):
+            for x in view():
+                values = x.value.items() + [('id', x.id)] + ([] if query['changes'] else [('dateModified', x.key)])
+                yield dict([(i, j) for i, j in values if i in view_fields]), x.key
+        else:
+            self.LOGGER.info('Used custom fields for {} list: {}'.format(self.object_name_for_listing, ','.join(sorted(fields))),
+                             extra=context_unpack(self.request, {'MESSAGE_ID': self.log_message_id}))
+            if not query['list_view'].projection:
+                for i in view(include_docs=True):
+                    yield self.serialize_func(self.request, i[u'doc'], view_fields), i.key
+                return
+            # rows of listing documents, the tenders are fetched by ids a batch at a time
+            rows = view()
+            while True:
+                batch = list(islice(rows, self.fetch_batch_size))
+                if not batch:
+                    return
+                docs = fetch_docs(self.db, [i.id for i in batch])
+                for i in batch:
+                    if i.id in docs:
+                        yield self.serialize_func(self.request, docs[i.id], view_fields), i.key
+
+    def get_listing_page(self, query):
+        """ Listing items iterator and a function that makes the page links.
+
+        The links depend on the iterated rows, so the function has to be
+        called after the items are exhausted.
+        """
+        offset, view_offset = query['offset'], query['view_offset']
+        page = {}
+
+        def items():
+            count = 0
+            for item, key in self.iter_listing_results(query):
+                if not page:
+                    page['first'] = key
+                    if offset and view_offset == key:
+                        page['last'] = key
+                        continue
+                if count == query['limit']:
+                    break
+                count += 1
+                page['last'] = key
+                yield item
+
+        def envelope():
+            params, pparams = query['params'], query['pparams']
+            if page:
+                params['offset'], pparams['offset'] = page['last'], page['first']
+                if offset and view_offset != page['first']:
+                    pparams['offset'] = view_offset
+                if query['changes']:
+                    params['offset'] = encrypt(self.server.uuid, self.db.name, params['offset'])
+                    pparams['offset'] = encrypt(self.server.uuid, self.db.name, pparams['offset'])
+            else:
+                params['offset'] = offset
+                pparams['offset'] = offset
+            data = {
+                'next_page': {
+                    'offset': params['offset'],
+                    'path': self.request.route_path(self.object_name_for_listing, _query=params),
+                    'uri': self.request.route_url(self.object_name_for_listing, _query=params)
+                }
+            }
+            if query['descending'] or offset:
+                data['prev_page'] = {
+                    'offset': pparams['offset'],
+                    'path': self.request.route_path(self.object_name_for_listing, _query=pparams),
+                    'uri': self.request.route_url(self.object_name_for_listing, _query=pparams)
+                }
+            return data
+
+        return items(), envelope
+
+    def stream_listing(self, items, envelope):
+        """ The listing page written to the response while items are iterated. """
+        callback = self.request.params.get('opt_jsonp')
+        response = self.request.response
+        response.content_type = 'application/javascript' if callback else 'application/json'
+        response.app_iter = iter_json_listing(items, envelope, bool(self.request.params.get('opt_pretty')), callback)
+        return response
+
     @json_view(content_type="application/json", permission='create_tender', validators=(validate_tender_data,))
     def post(self):
         """This API request is targeted to creating new Tenders by procuring organizations.
@@ -228,3 +433,44 @@ class TendersResource(APIResourceListing):
             }
 
 
+
+
+@optendersresource(name='DueTenders',
+                   path='/due_tenders',
+                   description="Tenders due to be checked by the chronograph")
+class DueTendersResource(APIResourceListing):
+
+    @json_view(permission='view_due_tenders')
+    def get(self):
+        """ Pages of tenders with ``next_check`` in the past, the earliest checks first.
+
+        Served from the next_check index, so only due tenders are read. The
+        ``offset`` of the next page is the (next_check, id) of the last
+        tender of the page.
+        """
+        if not NEXT_CHECK_INDEX.enabled:
+            self.request.errors.add('url', 'name', 'Not Found')
+            self.request.errors.status = 404
+            raise error_handler(self.request.errors)
+        params = {}
+        limit = self.request.params.get('limit', '')
+        if limit:
+            params['limit'] = limit
+        limit = int(limit) if limit.isdigit() and 1000 >= int(limit) > 0 else 100
+        offset = self.request.params.get('offset', '')
+        view_offset = offset and offset.rsplit('_', 1)
+        if offset and len(view_offset) != 2:
+            self.request.errors.add('params', 'offset', 'Offset expired/invalid')
+            self.request.errors.status = 404
+            raise error_handler(self.request.errors)
+        rows = NEXT_CHECK_INDEX.get_due(self.db, limit, offset=view_offset,
+                                        stale='update_after' if self.update_after else None)
+        params['offset'] = u'{}_{}'.format(*rows[-1].key) if rows else offset
+        return {
+            'data': [{'id': i.key[1], 'next_check': i.key[0]} for i in rows],
+            'next_page': {
+                'offset': params['offset'],
+                'path': self.request.route_path('DueTenders', _query=params),
+                'uri': self.request.route_url('DueTenders', _query=params)
+            }
+        }
@@ -17,14 +17,17 @@ test_requires = requires + [
 docs_requires = requires + [
     'sphinxcontrib-httpdomain',
 ]
+cache_requires = [
+    'python-memcached',
+]
 
 entry_points = {
     'openprocurement.api.plugins': [
         'tender_core = openprocurement.tender.core.includeme:includeme'
     ],
-    # 'openprocurement.tender.core.migrations': [
-        # 'contracts = openprocurement.tender.core.migration:migrate_data'
-    # ]
+    'openprocurement.api.migrations': [
+        'tender_core = openprocurement.tender.core.migration:migrate_data'
+    ]
 }
 
 setup(name='openprocurement.tender.core',
@@ -48,7 +51,7 @@ setup(name='openprocurement.tender.core',
       zip_safe=False,
       install_requires=requires,
       tests_require=test_requires,
-      extras_require={'test': test_requires, 'docs': docs_requires},
+      extras_require={'test': test_requires, 'docs': docs_requires, 'cache': cache_requires},
       test_suite="openprocurement.tender.core.tests.main.suite",
       entry_points=entry_points
       )